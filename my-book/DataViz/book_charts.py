@@ -0,0 +1,366 @@
+# Helpers for the Altair charts in the DataViz notebooks.
+#
+# Importing this module registers the "book_static" data transformer. With
+#
+#     alt.data_transformers.enable('book_static')
+#
+# chart data is no longer inlined into every notebook output. Each distinct
+# dataset is written once to _static/data/ under a name derived from its
+# content, and the Vega-Lite spec only references it by url. The book's
+# _static folder is copied to _build/html/_static when the book is built.
+#
+# prepare_chart() shrinks the data handed to a chart before it is glued:
+# unused columns are dropped and count() aggregations are done in pandas.
+#
+# point_layer() draws the tree locations for the maps. Above a size threshold
+# it switches to grid cells so the full city inventory stays usable.
+#
+# partitioned_data() splits chart rows into one file per value of the columns
+# a selection filters on, the page loads only the files the selection needs.
+
+import copy
+import hashlib
+import json
+import os
+import re
+import urllib.parse
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA_DIR = os.path.join(BOOK_DIR, '_static', 'data')
+# url of DATA_DIR as seen from the pages in DataViz/
+DATA_URL = '../_static/data'
+
+
+def _dump_values(values):
+    # compact and deterministic, so the same rows always give the same file
+    return json.dumps(values, separators=(',', ':'), sort_keys=True,
+                      allow_nan=False, default=str).encode('utf-8')
+
+
+def _write_payload(payload, prefix, data_dir, extension='json'):
+    """Write payload to data_dir under a name derived from its content, return the name."""
+    filename = '{}-{}.{}'.format(prefix, hashlib.sha256(payload).hexdigest()[:20], extension)
+    path = os.path.join(data_dir, filename)
+    # each dataset is only written the first time it is seen
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        # notebooks run in parallel may write the same dataset, give each its own temp file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    return filename
+
+
+def to_static_file(data, data_dir=None, data_url=None):
+    """Write chart data to a content-addressed json file and return a url reference."""
+    data_dir = data_dir or DATA_DIR
+    data_url = DATA_URL if data_url is None else data_url
+    if isinstance(data, dict) and 'url' in data:
+        return data
+    filename = _write_payload(_dump_values(alt.to_values(data)['values']), 'trees', data_dir)
+    return {'url': data_url.rstrip('/') + '/' + filename,
+            'format': {'type': 'json'}}
+
+
+alt.data_transformers.register('book_static', to_static_file)
+
+
+# name of the column holding the number of raw rows behind a pre-aggregated row
+WEIGHT_FIELD = '__count'
+
+_DATUM_FIELD = re.compile(r"""datum(?:\.(\w+)|\[['"]([^'"]+)['"]\])""")
+_COMPOUND_KEYS = ('layer', 'hconcat', 'vconcat', 'concat', 'spec')
+
+
+def _iter_views(chart):
+    # the chart itself plus every chart nested in it (layers, concats, facets)
+    yield chart
+    for key in _COMPOUND_KEYS:
+        children = chart._get(key)
+        if isinstance(children, alt.SchemaBase):
+            children = [children]
+        if isinstance(children, list):
+            for child in children:
+                if isinstance(child, alt.SchemaBase):
+                    yield from _iter_views(child)
+
+
+def _spec_dict(chart):
+    """Return the Vega-Lite dict for chart without serializing any of its rows."""
+    chart = chart.copy(deep=True)
+    for view in _iter_views(chart):
+        if isinstance(view._get('data'), pd.DataFrame):
+            # an empty frame keeps the dtypes altair uses to infer field types
+            view.data = view.data.head(0)
+    with alt.data_transformers.enable('default'):
+        return chart.to_dict(validate=False)
+
+
+def _collect_fields(spec, found):
+    if isinstance(spec, dict):
+        for key, value in spec.items():
+            if key in ('field', 'groupby', 'fields'):
+                for name in (value if isinstance(value, list) else [value]):
+                    if isinstance(name, str):
+                        found.add(name)
+            elif isinstance(value, str):
+                # filter and condition expressions such as "datum.rank <= 10"
+                for match in _DATUM_FIELD.finditer(value):
+                    found.add(match.group(1) or match.group(2))
+            else:
+                _collect_fields(value, found)
+    elif isinstance(spec, list):
+        for item in spec:
+            _collect_fields(item, found)
+    return found
+
+
+def chart_fields(chart):
+    """Return the set of field names referenced anywhere in chart.
+
+    This covers encodings, transforms, selections and filter expressions, so
+    columns outside this set can be dropped without changing the chart.
+    """
+    return _collect_fields(_spec_dict(chart), set())
+
+
+def _count_to_sum(channel):
+    channel.update(aggregate='sum', field=WEIGHT_FIELD,
+                   title=channel.get('title', 'Count of Records'))
+
+
+def _rewrite_counts(spec):
+    """Turn every count() in a unit spec into a sum over WEIGHT_FIELD.
+
+    Returns the new (encoding, transform) or None when the chart uses something
+    that cannot be computed from pre-aggregated rows, e.g. a mean or a window
+    over the raw rows.
+    """
+    encoding = copy.deepcopy(spec.get('encoding', {}))
+    transform = copy.deepcopy(spec.get('transform', []))
+    found = False
+    aggregated = False
+    for step in transform:
+        if aggregated:
+            # everything after the first aggregate already sees grouped rows
+            break
+        if 'aggregate' in step:
+            for op in step['aggregate']:
+                if op.get('op') != 'count':
+                    return None
+                op.update(op='sum', field=WEIGHT_FIELD)
+            found = aggregated = True
+        elif 'filter' not in step and 'calculate' not in step:
+            return None
+    if not aggregated:
+        for channels in encoding.values():
+            for channel in (channels if isinstance(channels, list) else [channels]):
+                if not isinstance(channel, dict):
+                    continue
+                aggregate = channel.get('aggregate')
+                if aggregate is not None:
+                    if aggregate != 'count':
+                        return None
+                    _count_to_sum(channel)
+                    found = True
+                sort = channel.get('sort')
+                if isinstance(sort, dict) and 'op' in sort:
+                    if sort['op'] != 'count':
+                        return None
+                    sort.update(op='sum', field=WEIGHT_FIELD)
+                    found = True
+    if not found:
+        return None
+    return encoding, transform
+
+
+def _aggregate_rows(data, keys):
+    if not keys:
+        return pd.DataFrame({WEIGHT_FIELD: [len(data)]})
+    counts = data.groupby(keys, observed=True, dropna=False, sort=False).size()
+    return counts.rename(WEIGHT_FIELD).reset_index()
+
+
+def prepare_chart(chart):
+    """Return a copy of chart that only carries the data it needs.
+
+    Columns that the chart never references are dropped from every dataset.
+    Unit charts whose only aggregation is count() get their rows grouped in
+    pandas by the referenced columns, with count() rewritten as a sum of the
+    group sizes, so a year x count bar chart ships one row per year. Fields
+    used by selections are kept as grouping keys, so selections like
+    click_year filter exactly as before.
+
+    Call this last, just before displaying or gluing the chart.
+    """
+    chart = chart.copy(deep=True)
+    fields = chart_fields(chart)
+    for view in _iter_views(chart):
+        data = view._get('data')
+        if not isinstance(data, pd.DataFrame):
+            continue
+        keys = [column for column in data.columns if column in fields]
+        rewrite = _rewrite_counts(_spec_dict(view)) if isinstance(view, alt.Chart) else None
+        if rewrite is None:
+            view.data = data[keys]
+        else:
+            view.encoding, view.transform = rewrite
+            view.data = _aggregate_rows(data, keys)
+    return chart
+
+
+def rank_top(counts, by, n=10, field='species_name', count='species_count'):
+    """Keep the rows of counts ranked n or better by count within each combination of `by`.
+
+    Ranks follow Vega's rank(): ties share a rank and the next rank skips, so
+    a tie at the last place keeps every tied row. Rows without any count are
+    dropped. The result is indexed and sorted by `by`, then rank and field,
+    and has a rank column.
+    """
+    by = list(by)
+    counts = counts[counts[count] > 0].copy()
+    counts['rank'] = (counts.groupby(by, observed=True)[count]
+                      .rank(method='min', ascending=False).astype(int))
+    table = counts[counts['rank'] <= n]
+    return table.sort_values(by + ['rank', field]).set_index(by)
+
+
+def top_species(trees, by=('year_planted', 'root_barrier'), n=10, field='species_name'):
+    """Return the n most planted species for every combination of the `by` columns.
+
+    This is the top-10 that species_select used to compute in the browser with
+    aggregate -> window(rank) -> filter(rank <= 10) on every click, done once
+    in pandas instead, with the ties of rank_top().
+
+    The result is indexed and sorted by `by`, so a single slice is a cheap
+    .loc lookup, and has one row per (key, species) with species_count and rank.
+    """
+    by = list(by)
+    counts = (trees.groupby(by + [field], observed=True).size()
+              .rename('species_count').reset_index())
+    return rank_top(counts, by, n, field)
+
+
+# most trees the map draws one by one, above that it draws grid cells
+LOD_THRESHOLD = 20000
+# most grid cells the binned map may draw, the grid gets coarser until it fits
+LOD_MAX_CELLS = 8000
+# finest grid cell size in degrees, roughly 400 x 550 m in Vancouver
+LOD_CELL_SIZE = 0.005
+
+
+def bin_points(trees, cell_size=LOD_CELL_SIZE, by=('year_planted',)):
+    """Aggregate trees into square grid cells per combination of `by`.
+
+    Each cell is placed at the mean position of its trees and carries
+    tree_count, the mean diameter and, when the trees have one, the most
+    common species_name.
+    """
+    by = [column for column in by if column in trees.columns]
+    keys = by + ['cell_x', 'cell_y']
+    cells = trees.assign(
+        cell_x=np.floor(trees['longitude'].to_numpy() / cell_size).astype('int64'),
+        cell_y=np.floor(trees['latitude'].to_numpy() / cell_size).astype('int64'))
+    binned = cells.groupby(keys, observed=True, dropna=False, sort=False).agg(
+        longitude=('longitude', 'mean'),
+        latitude=('latitude', 'mean'),
+        diameter=('diameter', 'mean'),
+        tree_count=('longitude', 'size'))
+    if 'species_name' in trees.columns:
+        species = (cells.groupby(keys + ['species_name'], observed=True, dropna=False).size()
+                   .sort_values(ascending=False, kind='stable').reset_index()
+                   .drop_duplicates(keys).set_index(keys)['species_name'])
+        binned['species_name'] = species.reindex(binned.index)
+    return binned.reset_index().drop(columns=['cell_x', 'cell_y'])
+
+
+def level_of_detail(trees, threshold=LOD_THRESHOLD, cell_size=LOD_CELL_SIZE, by=('year_planted',),
+                    max_cells=LOD_MAX_CELLS):
+    """Return map rows: one per tree up to `threshold` trees, grid cells beyond.
+
+    The choice is made on all the rows the map draws. Cells are binned per
+    `by`, the columns a selection filters on, so a selection still picks
+    whole cells; the grid starts at cell_size and doubles until there are at
+    most max_cells cells. Every row has tree_count (1 for single trees), so
+    sizes and sums work the same for both.
+    """
+    if len(trees) <= threshold:
+        return trees.assign(tree_count=1)
+    cells = bin_points(trees, cell_size, by)
+    while len(cells) > max_cells:
+        cell_size *= 2
+        cells = bin_points(trees, cell_size, by)
+    return cells
+
+
+def point_layer(trees, size=20, threshold=LOD_THRESHOLD, cell_size=LOD_CELL_SIZE, by=('year_planted',),
+                max_cells=LOD_MAX_CELLS):
+    """Circle layer with one mark per tree, for layering on top of vancouver_map.
+
+    Up to `threshold` trees this is exactly the original points chart.
+    Larger inventories are drawn as level_of_detail() grid cells sized by
+    the number of trees they hold.
+    """
+    points = alt.Chart(trees)
+    if len(trees) > threshold:
+        points = alt.Chart(level_of_detail(trees, threshold, cell_size, by, max_cells)).encode(
+                 size=alt.Size('tree_count:Q', legend=None,
+                               scale=alt.Scale(range=[size, size * 20])))
+    return points.mark_circle(size=size).encode(
+           longitude='longitude',
+           latitude='latitude',
+           ).project(type='identity', reflectY=True)
+
+
+# prefix of the dataset names partitioned_data() gives charts, the rest is a query
+PARTITION_PREFIX = 'book-partitions:'
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_partitions(trees, by=('year_planted', 'root_barrier'), columns=None, data_dir=None, data_url=None):
+    """Write the rows of trees as one file per combination of `by`, plus a manifest.
+
+    Partition files and the manifest are content addressed like
+    to_static_file(). The manifest lists the partitions with their key (in
+    `by` order), file name and row count, and the sorted values of each `by`
+    column. The partition files only hold `columns` (default: all but `by`),
+    a partition's key is the same for all of its rows. Returns the manifest url.
+    """
+    data_dir = data_dir or DATA_DIR
+    data_url = DATA_URL if data_url is None else data_url
+    by = list(by)
+    columns = list(columns) if columns else [column for column in trees.columns if column not in by]
+    partitions = []
+    for key, rows in trees.groupby(by, observed=True, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        payload = _dump_values(alt.to_values(rows[columns])['values'])
+        partitions.append({'key': [_json_value(value) for value in key],
+                           'url': _write_payload(payload, 'part', data_dir),
+                           'rows': len(rows)})
+    manifest = {'fields': by,
+                'values': {column: sorted(_json_value(value) for value in trees[column].dropna().unique())
+                           for column in by},
+                'partitions': partitions}
+    return data_url.rstrip('/') + '/' + _write_payload(_dump_values(manifest), 'partitions', data_dir)
+
+
+def partitioned_data(trees, selection, by=('year_planted', 'root_barrier'), columns=None, prefetch=1, **kwargs):
+    """Chart data the page loads one partition at a time, following selection.
+
+    The rows are written with write_partitions(). scripts/partitioned_data.js
+    loads the partitions matching the selection's current values (all of them
+    while it is empty) into the chart, and once they are shown prefetches the
+    partitions `prefetch` steps either side along the first `by` column, so a
+    year slider moves to the next year without waiting on the network.
+    """
+    manifest = write_partitions(trees, by, columns, **kwargs)
+    params = [('manifest', manifest), ('selection', selection.name), ('prefetch', str(prefetch))]
+    return alt.NamedData(name=PARTITION_PREFIX + urllib.parse.urlencode(params))
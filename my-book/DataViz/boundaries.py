@@ -0,0 +1,314 @@
+# Local copy of the Vancouver local area boundaries used for the base map.
+#
+# The notebooks used to point alt.Data at the GeoJSON on GitHub, so every
+# reader downloaded the full resolution file when the page loaded. This
+# fetches it once, simplifies the polygons, rounds the coordinates and writes
+# the result to _static/data/, next to the chart data from book_charts.
+#
+# AreaIndex places points in the local areas of the full resolution file, so
+# trees can be aggregated per neighbourhood at build time and drawn as a
+# choropleth instead of hundreds of thousands of points.
+
+import hashlib
+import json
+import os
+import urllib.request
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from book_charts import DATA_DIR, DATA_URL
+from trees_data import CACHE_DIR, TreesCacheError, is_frozen
+
+BOUNDARY_URL = 'https://raw.githubusercontent.com/UBC-MDS/exploratory-data-viz/main/data/local-area-boundary.geojson'
+
+# in degrees, about 7 m, well below a pixel at the size the map is drawn
+SIMPLIFY_TOLERANCE = 0.0001
+# 5 decimals is about 1 m
+COORD_DECIMALS = 5
+# feature property holding the local area name
+AREA_PROPERTY = 'name'
+# grid cell size of AreaIndex in degrees, roughly 70 x 110 m in Vancouver
+INDEX_CELL_SIZE = 0.001
+# most point x edge pairs tested at once
+_RAY_CHUNK = 1 << 20
+
+
+def simplify_line(points, tolerance):
+    """Douglas-Peucker simplification of an (n, 2) array of coordinates."""
+    n = len(points)
+    if n < 3:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            # closed ring, measure from the shared start/end point
+            distance = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distance = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return points[keep]
+
+
+def _simplify_ring(ring, tolerance, decimals):
+    points = np.round(np.asarray(ring, dtype=float), decimals)
+    # rounding can leave repeated points behind
+    repeated = np.all(points[1:] == points[:-1], axis=1)
+    points = points[np.concatenate([[True], ~repeated])]
+    simplified = simplify_line(points, tolerance)
+    # a polygon ring needs at least 4 points (first == last)
+    if len(simplified) < 4:
+        simplified = points
+    return simplified.tolist()
+
+
+def simplify_geometry(geometry, tolerance=SIMPLIFY_TOLERANCE, decimals=COORD_DECIMALS):
+    """Return a copy of a GeoJSON Polygon or MultiPolygon geometry with simplified rings."""
+    if geometry['type'] == 'Polygon':
+        rings = [_simplify_ring(ring, tolerance, decimals) for ring in geometry['coordinates']]
+        return {'type': 'Polygon', 'coordinates': rings}
+    if geometry['type'] == 'MultiPolygon':
+        polygons = [[_simplify_ring(ring, tolerance, decimals) for ring in polygon]
+                    for polygon in geometry['coordinates']]
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+    return geometry
+
+
+def _download(url, frozen, timeout=30):
+    path = os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest()[:32] + '.geojson')
+    if not os.path.exists(path):
+        if frozen:
+            raise TreesCacheError(
+                'no cached copy of {} in {} and frozen mode is on'.format(url, CACHE_DIR))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            raw = response.read()
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp, path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_boundaries(url=BOUNDARY_URL, tolerance=SIMPLIFY_TOLERANCE, decimals=COORD_DECIMALS,
+                     frozen=None, data_dir=None):
+    """Fetch (once), simplify and write the boundary file, returning its file name."""
+    frozen = is_frozen() if frozen is None else frozen
+    data_dir = data_dir or DATA_DIR
+    collection = _download(url, frozen)
+    features = [dict(feature, geometry=simplify_geometry(feature['geometry'], tolerance, decimals))
+                for feature in collection['features']]
+    payload = json.dumps({'type': 'FeatureCollection', 'features': features},
+                         separators=(',', ':'), sort_keys=True).encode('utf-8')
+    filename = 'local-area-boundary-{}.json'.format(hashlib.sha256(payload).hexdigest()[:20])
+    path = os.path.join(data_dir, filename)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        # both notebooks write this file and may run in parallel, each gets its own temp file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    return filename
+
+
+def boundary_data(url=BOUNDARY_URL, tolerance=SIMPLIFY_TOLERANCE, decimals=COORD_DECIMALS):
+    """alt.Data for the simplified boundaries, a drop-in for data_geojson_remote."""
+    filename = build_boundaries(url, tolerance, decimals)
+    return alt.Data(url=DATA_URL + '/' + filename,
+                    format=alt.DataFormat(property='features', type='json'))
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
+
+
+def _expand(start, count):
+    """Concatenated ranges start[i], ..., start[i] + count[i] - 1, and the i of each value."""
+    owner = np.repeat(np.arange(len(count)), count)
+    offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    return start[owner] + offset, owner
+
+
+class AreaIndex:
+    """Find the local area of many points at once.
+
+    The extent of the areas is cut into square grid cells. A cell no polygon
+    edge passes through lies wholly inside one area (or none), so it is
+    classified once from its centre and its points are assigned by a table
+    lookup. Points in the other cells are ray cast, even-odd rule, against the
+    edges that overlap their grid row only, which also handles holes and
+    multipolygons. Points outside every area get -1.
+    """
+
+    def __init__(self, features, name=AREA_PROPERTY, cell_size=INDEX_CELL_SIZE):
+        numbers, edges, owners = {}, [], []
+        for feature in features:
+            rings = _rings(feature['geometry'])
+            if not rings:
+                continue
+            # features sharing a name are parts of one area
+            number = numbers.setdefault(feature['properties'][name], len(numbers))
+            for ring in rings:
+                points = np.asarray(ring, dtype=float)[:, :2]
+                if len(points) and np.any(points[0] != points[-1]):
+                    points = np.vstack([points, points[:1]])
+                edges.append(np.hstack([points[:-1], points[1:]]))
+                owners.append(np.full(len(points) - 1, number))
+        edges = np.concatenate(edges)
+        owners = np.concatenate(owners)
+        self.names = list(numbers)
+        self.cell_size = cell_size
+        self.x_min = min(edges[:, 0].min(), edges[:, 2].min())
+        self.y_min = min(edges[:, 1].min(), edges[:, 3].min())
+        n_cols = int((max(edges[:, 0].max(), edges[:, 2].max()) - self.x_min) // cell_size) + 1
+        n_rows = int((max(edges[:, 1].max(), edges[:, 3].max()) - self.y_min) // cell_size) + 1
+        self.shape = (n_rows, n_cols)
+
+        # cells touched by the bounding box of an edge may hold a border
+        col_lo = self._col(np.minimum(edges[:, 0], edges[:, 2]))
+        col_hi = self._col(np.maximum(edges[:, 0], edges[:, 2]))
+        row_lo = self._row(np.minimum(edges[:, 1], edges[:, 3]))
+        row_hi = self._row(np.maximum(edges[:, 1], edges[:, 3]))
+        n_edge_cols = col_hi - col_lo + 1
+        cell, edge = _expand(np.zeros(len(edges), dtype=np.int64), n_edge_cols * (row_hi - row_lo + 1))
+        border = np.zeros(self.shape, dtype=bool)
+        border[row_lo[edge] + cell // n_edge_cols[edge], col_lo[edge] + cell % n_edge_cols[edge]] = True
+
+        # a horizontal edge never crosses a horizontal ray, the others are
+        # listed under every row they overlap, grouped by area within a row
+        sloped = edges[:, 1] != edges[:, 3]
+        edges, owners, row_lo, row_hi = edges[sloped], owners[sloped], row_lo[sloped], row_hi[sloped]
+        rows, edge = _expand(row_lo, row_hi - row_lo + 1)
+        order = np.lexsort((owners[edge], rows))
+        rows, edge = rows[order], edge[order]
+        self._row_start = np.searchsorted(rows, np.arange(n_rows + 1))
+        self._x0 = edges[edge, 0]
+        self._y0 = edges[edge, 1]
+        self._y1 = edges[edge, 3]
+        self._slope = (edges[edge, 2] - edges[edge, 0]) / (edges[edge, 3] - edges[edge, 1])
+        self._owner = owners[edge]
+
+        self._cells = np.full(self.shape, -2, dtype=np.int64)
+        rows, cols = np.nonzero(~border)
+        self._cells[rows, cols] = self._ray_cast(self.x_min + (cols + 0.5) * cell_size,
+                                                 self.y_min + (rows + 0.5) * cell_size, rows)
+
+    def _col(self, x):
+        return ((x - self.x_min) // self.cell_size).astype(np.int64)
+
+    def _row(self, y):
+        return ((y - self.y_min) // self.cell_size).astype(np.int64)
+
+    def _ray_cast(self, x, y, rows):
+        found = np.full(len(x), -1, dtype=np.int64)
+        order = np.argsort(rows, kind='stable')
+        bounds = np.searchsorted(rows[order], np.arange(self.shape[0] + 1))
+        for row in np.flatnonzero(np.diff(bounds)):
+            first, last = self._row_start[row], self._row_start[row + 1]
+            if first == last:
+                continue
+            owner = self._owner[first:last]
+            groups = np.flatnonzero(np.concatenate([[True], owner[1:] != owner[:-1]]))
+            x0, y0, y1, slope = (a[first:last] for a in (self._x0, self._y0, self._y1, self._slope))
+            points = order[bounds[row]:bounds[row + 1]]
+            step = max(1, _RAY_CHUNK // (last - first))
+            for start in range(0, len(points), step):
+                chunk = points[start:start + step]
+                px, py = x[chunk, None], y[chunk, None]
+                crosses = ((y0 > py) != (y1 > py)) & (px < x0 + (py - y0) * slope)
+                inside = np.logical_xor.reduceat(crosses, groups, axis=1)
+                hit = inside.any(axis=1)
+                found[chunk[hit]] = owner[groups[inside[hit].argmax(axis=1)]]
+        return found
+
+    def locate(self, x, y):
+        """Area number (position in .names) of every point, -1 outside all areas."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        found = np.full(len(x), -1, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            cols, rows = (x - self.x_min) // self.cell_size, (y - self.y_min) // self.cell_size
+            inside = (cols >= 0) & (cols < self.shape[1]) & (rows >= 0) & (rows < self.shape[0])
+        points = np.flatnonzero(inside)
+        rows, cols = rows[points].astype(np.int64), cols[points].astype(np.int64)
+        found[points] = self._cells[rows, cols]
+        border = found[points] == -2
+        found[points[border]] = self._ray_cast(x[points[border]], y[points[border]], rows[border])
+        return found
+
+
+def area_index(url=BOUNDARY_URL, name=AREA_PROPERTY, cell_size=INDEX_CELL_SIZE, frozen=None):
+    """AreaIndex of the full resolution boundaries, fetched once like build_boundaries."""
+    frozen = is_frozen() if frozen is None else frozen
+    return AreaIndex(_download(url, frozen)['features'], name, cell_size)
+
+
+def assign_areas(trees, index=None, column='local_area'):
+    """Return trees with a categorical column naming the local area each tree is in."""
+    if index is None:
+        index = area_index()
+    found = index.locate(trees['longitude'].to_numpy(dtype=float), trees['latitude'].to_numpy(dtype=float))
+    return trees.assign(**{column: pd.Categorical.from_codes(found, categories=index.names)})
+
+
+def area_aggregates(trees, index=None, by=('year_planted',), column='local_area'):
+    """Tree count, number of species and mean diameter per local area and `by`.
+
+    Trees outside every area are left out. Only areas and `by` values with
+    trees get a row.
+    """
+    if column not in trees.columns:
+        trees = assign_areas(trees, index, column)
+    by = [column] + [key for key in by if key in trees.columns]
+    table = trees.groupby(by, observed=True, sort=True).agg(
+        tree_count=('species_name', 'size'),
+        species_count=('species_name', 'nunique'),
+        mean_diameter=('diameter', 'mean'))
+    table = table.reset_index()
+    table[column] = table[column].astype(str)
+    return table
+
+
+def choropleth(aggregates, boundaries=None, value='tree_count', selection=None,
+               column='local_area', name=AREA_PROPERTY):
+    """Local areas colored by a column of area_aggregates(), drawn like vancouver_map.
+
+    The area shapes are looked up from `boundaries` (boundary_data() by
+    default) by name. With more than one row per area, one per year, pass a
+    selection that keeps one of them, such as a slider with an init value.
+    """
+    if boundaries is None:
+        boundaries = boundary_data()
+    chart = alt.Chart(aggregates)
+    if selection is not None:
+        chart = chart.transform_filter(selection)
+    return chart.transform_lookup(
+        lookup=column,
+        from_=alt.LookupData(boundaries, key='properties.' + name, fields=['type', 'geometry'])
+    ).mark_geoshape(stroke='black').encode(
+        color=alt.Color(value, type='quantitative'),
+        tooltip=[alt.Tooltip(column, type='nominal', title='Local Area'),
+                 alt.Tooltip('tree_count', type='quantitative', title='Trees'),
+                 alt.Tooltip('species_count', type='quantitative', title='Species'),
+                 alt.Tooltip('mean_diameter', type='quantitative', title='Mean Diameter', format='.1f')]
+    ).project(type='identity', reflectY=True)
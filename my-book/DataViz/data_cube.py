@@ -0,0 +1,165 @@
+# Crossfilter data cube for the linked views of the dashboard.
+#
+# In the dashboard every move of the year slider, the root barrier radio or a
+# click on a species makes Vega filter and re-aggregate the rows behind every
+# view. Instead, the build counts the trees once per year_planted x
+# root_barrier x species_name x grid cell and writes the counts as dense
+# typed array files next to the chart data: the full cube and the smaller
+# sums over species or over cells that most interactions need. The page
+# (scripts/data_cube.js) turns each array into prefix sums along the years and
+# answers a selection with lookups, so an interaction costs the same for 5k
+# or 500k trees. A chart showing the top n of a dimension also gets the top n
+# for every single value of the other dimensions ranked in pandas
+# (rank_top() in book_charts.py) in the manifest, so the page only ranks for
+# selections the table does not cover, with the same ties.
+
+import json
+import urllib.parse
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from book_charts import DATA_DIR, DATA_URL, _dump_values, _json_value, _write_payload, rank_top
+
+# prefix of the dataset names cube_data() gives charts, the rest is a query
+CUBE_PREFIX = 'book-cube:'
+# axes of the cube besides the grid cell; the first one is summed over ranges
+# and has to hold integers (years)
+CUBE_DIMENSIONS = ('year_planted', 'root_barrier', 'species_name')
+# arrays written for the page, smallest first; each starts with the first
+# dimension and the page uses the smallest one holding what a view needs
+CUBE_VIEWS = (('year_planted', 'root_barrier', 'species_name'),
+              ('year_planted', 'root_barrier', 'cell'),
+              ('year_planted', 'root_barrier', 'species_name', 'cell'))
+# grid cell size in degrees, roughly 700 x 1100 m in Vancouver
+CUBE_CELL_SIZE = 0.01
+
+
+class DataCube:
+    """Tree counts per combination of the dimensions and grid cell, as one dense array.
+
+    values holds the labels along each dimension, every integer from the
+    first to the last for the first one so a range of years is a range of
+    indices. cells holds the position of every occupied cell (the mean
+    position of its trees). Rows missing any dimension are left out.
+    """
+
+    def __init__(self, trees, dimensions=CUBE_DIMENSIONS, cell_size=CUBE_CELL_SIZE):
+        self.dimensions = list(dimensions) + ['cell']
+        self.cell_size = cell_size
+        trees = trees.dropna(subset=list(dimensions) + ['longitude', 'latitude'])
+        codes, self.values = [], {}
+        first = trees[dimensions[0]].astype('int64')
+        start = first.min() if len(first) else 0
+        codes.append((first - start).to_numpy())
+        self.values[dimensions[0]] = list(range(start, first.max() + 1)) if len(first) else []
+        for dimension in dimensions[1:]:
+            code, labels = pd.factorize(trees[dimension], sort=True)
+            codes.append(code)
+            self.values[dimension] = list(labels)
+        longitude = trees['longitude'].to_numpy(dtype=float)
+        latitude = trees['latitude'].to_numpy(dtype=float)
+        column = np.floor(longitude / cell_size).astype('int64')
+        row = np.floor(latitude / cell_size).astype('int64')
+        if len(trees):
+            column, row = column - column.min(), row - row.min()
+        _, cell = np.unique(column * (row.max(initial=0) + 1) + row, return_inverse=True)
+        trees_per_cell = np.bincount(cell)
+        self.cells = pd.DataFrame({'longitude': np.bincount(cell, weights=longitude) / trees_per_cell,
+                                   'latitude': np.bincount(cell, weights=latitude) / trees_per_cell})
+        codes.append(cell)
+        self.shape = tuple(len(self.values[dimension]) for dimension in dimensions) + (len(self.cells),)
+        flat = np.ravel_multi_index(codes, self.shape) if len(trees) else np.zeros(0, dtype='int64')
+        self.counts = np.bincount(flat, minlength=int(np.prod(self.shape))).reshape(self.shape)
+
+    def project(self, dimensions):
+        """Counts summed over every axis not in dimensions, in cube order."""
+        other = tuple(axis for axis, name in enumerate(self.dimensions) if name not in dimensions)
+        return self.counts.sum(axis=other)
+
+    def query(self, group, **filters):
+        """Counts per label of `group` for the trees matching filters ({dimension: [labels]})."""
+        index = []
+        for name in self.dimensions:
+            labels = self.values.get(name)
+            if name in filters:
+                index.append([labels.index(value) for value in filters[name] if value in labels])
+            else:
+                index.append(slice(None))
+        counts = self.counts[np.ix_(*[np.arange(size)[i] for size, i in zip(self.shape, index)])]
+        axis = self.dimensions.index(group)
+        totals = counts.sum(axis=tuple(a for a in range(counts.ndim) if a != axis))
+        labels = self.cells.index if group == 'cell' else self.values[group]
+        return pd.Series(totals, index=labels, name='count')
+
+    def top(self, group, n=10, count='count'):
+        """The n largest counts of `group` for every combination of the other dimensions but the cell.
+
+        Indexed by those dimensions, with `group`, count and rank columns, see rank_top().
+        """
+        dimensions = [name for name in self.dimensions if name != 'cell']
+        by = [name for name in dimensions if name != group]
+        index = pd.MultiIndex.from_product([self.values[name] for name in dimensions], names=dimensions)
+        counts = pd.Series(self.project(dimensions).ravel(), index=index, name=count).reset_index()
+        return rank_top(counts, by, n, group, count)
+
+
+def _dtype(array):
+    for dtype in ('uint8', 'uint16', 'uint32'):
+        if array.max(initial=0) <= np.iinfo(dtype).max:
+            return dtype
+    raise ValueError('cube counts do not fit in 32 bits')
+
+
+def write_cube(cube, views=CUBE_VIEWS, top=None, data_dir=None, data_url=None):
+    """Write the arrays of views and a manifest describing them, return the manifest url.
+
+    Arrays are little-endian, C order, in the smallest unsigned type holding
+    their counts, and content addressed like to_static_file(). With top, a
+    (group, n) pair, the manifest also holds DataCube.top(group, n) as lists
+    of [label, count] keyed by the JSON list of the other dimensions' values.
+    """
+    data_dir = data_dir or DATA_DIR
+    data_url = DATA_URL if data_url is None else data_url
+    arrays = []
+    for view in views:
+        if view[0] != cube.dimensions[0]:
+            raise ValueError('cube views have to start with {}'.format(cube.dimensions[0]))
+        counts = cube.project(view)
+        dtype = _dtype(counts)
+        payload = counts.astype('<' + np.dtype(dtype).str[1:]).tobytes()
+        arrays.append({'dimensions': list(view), 'shape': list(counts.shape), 'dtype': dtype,
+                       'url': _write_payload(payload, 'cube', data_dir, extension='bin')})
+    manifest = {'dimensions': cube.dimensions,
+                'values': {name: [_json_value(value) for value in labels] for name, labels in cube.values.items()},
+                'cells': cube.cells.round(5).to_dict(orient='list'),
+                'arrays': arrays}
+    if top:
+        group, n = top
+        table = cube.top(group, n)
+        rows = {}
+        for key, label, count in zip(table.index, table[group], table['count']):
+            key = json.dumps([_json_value(value) for value in (key if isinstance(key, tuple) else (key,))],
+                             separators=(',', ':'))
+            rows.setdefault(key, []).append([_json_value(label), int(count)])
+        manifest['top'] = {'group': group, 'n': n, 'by': list(table.index.names), 'rows': rows}
+    return data_url.rstrip('/') + '/' + _write_payload(_dump_values(manifest), 'cube', data_dir)
+
+
+def cube_data(cube, group, selections=(), count='tree_count', top=None, views=CUBE_VIEWS, **kwargs):
+    """Chart data the page computes from a DataCube, following selections.
+
+    Rows hold a `group` label (longitude and latitude for 'cell') and the
+    number of trees in `count`, for the trees matching the current values of
+    the selections on the cube dimensions; only rows with trees are kept and,
+    with top, only the rows ranked `top` or better, ties included like Vega's
+    rank(). A selection on the chart's own group should not be passed, it
+    would filter the chart it is clicked on.
+    """
+    manifest = write_cube(cube, views, (group, top) if top and group != 'cell' else None, **kwargs)
+    params = [('manifest', manifest), ('group', group), ('count', count)]
+    params += [('selection', selection.name) for selection in selections]
+    if top:
+        params.append(('top', str(top)))
+    return alt.NamedData(name=CUBE_PREFIX + urllib.parse.urlencode(params))
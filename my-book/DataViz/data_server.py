@@ -0,0 +1,435 @@
+# Local query backend for the interactive charts.
+#
+#     python DataViz/data_server.py --html-dir _build/html [--port 8000]
+#
+# Serves the built book and answers small filter queries against the trees
+# data, so a chart can fetch the rows (or counts) for the current selection
+# instead of carrying every row inlined in the page. A chart opts in with
+#
+#     alt.Chart(served_data('trees_small', click_year, columns=[...]))
+#
+# which gives it an empty named dataset. The page script data_server.js
+# (injected into every page this server sends) watches the selection and, on
+# each change, requests /query?table=trees_small&year_planted=2003&... and
+# loads the answer into the dataset. Answers are in a small binary columnar
+# format (see encode_columns), cached by the server and by the page, and
+# fetched over a kept-alive connection.
+#
+# The notebooks only use served_data() when BOOK_DATA_SERVER=1 is set at
+# build time, a plain build keeps the static data files.
+
+import argparse
+import functools
+import hashlib
+import http.client
+import http.server
+import os
+import struct
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERY_PATH = '/query'
+CLIENT_PATH = '/_data_server/data_server.js'
+CLIENT_JS = os.path.join(HERE, os.pardir, 'scripts', 'data_server.js')
+CONTENT_TYPE = 'application/x-book-columns'
+# prefix of the dataset names served_data() gives charts, the rest is the query
+SERVED_PREFIX = 'book-server:'
+# query parameters that are not field filters
+RESERVED = ('table', 'selection', 'columns', 'groupby', 'top', 'count', 'format')
+CACHE_SIZE = 256
+
+MAGIC = b'BKC1'
+FLOAT, INT, STRING, BOOL = range(4)
+
+
+def enabled():
+    return os.environ.get('BOOK_DATA_SERVER', '').lower() in ('1', 'true', 'yes')
+
+
+# -- columnar encoding ----------------------------------------------------------
+
+def encode_columns(frame):
+    """Encode a frame as little-endian columns.
+
+    MAGIC, uint32 rows, uint16 columns, then per column a uint16-prefixed
+    utf-8 name, a uint8 kind and the values: FLOAT float64 (NaN is missing,
+    datetimes are epoch milliseconds), INT int32, BOOL uint8, STRING a uint32
+    count of uint32-prefixed utf-8 labels followed by int32 codes (-1 is
+    missing).
+    """
+    parts = [MAGIC, struct.pack('<IH', len(frame), len(frame.columns))]
+    for name, column in frame.items():
+        key = str(name).encode('utf-8')
+        parts.append(struct.pack('<H', len(key)) + key)
+        values = column.to_numpy()
+        if pd.api.types.is_bool_dtype(column.dtype):
+            parts.append(struct.pack('<B', BOOL) + values.astype('u1').tobytes())
+        elif (pd.api.types.is_integer_dtype(column.dtype) and len(column)
+              and np.iinfo('i4').min <= values.min() and values.max() <= np.iinfo('i4').max):
+            parts.append(struct.pack('<B', INT) + values.astype('<i4').tobytes())
+        elif pd.api.types.is_datetime64_any_dtype(column.dtype):
+            millis = column.dt.tz_localize(None) if column.dt.tz else column
+            millis = (millis.astype('int64') // 10 ** 6).astype('<f8').where(column.notna(), np.nan)
+            parts.append(struct.pack('<B', FLOAT) + millis.to_numpy('<f8').tobytes())
+        elif pd.api.types.is_numeric_dtype(column.dtype):
+            parts.append(struct.pack('<B', FLOAT) + values.astype('<f8').tobytes())
+        else:
+            codes, labels = pd.factorize(column)
+            parts.append(struct.pack('<BI', STRING, len(labels)))
+            for label in labels:
+                text = str(label).encode('utf-8')
+                parts.append(struct.pack('<I', len(text)) + text)
+            parts.append(codes.astype('<i4').tobytes())
+    return b''.join(parts)
+
+
+def decode_columns(payload):
+    """Inverse of encode_columns(), strings come back as categoricals."""
+    if payload[:4] != MAGIC:
+        raise ValueError('not a columns payload')
+    rows, count = struct.unpack_from('<IH', payload, 4)
+    offset = 10
+    columns = {}
+    for _ in range(count):
+        (length,) = struct.unpack_from('<H', payload, offset)
+        name = payload[offset + 2:offset + 2 + length].decode('utf-8')
+        kind = payload[offset + 2 + length]
+        offset += 3 + length
+        if kind == STRING:
+            (n_labels,) = struct.unpack_from('<I', payload, offset)
+            offset += 4
+            labels = []
+            for _ in range(n_labels):
+                (length,) = struct.unpack_from('<I', payload, offset)
+                labels.append(payload[offset + 4:offset + 4 + length].decode('utf-8'))
+                offset += 4 + length
+            codes = np.frombuffer(payload, '<i4', rows, offset)
+            columns[name] = pd.Categorical.from_codes(codes, labels)
+            offset += 4 * rows
+        else:
+            dtype, size = {FLOAT: ('<f8', 8), INT: ('<i4', 4), BOOL: ('u1', 1)}[kind]
+            values = np.frombuffer(payload, dtype, rows, offset)
+            columns[name] = values.astype(bool) if kind == BOOL else values.copy()
+            offset += size * rows
+    return pd.DataFrame(columns)
+
+
+# -- queries --------------------------------------------------------------------
+
+def _split(params, key):
+    return [item for value in params.get(key, []) for item in value.split(',') if item]
+
+
+def _filter_values(column, values):
+    if pd.api.types.is_bool_dtype(column.dtype):
+        return [value.lower() in ('true', '1') for value in values]
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return pd.to_numeric(values).tolist()
+    return values
+
+
+def run_query(tables, params):
+    """Answer one query, params maps names to lists of values as parse_qs gives them.
+
+    table picks the frame, every other non-reserved name filters its column to
+    the given values (repeat the name for several). groupby returns one row per
+    group with its size in a `count` column (renamed by count=), top=n keeps
+    the n largest groups, ties included, with their rank. Without groupby,
+    columns= picks the columns returned.
+    """
+    name = params.get('table', [None])[0]
+    if name not in tables:
+        raise KeyError('unknown table {!r}'.format(name))
+    frame = tables[name]
+    unknown = [field for field in _split(params, 'groupby') + _split(params, 'columns')
+               if field not in frame.columns]
+    if unknown:
+        raise ValueError('unknown fields {}'.format(', '.join(unknown)))
+    mask = np.ones(len(frame), dtype=bool)
+    for field, values in params.items():
+        if field in RESERVED:
+            continue
+        if field not in frame.columns:
+            raise ValueError('unknown field {!r}'.format(field))
+        mask &= frame[field].isin(_filter_values(frame[field], values)).to_numpy()
+    frame = frame[mask]
+
+    groupby = _split(params, 'groupby')
+    if groupby:
+        count = params.get('count', ['count'])[0]
+        frame = frame.groupby(groupby, observed=True).size().rename(count).reset_index()
+        frame = frame[frame[count] > 0]
+        if params.get('top'):
+            # same ranking as Vega's rank(), like top_species()
+            frame = frame.assign(rank=frame[count].rank(method='min', ascending=False).astype(int))
+            frame = frame[frame['rank'] <= int(params['top'][0])].sort_values(['rank'] + groupby)
+    elif _split(params, 'columns'):
+        frame = frame[_split(params, 'columns')]
+    return frame.reset_index(drop=True)
+
+
+def query_key(params):
+    """A canonical cache key: the same filter in any parameter order is one entry."""
+    return tuple(sorted((key, tuple(sorted(values))) for key, values in params.items()))
+
+
+class ResponseCache:
+    """Least recently used cache of encoded query answers."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+
+# -- server ---------------------------------------------------------------------
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between a page's queries
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def end_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        super().end_headers()
+
+    def _send(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == QUERY_PATH:
+            return self._query(urllib.parse.parse_qs(url.query))
+        if url.path == CLIENT_PATH:
+            with open(CLIENT_JS, 'rb') as f:
+                return self._send(200, f.read(), 'text/javascript; charset=utf-8')
+        if self.server.html_dir is None:
+            return self._send(404, b'not found', 'text/plain')
+        path = self.translate_path(url.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if path.endswith('.html') and os.path.isfile(path):
+            return self._page(path)
+        return super().do_GET()
+
+    def _page(self, path):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        tag = '<script src="{}"></script>'.format(CLIENT_PATH)
+        # first thing in <head>, it has to be there before vega-embed loads
+        text = text.replace('<head>', '<head>' + tag, 1)
+        self._send(200, text.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def _query(self, params):
+        as_json = params.get('format', [''])[0] == 'json'
+
+        def answer():
+            frame = run_query(self.server.tables, params)
+            if as_json:
+                body = frame.to_json(orient='records', date_format='epoch').encode('utf-8')
+            else:
+                body = encode_columns(frame)
+            return body, '"{}"'.format(hashlib.sha256(body).hexdigest()[:20])
+
+        try:
+            body, etag = self.server.cache.get(query_key(params), answer)
+        except KeyError as err:
+            return self._send(404, str(err).encode('utf-8'), 'text/plain')
+        except ValueError as err:
+            return self._send(400, str(err).encode('utf-8'), 'text/plain')
+        headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        self._send(200, body, 'application/json' if as_json else CONTENT_TYPE, headers)
+
+
+class DataServer:
+    """The query server, run in a background thread with start() or as a context manager.
+
+    port=0 picks a free port, which is what tests use:
+
+        with DataServer({'trees_small': frame}) as server:
+            DataClient(server.url).query('trees_small', year_planted=[2003])
+    """
+
+    def __init__(self, tables, html_dir=None, host='127.0.0.1', port=0,
+                 cache_size=CACHE_SIZE, verbose=False):
+        handler = functools.partial(_Handler, directory=html_dir or os.curdir)
+        self.httpd = http.server.ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.tables = tables
+        self.httpd.html_dir = html_dir
+        self.httpd.cache = ResponseCache(cache_size)
+        self.httpd.verbose = verbose
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def cache(self):
+        return self.httpd.cache
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class DataClient:
+    """Python client for DataServer, mostly for tests and benchmarks.
+
+    One connection is kept open and reused for every query, and answers are
+    cached by query and revalidated with their ETag.
+    """
+
+    def __init__(self, url, timeout=10):
+        url = urllib.parse.urlsplit(url)
+        self.host, self.port, self.timeout = url.hostname, url.port, timeout
+        self._connection = None
+        self._cache = {}
+        self.requests = self.connections = 0
+
+    def _connect(self):
+        self.connections += 1
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _get(self, path, headers):
+        for attempt in (0, 1):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request('GET', path, headers=headers)
+                response = self._connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed the kept-alive connection, reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+    def query(self, table, **params):
+        """Return the answer frame for table filtered by params (lists for several values)."""
+        params = dict(params, table=table)
+        path = QUERY_PATH + '?' + urllib.parse.urlencode(
+            {key: value if isinstance(value, (list, tuple)) else [value] for key, value in params.items()},
+            doseq=True)
+        cached = self._cache.get(path)
+        headers = {'Accept': CONTENT_TYPE}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+        self.requests += 1
+        response, body = self._get(path, headers)
+        if response.status == 304:
+            return cached[1].copy()
+        if response.status != 200:
+            raise ValueError('{} {}: {}'.format(response.status, response.reason, body.decode('utf-8', 'replace')))
+        frame = decode_columns(body)
+        self._cache[path] = (response.getheader('ETag'), frame)
+        return frame.copy()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# -- charts ---------------------------------------------------------------------
+
+def served_data(table='trees_small', selection=None, columns=None, groupby=None, top=None, count=None):
+    """Chart data that data_server.js fetches from the server for the current selection.
+
+    The filter is taken from the selection's store in the page: every field a
+    selected tuple sets becomes a field filter (a multi-field multi-selection
+    gets every combination of the selected values). No selection, or an empty
+    one, fetches the whole table. columns / groupby / top / count are passed
+    on to run_query().
+    """
+    params = [('table', table)]
+    if selection is not None:
+        params.append(('selection', selection.name))
+    if columns:
+        params.append(('columns', ','.join(columns)))
+    if groupby:
+        params.append(('groupby', ','.join(groupby)))
+    if top:
+        params.append(('top', str(top)))
+    if count:
+        params.append(('count', count))
+    return alt.NamedData(name=SERVED_PREFIX + urllib.parse.urlencode(params))
+
+
+def main(argv=None):
+    from trees import Trees
+
+    parser = argparse.ArgumentParser(description='Serve the built book and the trees data queries.')
+    parser.add_argument('--html-dir', default=os.path.join(HERE, os.pardir, '_build', 'html'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    trees = Trees.load(drop=['Unnamed: 0'])
+    server = DataServer({'trees_small': trees.trees_small, 'trees': trees.trees_df},
+                        html_dir=args.html_dir, host=args.host, port=args.port, verbose=args.verbose)
+    print('serving {} on {}'.format(args.html_dir, server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
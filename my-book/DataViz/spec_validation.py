@@ -0,0 +1,87 @@
+# Schema validation of the Altair charts for the book build.
+#
+# Altair checks every object against the Vega-Lite JSON schema when it is
+# created (its debug mode) and the whole spec again when it is serialized,
+# with the data inlined. Building a figure through a few .encode() and
+# .properties() calls validates it over and over, and each validation walks
+# every data row. With
+#
+#     spec_validation.enable()
+#
+# objects are no longer validated when they are created, only the spec of a
+# chart being serialized is, and with its data values left out: rows never
+# change whether a spec is valid, its shape does. A spec shape that validated
+# once (same chart, same derivation) is not validated again.
+#
+# Environment variables:
+#   BOOK_VALIDATION  strict: Altair's own full validation, for CI
+#                    cached (default): the above
+
+import copy
+import hashlib
+import json
+import os
+
+import altair as alt
+
+MODES = ('cached', 'strict')
+
+_schemapi = alt.utils.schemapi
+_validate = _schemapi.SchemaBase.__dict__['validate']
+_debug_mode = _schemapi.DEBUG_MODE
+_valid_shapes = set()
+stats = {'validated': 0, 'cached': 0}
+
+
+def strip_data(spec):
+    """A copy of a spec dict with the inline data values and datasets emptied."""
+    spec = copy.copy(spec)
+    for key, value in spec.items():
+        if key == 'datasets' and isinstance(value, dict):
+            spec[key] = {name: [] for name in value}
+        elif key == 'data' and isinstance(value, dict) and 'values' in value:
+            spec[key] = dict(value, values=type(value['values'])())
+        elif isinstance(value, dict):
+            spec[key] = strip_data(value)
+        elif isinstance(value, list):
+            spec[key] = [strip_data(item) if isinstance(item, dict) else item for item in value]
+    return spec
+
+
+def _hash(spec):
+    payload = json.dumps(spec, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def shape_hash(spec):
+    """Hash of a spec dict without its data values."""
+    return _hash(strip_data(spec))
+
+
+@classmethod
+def _cached_validate(cls, instance, schema=None):
+    if not isinstance(instance, dict):
+        return _validate.__func__(cls, instance, schema)
+    stripped = strip_data(instance)
+    key = (cls.__name__, id(schema), _hash(stripped))
+    if key in _valid_shapes:
+        stats['cached'] += 1
+        return
+    _validate.__func__(cls, stripped, schema)
+    stats['validated'] += 1
+    _valid_shapes.add(key)
+
+
+def enable(mode=None):
+    """Switch the validation mode, by default the one BOOK_VALIDATION names (cached)."""
+    mode = mode or os.environ.get('BOOK_VALIDATION') or 'cached'
+    if mode not in MODES:
+        raise ValueError('unknown validation mode {!r}, expected one of {}'.format(mode, ', '.join(MODES)))
+    if mode == 'strict':
+        _schemapi.SchemaBase.validate = _validate
+        _schemapi.DEBUG_MODE = _debug_mode
+    else:
+        _schemapi.SchemaBase.validate = _cached_validate
+        # defer the checks of every intermediate object to serialization
+        _schemapi.DEBUG_MODE = False
+    return mode
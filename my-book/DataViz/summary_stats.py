@@ -0,0 +1,285 @@
+# One pass summary statistics of the street trees data.
+#
+# The EDA used trees_df.info(), trees_df.describe() and
+# trees_nan.groupby('species_name').describe(): three full passes over a
+# frame that has to be in memory, and a table of 8 statistics x every
+# numeric column x 171 species. Profiler reads the data a chunk at a time and
+# keeps, for every column and every group of the `by` columns, running
+# counts, null counts, min/max, mean and variance (chunk moments merged
+# exactly, the parallel form of Welford's update) and a quantile sketch, so
+# memory depends on the number of groups and not on the number of rows.
+# Dates are profiled like numbers (seconds since the epoch) and shown as
+# dates again.
+
+import html
+
+import numpy as np
+import pandas as pd
+
+from trees_data import CHUNK_ROWS, DATE_COLUMNS
+
+QUANTILES = (0.25, 0.5, 0.75)
+# items kept per sketch level, the rank error is about log2(n / SKETCH_SIZE) / SKETCH_SIZE
+SKETCH_SIZE = 256
+# groups per page of the rendered summary
+PAGE_SIZE = 20
+STATS = ['count', 'nulls', 'mean', 'std', 'min'] + ['{:g}%'.format(q * 100) for q in QUANTILES] + ['max']
+
+
+class QuantileSketch:
+    """Approximate quantiles of a stream of numbers in bounded memory.
+
+    A stack of compactors (KLL without the shrinking capacities): level h
+    holds items standing for 2**h values. When a level is over `size`
+    items it is sorted and every other item, starting at random, moves up a
+    level. Until the first compaction the quantiles are exact and
+    interpolated like pandas.
+    """
+
+    def __init__(self, size=SKETCH_SIZE, seed=0):
+        self.size = size
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.size:
+                items = np.sort(items)
+                # an odd item out stays behind
+                kept, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level] = kept
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1],
+                                                         items[self._rng.integers(2)::2]])
+            level += 1
+
+    def quantiles(self, qs):
+        if len(self.levels) == 1:
+            if not len(self.levels[0]):
+                return np.full(len(qs), np.nan)
+            return np.quantile(self.levels[0], qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        ranks = np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, np.asarray(qs) * ranks[-1], side='left')
+        return values[order][np.minimum(positions, len(values) - 1)]
+
+
+class _GroupStats:
+    """Running statistics of the numeric columns for the groups of one key."""
+
+    def __init__(self, n_columns, n_numeric, sketch_size):
+        self.groups = {}
+        self.sketch_size = sketch_size
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.nulls = np.zeros((n_columns, 0), dtype=np.int64)
+        self.count = np.zeros((n_numeric, 0))
+        self.mean = np.zeros((n_numeric, 0))
+        self.m2 = np.zeros((n_numeric, 0))
+        self.minimum = np.zeros((n_numeric, 0))
+        self.maximum = np.zeros((n_numeric, 0))
+        self.sketches = []
+
+    def _numbers(self, uniques):
+        """Row of every group in uniques, adding the new ones."""
+        for value in uniques:
+            if value not in self.groups:
+                self.groups[value] = len(self.groups)
+                self.sketches.append([QuantileSketch(self.sketch_size, seed=len(self.groups) * 1000 + j)
+                                      for j in range(len(self.count))])
+        n = len(self.groups)
+        if n > len(self.rows):
+            self.rows = np.pad(self.rows, (0, n - len(self.rows)))
+            for name in ('nulls', 'count', 'mean', 'm2'):
+                setattr(self, name, np.pad(getattr(self, name), [(0, 0), (0, n - getattr(self, name).shape[1])]))
+            self.minimum = np.pad(self.minimum, [(0, 0), (0, n - self.minimum.shape[1])], constant_values=np.inf)
+            self.maximum = np.pad(self.maximum, [(0, 0), (0, n - self.maximum.shape[1])], constant_values=-np.inf)
+        return np.array([self.groups[value] for value in uniques], dtype=np.int64)
+
+    def update(self, codes, uniques, nulls, numbers):
+        """Add a chunk: codes index uniques (-1 for a missing key), nulls is
+        (columns x rows) and numbers (numeric columns x rows, nan when missing)."""
+        keep = np.flatnonzero(codes >= 0)
+        groups = self._numbers(uniques)[codes[keep]]
+        # rows sorted by group, so each group's values are one slice for the sketches
+        order = np.argsort(groups, kind='stable')
+        groups, keep = groups[order], keep[order]
+        n = len(self.groups)
+        self.rows += np.bincount(groups, minlength=n)
+        for j, column_nulls in enumerate(nulls[:, keep]):
+            self.nulls[j] += np.bincount(groups, weights=column_nulls, minlength=n).astype(np.int64)
+        for j, values in enumerate(numbers[:, keep]):
+            valid = ~np.isnan(values)
+            g, x = groups[valid], values[valid]
+            count = np.bincount(g, minlength=n).astype(float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.bincount(g, weights=x, minlength=n) / count
+                m2 = np.bincount(g, weights=(x - mean[g]) ** 2, minlength=n)
+                # merge with the running moments (Chan et al.)
+                total = self.count[j] + count
+                delta = np.where(count > 0, mean - self.mean[j], 0.0)
+                self.mean[j] = np.where(count > 0, self.mean[j] + delta * count / total, self.mean[j])
+                self.m2[j] += np.where(count > 0, m2 + delta ** 2 * self.count[j] * count / total, 0.0)
+            self.count[j] = total
+            np.fmin.at(self.minimum[j], g, x)
+            np.fmax.at(self.maximum[j], g, x)
+            starts = np.flatnonzero(np.concatenate([[True], g[1:] != g[:-1]])) if len(g) else []
+            for start, end in zip(starts, list(starts[1:]) + [len(g)]):
+                self.sketches[g[start]][j].update(x[start:end])
+
+
+class Profiler:
+    """Summary statistics of a frame fed one chunk at a time.
+
+        profiler = Profiler(by=['species_name'])
+        for chunk in chunks:
+            profiler.update(chunk)
+        profile = profiler.result()
+    """
+
+    def __init__(self, by=(), quantiles=QUANTILES, sketch_size=SKETCH_SIZE):
+        self.by = list(by)
+        self.quantiles = tuple(quantiles)
+        self.sketch_size = sketch_size
+        self.columns = None
+
+    def _start(self, chunk):
+        self.columns = list(chunk.columns)
+        self.dtypes = chunk.dtypes.astype(str).to_dict()
+        self.dates = [column for column in self.columns if pd.api.types.is_datetime64_any_dtype(chunk[column])]
+        self.numeric = [column for column in self.columns
+                        if column in self.dates or (pd.api.types.is_numeric_dtype(chunk[column])
+                                                    and not pd.api.types.is_bool_dtype(chunk[column]))]
+        self.stats = {key: _GroupStats(len(self.columns), len(self.numeric), self.sketch_size)
+                      for key in [None] + self.by}
+
+    def update(self, chunk):
+        if self.columns is None:
+            self._start(chunk)
+        nulls = chunk[self.columns].isna().to_numpy().T
+        numbers = np.empty((len(self.numeric), len(chunk)))
+        for j, column in enumerate(self.numeric):
+            if column in self.dates:
+                values = pd.to_datetime(chunk[column])
+                numbers[j] = np.where(values.isna(), np.nan, values.to_numpy('int64') / 1e9)
+            else:
+                numbers[j] = pd.to_numeric(chunk[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        for key, stats in self.stats.items():
+            if key is None:
+                codes, uniques = np.zeros(len(chunk), dtype=np.int64), [None]
+            else:
+                codes, uniques = pd.factorize(chunk[key])
+                uniques = list(uniques)
+            stats.update(codes, uniques, nulls, numbers)
+
+    def result(self):
+        if self.columns is None:
+            raise ValueError('nothing to profile, no chunk was given')
+        return Profile(self)
+
+
+def profile_frame(frame, by=(), chunksize=CHUNK_ROWS, **kwargs):
+    """Profile a frame in memory, chunksize rows at a time."""
+    profiler = Profiler(by, **kwargs)
+    for start in range(0, len(frame), chunksize):
+        profiler.update(frame.iloc[start:start + chunksize])
+    return profiler.result()
+
+
+def profile_csv(source, by=(), columns=None, chunksize=CHUNK_ROWS, **kwargs):
+    """Profile a CSV without loading it, chunksize rows at a time.
+
+    source is anything read_csv accepts. Only `columns` are read when given.
+    """
+    profiler = Profiler(by, **kwargs)
+    parse_dates = [column for column in DATE_COLUMNS if columns is None or column in columns]
+    for chunk in pd.read_csv(source, usecols=columns, parse_dates=parse_dates, chunksize=chunksize):
+        profiler.update(chunk)
+    return profiler.result()
+
+
+class Profile:
+    """The statistics a Profiler collected, as tables.
+
+    summary() has one row per column, summary(key) one row per group and
+    numeric column. In a notebook the profile shows the overview and, for
+    every `by` key, the groups PAGE_SIZE at a time in collapsed sections.
+    """
+
+    def __init__(self, profiler):
+        self.by = profiler.by
+        self.columns = profiler.columns
+        self.dtypes = profiler.dtypes
+        self.numeric = profiler.numeric
+        self.dates = profiler.dates
+        self.quantiles = profiler.quantiles
+        self.rows = int(profiler.stats[None].rows.sum())
+        self._tables = {key: self._table(key, stats) for key, stats in profiler.stats.items()}
+
+    def _table(self, key, stats):
+        groups = list(stats.groups)
+        numeric = [column for column in self.numeric if column != key]
+        records = []
+        for row, group in enumerate(groups):
+            for column in (self.columns if key is None else numeric):
+                j = self.columns.index(column)
+                record = {'group': group, 'column': column, 'count': int(stats.rows[row] - stats.nulls[j, row]),
+                          'nulls': int(stats.nulls[j, row])}
+                if column in self.numeric:
+                    i = self.numeric.index(column)
+                    count = stats.count[i, row]
+                    values = [stats.mean[i, row] if count else np.nan,
+                              (stats.m2[i, row] / (count - 1)) ** 0.5 if count > 1 else np.nan,
+                              stats.minimum[i, row] if count else np.nan]
+                    values += list(stats.sketches[row][i].quantiles(self.quantiles))
+                    values.append(stats.maximum[i, row] if count else np.nan)
+                    record.update(zip(STATS[2:], values))
+                records.append(record)
+        table = pd.DataFrame.from_records(records, columns=['group', 'column'] + STATS)
+        dates = table['column'].isin(self.dates).to_numpy()
+        if dates.any():
+            table = table.astype({stat: object for stat in STATS[2:]})
+            for stat in STATS[2:]:
+                convert = pd.to_timedelta if stat == 'std' else pd.to_datetime
+                # nan becomes NaT, numpy warns about the cast on the way
+                with np.errstate(invalid='ignore'):
+                    table.loc[dates, stat] = list(convert(table.loc[dates, stat].astype(float), unit='s'))
+        if key is None:
+            table = table.drop(columns='group').set_index('column')
+            table.insert(0, 'dtype', [self.dtypes[column] for column in table.index])
+            return table
+        return table.rename(columns={'group': key}).set_index([key, 'column'])
+
+    def summary(self, key=None):
+        """Statistics per column, or per group of key and numeric column."""
+        return self._tables[key]
+
+    def groups(self, key):
+        return list(self._tables[key].index.unique(0))
+
+    def page(self, key, number=1, size=PAGE_SIZE):
+        """The summary rows of the number-th (from 1) size groups of key."""
+        groups = self.groups(key)[(number - 1) * size:number * size]
+        return self._tables[key].loc[groups]
+
+    def pages(self, key, size=PAGE_SIZE):
+        return max(1, -(-len(self.groups(key)) // size))
+
+    def _repr_html_(self):
+        parts = ['<p>{:,} rows, {} columns</p>'.format(self.rows, len(self.columns)),
+                 self.summary().to_html(float_format='{:.4g}'.format, na_rep='')]
+        for key in self.by:
+            groups = self.groups(key)
+            for number in range(1, self.pages(key) + 1):
+                first = (number - 1) * PAGE_SIZE
+                title = 'by {}: groups {}-{} of {}'.format(
+                    key, first + 1, min(first + PAGE_SIZE, len(groups)), len(groups))
+                parts.append('<details{}><summary>{}</summary>{}</details>'.format(
+                    ' open' if number == 1 else '', html.escape(title),
+                    self.page(key, number).to_html(float_format='{:.4g}'.format, na_rep='')))
+        return '\n'.join(parts)
@@ -0,0 +1,61 @@
+# Derived views of the street trees data shared by the EDA and the report.
+#
+# Both notebooks used to build the same frames cell by cell. Trees computes
+# each view the first time it is asked for and keeps it, so a notebook only
+# pays for the views it uses, and each one is built the cheap way: a single
+# column isna() instead of a full boolean frame, value_counts() instead of a
+# groupby count over every column.
+
+from functools import cached_property
+
+from trees_data import TREES_URL, load_trees
+
+
+class Trees:
+    """Lazily computed views of a street trees frame.
+
+        trees = Trees.load()
+        trees.trees_small      # dated trees with a year_planted column
+        trees.top_common(10)   # the 10 most common common_names
+    """
+
+    def __init__(self, trees_df, n_common=10):
+        self.trees_df = trees_df
+        self.n_common = n_common
+
+    @classmethod
+    def load(cls, url=TREES_URL, drop=(), **kwargs):
+        """Load the data through the trees_data cache, dropping the `drop` columns."""
+        return cls(load_trees(url).drop(columns=list(drop)), **kwargs)
+
+    @cached_property
+    def trees_small(self):
+        """Trees with a planting date, plus the year they were planted."""
+        dated = self.trees_df[self.trees_df['date_planted'].notna()]
+        return dated.assign(year_planted=dated['date_planted'].dt.year)
+
+    @cached_property
+    def trees_nan(self):
+        """All trees, with date_record True where the planting date is missing."""
+        return self.trees_df.assign(date_record=self.trees_df['date_planted'].isna())
+
+    def top_common(self, n=None):
+        """List of the n most common common_names, most common first."""
+        n = n or self.n_common
+        if n == self.n_common:
+            return list(self._top_common)
+        return self._common_counts.nlargest(n).index.tolist()
+
+    @cached_property
+    def _common_counts(self):
+        return self.trees_df['common_name'].value_counts()
+
+    @cached_property
+    def _top_common(self):
+        return tuple(self._common_counts.nlargest(self.n_common).index)
+
+    @cached_property
+    def trees_nan_small(self):
+        """trees_nan restricted to the top_common() names."""
+        common = self.trees_nan['common_name'].isin(self._top_common)
+        return self.trees_nan[common]
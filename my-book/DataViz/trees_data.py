@@ -0,0 +1,273 @@
+# Load the Vancouver street trees data with a local on-disk cache.
+#
+# Both DataViz notebooks read the same CSV from GitHub. Instead of downloading
+# and parsing it on every book build, the parsed frame is stored once in a
+# columnar file with the dtypes already resolved, so a warm load is a local
+# read with no network.
+#
+# Environment variables:
+#   TREES_CACHE_DIR  where cached frames are stored (default: _build/.data_cache)
+#   TREES_FROZEN     set to 1 to never touch the network (CI / offline builds)
+
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+TREES_URL = 'https://raw.githubusercontent.com/UBC-MDS/data_viz_wrangled/main/data/Trees_data_sets/small_unique_vancouver.csv'
+
+# columns stored as categoricals, everything else keeps the read_csv dtype
+CATEGORY_COLUMNS = ['species_name', 'common_name', 'neighbourhood_name',
+                    'root_barrier', 'street_side_name']
+DATE_COLUMNS = ['date_planted']
+
+CACHE_DIR = os.environ.get(
+    'TREES_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '_build', '.data_cache'))
+
+# pickle keeps categoricals and datetimes too, it is just less portable
+CACHE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pickle'
+
+
+class TreesCacheError(RuntimeError):
+    """Raised when frozen mode is on and the data is not in the cache."""
+
+
+def is_frozen():
+    return os.environ.get('TREES_FROZEN', '').lower() in ('1', 'true', 'yes')
+
+
+def parse_trees(raw):
+    """Parse the raw CSV bytes into a frame with compact dtypes."""
+    trees = pd.read_csv(io.BytesIO(raw), parse_dates=DATE_COLUMNS)
+    for column in CATEGORY_COLUMNS:
+        if column in trees.columns:
+            trees[column] = trees[column].astype('category')
+    return trees
+
+
+def _index_path(cache_dir):
+    return os.path.join(cache_dir, 'index.json')
+
+
+def _read_index(cache_dir):
+    try:
+        with open(_index_path(cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(cache_dir, index):
+    # write then rename so an interrupted build never leaves a broken index, with
+    # a temp file per process as notebooks run in parallel share the cache
+    tmp = '{}.{}.tmp'.format(_index_path(cache_dir), os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, _index_path(cache_dir))
+
+
+def _frame_path(cache_dir, url, digest):
+    # keyed by url + content hash, so the same file from two urls or two
+    # versions of the file at one url never collide
+    key = hashlib.sha256((url + '\n' + digest).encode()).hexdigest()[:32]
+    return os.path.join(cache_dir, key + '.' + CACHE_FORMAT)
+
+
+def _save_frame(trees, path):
+    # like the index, so an interrupted build never leaves a truncated frame
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    if CACHE_FORMAT == 'parquet':
+        trees.to_parquet(tmp, index=False)
+    else:
+        trees.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def _load_frame(path):
+    if CACHE_FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _fetch(url, entry, timeout):
+    """Download url, sending validators from a previous download if we have them.
+
+    Returns (raw_bytes, headers), raw_bytes is None when the server answered
+    304 Not Modified.
+    """
+    request = urllib.request.Request(url)
+    if entry.get('etag'):
+        request.add_header('If-None-Match', entry['etag'])
+    if entry.get('last_modified'):
+        request.add_header('If-Modified-Since', entry['last_modified'])
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read(), response.headers
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return None, err.headers
+        raise
+
+
+def load_trees(url=TREES_URL, revalidate=False, frozen=None, cache_dir=None, timeout=30):
+    """Return the street trees frame for url, using the local cache when possible.
+
+    By default a cached copy is used without any network access. With
+    revalidate=True the server is asked whether the file changed (ETag /
+    Last-Modified) and it is only downloaded and re-parsed if it did. In
+    frozen mode (frozen=True or TREES_FROZEN=1) the network is never used and
+    a missing cache entry raises TreesCacheError.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    frozen = is_frozen() if frozen is None else frozen
+    os.makedirs(cache_dir, exist_ok=True)
+
+    index = _read_index(cache_dir)
+    entry = index.get(url, {})
+    cached = None
+    if entry.get('sha256'):
+        path = _frame_path(cache_dir, url, entry['sha256'])
+        if os.path.exists(path):
+            cached = path
+
+    if cached and (frozen or not revalidate):
+        return _load_frame(cached)
+    if frozen:
+        raise TreesCacheError(
+            'no cached copy of {} in {} and frozen mode is on'.format(url, cache_dir))
+
+    raw, headers = _fetch(url, entry if cached else {}, timeout)
+    if raw is None:
+        return _load_frame(cached)
+
+    digest = hashlib.sha256(raw).hexdigest()
+    path = _frame_path(cache_dir, url, digest)
+    if digest == entry.get('sha256') and cached:
+        trees = _load_frame(cached)
+    else:
+        trees = parse_trees(raw)
+        _save_frame(trees, path)
+
+    index[url] = {'sha256': digest,
+                  'etag': headers.get('ETag'),
+                  'last_modified': headers.get('Last-Modified')}
+    _write_index(cache_dir, index)
+    return trees
+
+
+# -- streaming path for inventories too large to load at once -------------------
+
+# only the columns the report charts aggregate, with compact dtypes
+STREAM_COLUMNS = ['species_name', 'root_barrier', 'date_planted', 'diameter', 'height_range_id']
+STREAM_DTYPES = {'species_name': 'category', 'root_barrier': 'category',
+                 'diameter': 'float64', 'height_range_id': 'int8'}
+SIZE_COLUMNS = ['diameter', 'height_range_id']
+CHUNK_ROWS = 100000
+
+
+def _count_tables(trees_small):
+    """Counts the charts need, from dated trees with a year_planted column."""
+    return {
+        'year': trees_small.groupby('year_planted').size(),
+        'species_year': trees_small.groupby(['species_name', 'year_planted'], observed=True).size(),
+        'root_barrier_year': trees_small.groupby(['root_barrier', 'year_planted'], observed=True).size(),
+    }
+
+
+def _dated(chunk):
+    dated = chunk[chunk['date_planted'].notna()]
+    return dated.assign(year_planted=dated['date_planted'].dt.year)
+
+
+def aggregate_frame(trees_df):
+    """Chart aggregates computed in memory from a full trees frame.
+
+    Counts per year, per species x year and per root_barrier x year of the
+    dated trees, and count/mean/std/min/max of diameter and height per
+    root_barrier.
+    """
+    trees_small = _dated(trees_df)
+    aggregates = _count_tables(trees_small)
+    aggregates['size'] = (trees_small.groupby('root_barrier', observed=True)[SIZE_COLUMNS]
+                          .agg(['count', 'mean', 'std', 'min', 'max']))
+    return aggregates
+
+
+def _size_partial(trees_small):
+    grouped = trees_small.groupby('root_barrier', observed=True)[SIZE_COLUMNS]
+    count = grouped.count()
+    return {'count': count, 'mean': grouped.mean(), 'm2': grouped.var(ddof=0) * count,
+            'min': grouped.min(), 'max': grouped.max()}
+
+
+def _combine_sizes(partials):
+    """Merge per-chunk (count, mean, m2) into exact totals, then std like pandas."""
+    stats = {key: pd.concat([partial[key] for partial in partials]) for key in partials[0]}
+    by = stats['count'].index.name
+    count = stats['count'].groupby(by).sum()
+    mean = (stats['mean'] * stats['count']).groupby(by).sum() / count
+    spread = stats['count'] * (stats['mean'] - mean.reindex(stats['mean'].index)) ** 2
+    m2 = (stats['m2'] + spread).groupby(by).sum()
+    summary = {'count': count, 'mean': mean, 'std': (m2 / (count - 1)) ** 0.5,
+               'min': stats['min'].groupby(by).min(), 'max': stats['max'].groupby(by).max()}
+    frame = pd.concat(summary, axis=1).swaplevel(0, 1, axis=1)
+    return frame[[(column, stat) for column in SIZE_COLUMNS for stat in summary]]
+
+
+def aggregate_csv(source, chunksize=CHUNK_ROWS):
+    """Stream a street trees CSV and return the same tables as aggregate_frame().
+
+    Only STREAM_COLUMNS are parsed, chunksize rows at a time, and only the
+    running counts and per-chunk size moments are kept, so peak memory depends
+    on chunksize and the number of species and years, not on the file size.
+    source is anything read_csv accepts: a path, url or open file.
+    """
+    counts = None
+    sizes = []
+    chunks = pd.read_csv(source, usecols=STREAM_COLUMNS, dtype=STREAM_DTYPES,
+                         parse_dates=DATE_COLUMNS, chunksize=chunksize)
+    for chunk in chunks:
+        trees_small = _dated(chunk)
+        if trees_small.empty:
+            continue
+        tables = _count_tables(trees_small)
+        if counts is None:
+            counts = tables
+        else:
+            counts = {name: counts[name].add(table, fill_value=0) for name, table in tables.items()}
+        sizes.append(_size_partial(trees_small))
+    aggregates = {name: table.astype('int64').sort_index() for name, table in counts.items()}
+    aggregates['size'] = _combine_sizes(sizes)
+    return aggregates
+
+
+def compare_aggregates(streamed, in_memory, rtol=1e-9):
+    """Return a list of differences between two sets of aggregates (empty when they match).
+
+    Counts, min and max must be identical. Means and standard deviations are
+    sums of floats added in a different order, so they only have to agree to
+    rtol.
+    """
+    problems = []
+    for name in ('year', 'species_year', 'root_barrier_year'):
+        left = {key: int(value) for key, value in streamed[name].items() if value}
+        right = {key: int(value) for key, value in in_memory[name].items() if value}
+        if left != right:
+            problems.append('{} counts differ'.format(name))
+    left = streamed['size'].set_axis(streamed['size'].index.astype(str), axis=0)
+    right = in_memory['size'].set_axis(in_memory['size'].index.astype(str), axis=0)
+    right = right.reindex(index=left.index, columns=left.columns)
+    for column in left.columns:
+        a, b = left[column].to_numpy(dtype='float64'), right[column].to_numpy(dtype='float64')
+        exact = column[1] in ('count', 'min', 'max')
+        same = (a == b) | (np.isnan(a) & np.isnan(b)) if exact else np.isclose(a, b, rtol=rtol, equal_nan=True)
+        if not same.all():
+            problems.append('size {} {} differs'.format(*column))
+    return problems
@@ -16,9 +16,16 @@
 
 
 # Import libraries needed for this analysis
-import pandas as pd
 import altair as alt
-import json
+from trees_data import load_trees
+from trees import Trees
+from book_charts import point_layer, prepare_chart
+from boundaries import area_aggregates, boundary_data, choropleth
+from summary_stats import profile_frame
+import spec_validation
+alt.data_transformers.enable('book_static')
+# validate each chart's spec once per shape, without its data (BOOK_VALIDATION=strict in CI)
+spec_validation.enable()
 
 
 # pandas {cite}`The_pandas_development_team_pandas-dev_pandas_Pandas` is used to handle data, altair {cite}`altair` is a package used for graphing, and json {cite}`Lohmann_JSON_for_Modern_2022` is used to [create maps.](city-map)
@@ -28,15 +35,18 @@ import json
 
 # Load in the data and view a subset
 trees_url = 'https://raw.githubusercontent.com/UBC-MDS/data_viz_wrangled/main/data/Trees_data_sets/small_unique_vancouver.csv'
-trees_df = pd.read_csv(trees_url, parse_dates=['date_planted'])
+trees = Trees(load_trees(trees_url))
+trees_df = trees.trees_df
 trees_df.head()
 
 
 # In[3]:
 
 
-# get more information about our datasset
-trees_df.info()
+# get more information about our datasset: counts, missing values and statistics
+# of every column, and of every column per species, in one pass over the data
+trees_profile = profile_frame(trees_df, by=['species_name'])
+trees_profile.summary()
 
 
 # ## Questions of Interest
@@ -67,7 +77,7 @@ trees_date
 
 
 # add a boolean column to our datafrom for data_planted data available
-trees_nan = trees_df.assign(date_record = trees_df.isna().loc[:, 'date_planted'])
+trees_nan = trees.trees_nan
 trees_nan.head()
 
 
@@ -76,8 +86,8 @@ trees_nan.head()
 # In[6]:
 
 
-species = trees_nan.groupby("species_name")
-species.describe()
+# statistics per species from the profile, 20 species per page
+trees_profile
 
 
 # (top-10)=
@@ -96,9 +106,7 @@ species.describe()
 
 
 #find the 10 most common trees in our dataset
-trees_common = (trees_nan.groupby("common_name").count().sort_values(by='tree_id', ascending=False
-                ).reset_index().loc[0:9])
-trees_common = trees_common["common_name"].tolist()
+trees_common = trees.top_common(10)
 trees_common
 
 
@@ -106,8 +114,7 @@ trees_common
 
 
 # filter trees_nan to include only the most common trees
-common_records = trees_nan.common_name.isin(trees_common)
-trees_nan_small = trees_nan[common_records]
+trees_nan_small = trees.trees_nan_small
 
 
 # In[9]:
@@ -140,10 +147,8 @@ tree_diam
 # In[10]:
 
 
-# remove entries with no date_planted
-trees_small = trees_df.dropna(subset=['date_planted'])
-# create a new column with just year 
-trees_small = trees_small.assign(year_planted = trees_small['date_planted'].dt.year)
+# remove entries with no date_planted and add a column with just the year
+trees_small = trees.trees_small
 
 
 # In[11]:
@@ -153,7 +158,7 @@ trees_small = trees_small.assign(year_planted = trees_small['date_planted'].dt.y
 trees_time = alt.Chart(trees_small).mark_bar().encode(
              alt.X('year_planted:O'),
              alt.Y('count()'))
-trees_time
+prepare_chart(trees_time)
 
 
 # (click-filter)=
@@ -184,7 +189,7 @@ species_select = (alt.Chart(trees_small).transform_filter(click_year).mark_bar()
                     rank='rank(species_count)',
                     sort=[alt.SortField("species_count", order="descending")]
                     ).transform_filter((alt.datum.rank <= 10)).add_selection(click_year))
-species_select & click_trees_year
+prepare_chart(species_select & click_trees_year)
 
 
 # Interesting, there is less overlap in the top 10 species per year than I thought there would be. Now, I would like to look more at the size of trees. I wonder how the method of planting affects a tree's size. To visualize I will use our [top 10 data subset](Top-10).
@@ -231,7 +236,7 @@ tree_side
 
 
 root_barrier = trees_time.encode(color="root_barrier:N")
-root_barrier
+prepare_chart(root_barrier)
 
 
 # It looks like most of the trees with root barriers were planted between 2004 and 2009. Let's filter our data to include just those years and see if the pattern still holds. 
@@ -257,7 +262,8 @@ tree_height_filter
 
 # load data to make a map of vancouver (code provided)
 url_geojson = 'https://raw.githubusercontent.com/UBC-MDS/exploratory-data-viz/main/data/local-area-boundary.geojson'
-data_geojson_remote = alt.Data(url=url_geojson, format=alt.DataFormat(property='features',type='json'))
+# simplified local copy served from _static instead of the full file on GitHub
+data_geojson_remote = boundary_data(url_geojson)
 data_geojson_remote
 
 
@@ -275,11 +281,8 @@ vancouver_map
 # In[21]:
 
 
-#Map location of all trees in Vancouver
-points = alt.Chart(trees_small).mark_circle(size=20).encode(
-         longitude='longitude',
-         latitude='latitude',
-         ).project(type= 'identity', reflectY=True)
+#Map location of all trees in Vancouver, a large inventory is drawn as grid cells
+points = point_layer(trees_small, size=20)
 
 point_map = (vancouver_map + points)
 point_map
@@ -294,7 +297,22 @@ point_map = point_map.encode(
                 opacity=alt.condition(click_year, alt.value(1), alt.value(0.1)),
                 color="species_name:N"
                 ).add_selection(click_year)
-point_map & click_trees_year
+prepare_chart(point_map & click_trees_year)
+
+
+# Points make it hard to compare neighbourhoods, so I am also going to count the trees planted in each local area per year. Each tree is placed in the local area its location falls in.
+
+# In[23]:
+
+
+# trees, species and mean diameter per local area and year
+area_trees = area_aggregates(trees_small)
+year_slider = alt.binding_range(name='Year Planted ', min=area_trees['year_planted'].min(),
+                                max=area_trees['year_planted'].max(), step=1)
+select_year = alt.selection_single(fields=['year_planted'], bind=year_slider,
+                                   init={'year_planted': area_trees['year_planted'].min()})
+area_map = choropleth(area_trees, data_geojson_remote, value='tree_count', selection=select_year)
+(vancouver_map + area_map).add_selection(select_year)
 
 
 # ## Conclusion
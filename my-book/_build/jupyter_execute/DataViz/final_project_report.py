@@ -21,18 +21,28 @@
 
 
 # Import libraries needed for this analysis
-import pandas as pd
 import altair as alt
-import json
 from myst_nb import glue
-#alt.data_transformers.enable("data_server")
+from trees_data import load_trees
+from trees import Trees
+from book_charts import partitioned_data, point_layer, prepare_chart
+from data_cube import DataCube, cube_data
+from boundaries import boundary_data
+import spec_validation
+# with BOOK_DATA_SERVER=1 the year and dashboard charts ask DataViz/data_server.py for their rows
+import data_server
+# write chart data to _static/data instead of inlining it in every output
+alt.data_transformers.enable('book_static')
+# validate each chart's spec once per shape, without its data (BOOK_VALIDATION=strict in CI)
+spec_validation.enable()
 
 # Load in the data
 trees_url = 'https://raw.githubusercontent.com/UBC-MDS/data_viz_wrangled/main/data/Trees_data_sets/small_unique_vancouver.csv'
-trees_df = pd.read_csv(trees_url, parse_dates=['date_planted'])
+trees_df = load_trees(trees_url)
 
 #remove colunm that represented the index in the origional dataset
 trees_df = trees_df.drop(columns=['Unnamed: 0'])
+trees = Trees(trees_df)
 
 
 # ## Describe the dataset
@@ -101,11 +111,8 @@ trees_df.describe()
 # In[3]:
 
 
-# remove entries with no date planted
-trees_small = trees_df.dropna(subset=['date_planted'])
-
-# create a new date column with just year 
-trees_small = trees_small.assign(year_planted = trees_small['date_planted'].dt.year)
+# remove entries with no date planted and add a new date column with just year
+trees_small = trees.trees_small
 
 
 # ### Question 1: How has the number and type of trees planted changed over time?
@@ -117,7 +124,7 @@ trees_small = trees_small.assign(year_planted = trees_small['date_planted'].dt.y
 trees_time = alt.Chart(trees_small).mark_bar(color='darkgray').encode(
              alt.X('year_planted:O', title="Year Planted"),
              alt.Y('count()', title="Number of Trees"))
-glue("trees_time", trees_time, display=False)
+glue("trees_time", prepare_chart(trees_time), display=False)
 
 
 # ```{glue:figure} trees_time
@@ -138,20 +145,27 @@ click_trees_year = (trees_time.encode(
                   .add_selection(click_year))
 
 # select 10 most common trees per year
-species_select = (alt.Chart(trees_small).transform_filter(click_year).mark_bar().encode(
+if data_server.enabled():
+    # the server answers with the top 10 species of the clicked years
+    species_select = alt.Chart(data_server.served_data('trees_small', click_year, groupby=['species_name'],
+                                                       top=10, count='species_count')).mark_bar()
+else:
+    species_select = (alt.Chart(trees_small).transform_filter(click_year).mark_bar(
+                        ).transform_aggregate(
+                        species_count="count()",
+                        groupby=["species_name"]
+                        ).transform_window(
+                        rank='rank(species_count)',
+                        sort=[alt.SortField("species_count", order="descending")]
+                        ).transform_filter((alt.datum.rank <= 10)
+                        ).add_selection(click_year))
+species_select = species_select.encode(
                     alt.Y('species_name:N', sort='x', title="Species Name"),
                     alt.X('species_count:Q', title="Amount Planted"),
                     alt.Color('species_name:N', legend=None, scale=alt.Scale(scheme='category20'))
-                    ).transform_aggregate(
-                    species_count="count()",
-                    groupby=["species_name"]
-                    ).transform_window(
-                    rank='rank(species_count)',
-                    sort=[alt.SortField("species_count", order="descending")]
-                    ).transform_filter((alt.datum.rank <= 10)
-                    ).add_selection(click_year).properties(height=250))
+                    ).properties(height=250)
 (species_select & click_trees_year)
-glue("species_select",species_select, display=False)
+glue("species_select", prepare_chart(species_select), display=False)
 
 
 # ```{glue:figure} species_select
@@ -176,7 +190,14 @@ glue("species_select",species_select, display=False)
 
 
 # Create a scatter plot to visualize tree growth
-size_chart = (alt.Chart(trees_small).transform_filter(click_year).mark_circle().encode(
+if data_server.enabled():
+    # the server answers with the trees of the clicked years
+    size_data = alt.Chart(data_server.served_data('trees_small', click_year,
+                                                  columns=['height_range_id', 'diameter', 'species_name',
+                                                           'root_barrier']))
+else:
+    size_data = alt.Chart(trees_small).transform_filter(click_year).add_selection(click_year)
+size_chart = (size_data.mark_circle().encode(
                     alt.Y('height_range_id:Q', title="Height"),
                     alt.X('diameter:Q', title=("Diameter")),
                     alt.Color('species_name:N', legend=None, scale=alt.Scale(scheme='category20')),
@@ -184,12 +205,11 @@ size_chart = (alt.Chart(trees_small).transform_filter(click_year).mark_circle().
                              alt.Tooltip('height_range_id', title='Height'),
                              alt.Tooltip('diameter', title='Diameter')],
                     facet=alt.Facet('root_barrier:N', title="Root Barrier Y/N")
-                    ).add_selection(click_year) 
-                    .properties(height=200, width=250))
+                    ).properties(height=200, width=250))
 
 # Make chart selectabe with year chart
 size_click = (size_chart & click_trees_year)
-glue("size_click", size_click, display=False)
+glue("size_click", prepare_chart(size_click), display=False)
 
 
 # ```{glue:figure} size_click
@@ -207,25 +227,23 @@ glue("size_click", size_click, display=False)
 
 # load data to make a map of vancouver (code provided)
 url_geojson = 'https://raw.githubusercontent.com/UBC-MDS/exploratory-data-viz/main/data/local-area-boundary.geojson'
-data_geojson_remote = alt.Data(url=url_geojson, format=alt.DataFormat(property='features',type='json'))
+# simplified local copy served from _static instead of the full file on GitHub
+data_geojson_remote = boundary_data(url_geojson)
 
 # base map of Vancouver (code provided)
 vancouver_map = alt.Chart(data_geojson_remote).mark_geoshape(
     color = 'white', opacity= 0.5, stroke='black').encode(
 ).project(type='identity', reflectY=True)
 
-#Map location of all trees in Vancouver
-points = alt.Chart(trees_small).mark_circle(size=10).encode(
-         longitude='longitude',
-         latitude='latitude'
-         ).project(type= 'identity', reflectY=True)
+#Map location of all trees in Vancouver, a large inventory is drawn as grid cells
+points = point_layer(trees_small, size=10)
 # Layer points and Vancouver map. Add filter for year planted
 point_map = (vancouver_map + points).add_selection(click_year).encode(
             opacity=alt.condition(click_year, alt.value(1), alt.value(0.05)))
 #add year chart to filter data
 click_trees_year = click_trees_year.encode(color=alt.value('darkgray'))
 point_click_year = (point_map & click_trees_year)
-glue("point_click_year",point_click_year, display=False)
+glue("point_click_year", prepare_chart(point_click_year), display=False)
 
 
 # ```{glue:figure} point_click_year
@@ -255,33 +273,42 @@ select_dashboard = alt.selection_single(
                    fields=['year_planted', 'root_barrier'],
                    bind={'year_planted': year_slider, 'root_barrier': radiobuttons_root},
                    init={'root_barrier': 'N', 'year_planted': year_min})
-# add selection filter to point map
-point_map = point_map.add_selection(select_dashboard).encode(
-            opacity=alt.condition(select_dashboard, alt.value(1), alt.value(0.05)))
-# add selection filter to top 100 species chart
-species_select = (alt.Chart(trees_small).transform_filter(select_dashboard).mark_bar().encode(
+# the dashboard map only loads the points of the selected year and root barrier,
+# the neighbouring years are fetched in the background
+dashboard_points = alt.Chart(partitioned_data(trees_small, select_dashboard,
+                                              columns=['longitude', 'latitude', 'diameter', 'species_name'])
+                             ).mark_circle().encode(
+                             longitude='longitude:Q',
+                             latitude='latitude:Q'
+                             ).project(type='identity', reflectY=True)
+if data_server.enabled():
+    # the server answers with the top 10 species of the selected year and root barrier
+    species_top = alt.Chart(data_server.served_data('trees_small', select_dashboard, groupby=['species_name'],
+                                                    top=10, count='species_count'))
+else:
+    # top 10 species of the selected year and root barrier, the page answers them
+    # from tree counts per year, root barrier and species instead of filtering the trees
+    species_top = alt.Chart(cube_data(DataCube(trees_small), 'species_name', [select_dashboard],
+                                      count='species_count', top=10,
+                                      views=[('year_planted', 'root_barrier', 'species_name')]))
+# add selection filter to top 10 species chart
+species_select = (species_top.mark_bar().encode(
                     alt.Y('species_name:N', sort='x', title="Species Name"),
                     alt.X('species_count:Q', title="Amount Planted"),
                     alt.Color('species_name:N', legend=None, scale=alt.Scale(scheme='category20'))
-                    ).transform_aggregate(
-                    species_count="count()",
-                    groupby=["species_name"]
-                    ).transform_window(
-                    rank='rank(species_count)',
-                    sort=[alt.SortField("species_count", order="descending")]
-                    ).transform_filter((alt.datum.rank <= 10))
-                    ).properties(height=200, width=250, title="Click to Select Species")
+                    ).properties(height=200, width=250, title="Click to Select Species"))
 # make top 10 species chart clickable
-click_species = alt.selection_multi(encodings=['y'], on='click', nearest=True)
+click_species = alt.selection_multi(fields=['species_name'], on='click', nearest=True)
 species_select = species_select.add_selection(click_species).encode(
                  opacity=alt.condition(click_species, alt.value(1), alt.value(0.05)))
 # filter point map by species. Encode diameter to size
-point_map = point_map.encode(
-            size=alt.Size('diameter:Q', legend=None, title="Diameter"),
-            color=alt.condition(click_species, 'species_name:N', alt.value('white'))
-            ).add_selection(click_species)
+dashboard_points = dashboard_points.encode(
+                   size=alt.Size('diameter:Q', legend=None, title="Diameter"),
+                   color=alt.condition(click_species, 'species_name:N', alt.value('white'))
+                   ).add_selection(click_species)
+point_map = (vancouver_map + dashboard_points).add_selection(select_dashboard)
 #Layer charts and add title
-((point_map | species_select)
+prepare_chart((point_map | species_select)
  .properties(title={'text': ["Size and Distribution of Vancouver Street Trees"],
             'subtitle': ["Filter by top 10 species per year. Point size is proportional to tree diameter."]}
             ).configure_title(anchor='middle'))
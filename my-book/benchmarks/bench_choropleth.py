@@ -0,0 +1,81 @@
+# Time the neighbourhood choropleth: placing every tree in its local area and
+# aggregating per area and year.
+#
+#     python benchmarks/bench_choropleth.py [--rows 5000 50000 150000 500000]
+#
+# Areas come from synthetic.make_areas(), about as many vertices as the real
+# boundary file. For every size this prints the time to locate the trees, to
+# aggregate them and to build the chart spec, and the number of trees in a
+# sample whose area differs from a plain ray cast against every edge, which
+# should always be 0.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'DataViz'))
+
+import altair as alt  # noqa: E402
+
+from boundaries import AreaIndex, area_aggregates, assign_areas, choropleth  # noqa: E402
+from synthetic import make_areas, make_trees_small  # noqa: E402
+
+
+def brute_force(features, x, y):
+    """Area name of every point, testing each point against every ring."""
+    found = np.full(len(x), None, dtype=object)
+    for feature in features:
+        inside = np.zeros(len(x), dtype=bool)
+        for ring in feature['geometry']['coordinates']:
+            ring = np.asarray(ring)
+            x0, y0 = ring[:-1, 0], ring[:-1, 1]
+            x1, y1 = ring[1:, 0], ring[1:, 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crosses = (((y0 > y[:, None]) != (y1 > y[:, None]))
+                           & (x[:, None] < x0 + (y[:, None] - y0) * (x1 - x0) / (y1 - y0)))
+            inside ^= np.logical_xor.reduce(crosses, axis=1)
+        found[inside] = feature['properties']['name']
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the point-in-polygon neighbourhood choropleth.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 150000, 500000])
+    parser.add_argument('--vertices', type=int, default=100, help='points on every side of an area')
+    parser.add_argument('--sample', type=int, default=2000, help='trees checked against the brute force')
+    args = parser.parse_args(argv)
+
+    features = make_areas(vertices=args.vertices)
+    start = time.perf_counter()
+    index = AreaIndex(features)
+    print('index of {} areas built in {:.3f} s'.format(len(index.names), time.perf_counter() - start))
+    print('{:>8} {:>9} {:>11} {:>9} {:>8} {:>10}'.format(
+        'rows', 'locate', 'aggregate', 'chart', 'groups', 'mismatch'))
+    for rows in args.rows:
+        # the generator drops the undated half, ask for twice as many
+        trees = make_trees_small(rows * 2)[:rows]
+        start = time.perf_counter()
+        located = assign_areas(trees, index)
+        locate = time.perf_counter() - start
+        start = time.perf_counter()
+        table = area_aggregates(located)
+        aggregate = time.perf_counter() - start
+        start = time.perf_counter()
+        # the book looks the shapes up from a file, inlining them would time their validation
+        choropleth(table, alt.Data(url='areas.json', format=alt.DataFormat(property='features', type='json'))
+                   ).to_dict()
+        chart = time.perf_counter() - start
+
+        sample = located.sample(min(args.sample, rows), random_state=0)
+        expected = brute_force(features, sample['longitude'].to_numpy(), sample['latitude'].to_numpy())
+        actual = sample['local_area'].astype(object).where(sample['local_area'].notna(), None).to_numpy()
+        mismatch = int((expected != actual).sum())
+        print('{:>8} {:>9.3f} {:>11.3f} {:>9.3f} {:>8} {:>10}'.format(
+            rows, locate, aggregate, chart, len(table), mismatch))
+
+
+if __name__ == '__main__':
+    main()
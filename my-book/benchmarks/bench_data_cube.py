@@ -0,0 +1,72 @@
+# Compare answering the dashboard selections from the data cube with
+# filtering and aggregating the tree rows, as Vega does without it.
+#
+#     python benchmarks/bench_data_cube.py [--rows 5000 50000 500000]
+#
+# For every size this prints the time to build the cube, the bytes of the
+# arrays the page loads (the small ones up front, the full cube on the first
+# species click) and the time of one interaction: the top species and the
+# map cells for a year, a root barrier and a clicked species. The cube
+# answers with lookups, so its column should stay flat as rows grow while
+# the row filter grows with them.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'DataViz'))
+
+import numpy as np  # noqa: E402
+
+from data_cube import CUBE_VIEWS, DataCube  # noqa: E402
+from synthetic import make_trees_small  # noqa: E402
+
+
+def best_of(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def from_cube(cube, year, root_barrier, species):
+    cube.query('species_name', year_planted=[year], root_barrier=[root_barrier]).nlargest(10)
+    cube.query('cell', year_planted=[year], root_barrier=[root_barrier], species_name=[species])
+
+
+def from_rows(trees, cell_size, year, root_barrier, species):
+    selected = trees[(trees['year_planted'] == year) & (trees['root_barrier'] == root_barrier)]
+    selected['species_name'].value_counts().nlargest(10)
+    selected = selected[selected['species_name'] == species]
+    (selected.groupby([np.floor(selected['longitude'] / cell_size),
+                       np.floor(selected['latitude'] / cell_size)]).size())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard data cube against filtering rows.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 500000])
+    args = parser.parse_args(argv)
+
+    print('{:>8} {:>9} {:>12} {:>12} {:>11} {:>11}'.format(
+        'rows', 'build', 'small bytes', 'full bytes', 'cube query', 'row filter'))
+    for rows in args.rows:
+        # the generator drops the undated half, ask for twice as many
+        trees = make_trees_small(rows * 2)[:rows]
+        start = time.perf_counter()
+        cube = DataCube(trees)
+        build = time.perf_counter() - start
+        sizes = [cube.project(view).max() for view in CUBE_VIEWS]
+        nbytes = [int(np.prod(cube.project(view).shape)) * np.dtype(np.min_scalar_type(size)).itemsize
+                  for view, size in zip(CUBE_VIEWS, sizes)]
+        choice = (2005, 'N', trees['species_name'].mode()[0])
+        cube_seconds = best_of(lambda: from_cube(cube, *choice))
+        row_seconds = best_of(lambda: from_rows(trees, cube.cell_size, *choice))
+        print('{:>8} {:>9.3f} {:>12} {:>12} {:>11.4f} {:>11.4f}'.format(
+            rows, build, sum(nbytes[:-1]), nbytes[-1], cube_seconds, row_seconds))
+
+
+if __name__ == '__main__':
+    main()
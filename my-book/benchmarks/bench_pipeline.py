@@ -0,0 +1,211 @@
+# Benchmark the analysis pipeline and chart serialization of the report.
+#
+#     python benchmarks/bench_pipeline.py [--rows 5000 50000 500000]
+#     python benchmarks/bench_pipeline.py --save-baseline
+#
+# Every stage runs against synthetic data with the street trees schema
+# (benchmarks/synthetic.py): CSV parsing, chunked aggregation, cleaning, the
+# groupby/describe profiling and its one pass replacement, and building +
+# serializing each glued figure.
+# For each stage this reports wall time, peak traced memory and, for figures,
+# the bytes of the emitted Vega-Lite spec. Results are compared with the committed
+# baseline (benchmarks/baseline.json, only the sizes it holds are compared) and
+# the run exits non-zero when a stage got hungrier or heavier than --tolerance
+# allows, or slower than --time-tolerance allows. The timings in the baseline are
+# from one machine (Altair 4.2, pandas 1.5); save a baseline of your own before
+# comparing timings elsewhere.
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'DataViz'))
+
+import altair as alt  # noqa: E402
+
+from book_charts import partitioned_data, point_layer, prepare_chart  # noqa: E402
+from data_cube import DataCube, cube_data  # noqa: E402
+from summary_stats import profile_csv  # noqa: E402
+from synthetic import make_trees  # noqa: E402
+from trees import Trees  # noqa: E402
+from trees_data import aggregate_csv, parse_trees  # noqa: E402
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+# boundaries are served as a file, they never go through the chart data
+BOUNDARIES = alt.Data(url='local-area-boundary.json',
+                      format=alt.DataFormat(property='features', type='json'))
+
+
+def figures(trees_small, data_dir):
+    """The report's glued figures and dashboard, built the way the notebook builds them.
+
+    The dashboard's partitions and cube are written to data_dir.
+    """
+    trees_time = alt.Chart(trees_small).mark_bar(color='darkgray').encode(
+                 alt.X('year_planted:O', title="Year Planted"),
+                 alt.Y('count()', title="Number of Trees"))
+    click_year = alt.selection_multi(encodings=['x'], on='click')
+    click_trees_year = (trees_time.encode(
+                       opacity=alt.condition(click_year, alt.value(1), alt.value(0.5)))
+                       .properties(height=100, width=500)
+                       .add_selection(click_year))
+    species_select = (alt.Chart(trees_small).transform_filter(click_year).mark_bar().encode(
+                      alt.Y('species_name:N', sort='x'),
+                      alt.X('species_count:Q'),
+                      alt.Color('species_name:N', legend=None, scale=alt.Scale(scheme='category20'))
+                      ).transform_aggregate(
+                      species_count="count()",
+                      groupby=["species_name"]
+                      ).transform_window(
+                      rank='rank(species_count)',
+                      sort=[alt.SortField("species_count", order="descending")]
+                      ).transform_filter((alt.datum.rank <= 10)).add_selection(click_year))
+    size_chart = (alt.Chart(trees_small).transform_filter(click_year).mark_circle().encode(
+                  alt.Y('height_range_id:Q'),
+                  alt.X('diameter:Q'),
+                  alt.Color('species_name:N', legend=None),
+                  facet=alt.Facet('root_barrier:N')
+                  ).add_selection(click_year))
+    vancouver_map = alt.Chart(BOUNDARIES).mark_geoshape(
+        color='white', opacity=0.5, stroke='black').project(type='identity', reflectY=True)
+    point_map = (vancouver_map + point_layer(trees_small, size=10)).add_selection(click_year).encode(
+                opacity=alt.condition(click_year, alt.value(1), alt.value(0.05)))
+
+    year_min = int(trees_small['year_planted'].min())
+    select_dashboard = alt.selection_single(
+        fields=['year_planted', 'root_barrier'],
+        bind={'year_planted': alt.binding_range(min=year_min, max=int(trees_small['year_planted'].max()), step=1),
+              'root_barrier': alt.binding_radio(options=['N', 'Y'])},
+        init={'root_barrier': 'N', 'year_planted': year_min})
+    dashboard_species = alt.Chart(cube_data(DataCube(trees_small), 'species_name', [select_dashboard],
+                                            count='species_count', top=10,
+                                            views=[('year_planted', 'root_barrier', 'species_name')],
+                                            data_dir=data_dir)).mark_bar().encode(
+        alt.Y('species_name:N', sort='x'), alt.X('species_count:Q'))
+    click_species = alt.selection_multi(fields=['species_name'], on='click', nearest=True)
+    dashboard_species = dashboard_species.add_selection(click_species).encode(
+        opacity=alt.condition(click_species, alt.value(1), alt.value(0.05)))
+    dashboard_points = alt.Chart(partitioned_data(
+        trees_small, select_dashboard, columns=['longitude', 'latitude', 'diameter', 'species_name'],
+        data_dir=data_dir)).mark_circle().encode(
+        longitude='longitude:Q',
+        latitude='latitude:Q',
+        size=alt.Size('diameter:Q', legend=None),
+        color=alt.condition(click_species, 'species_name:N', alt.value('white'))
+        ).project(type='identity', reflectY=True).add_selection(click_species)
+    dashboard_map = (vancouver_map + dashboard_points).add_selection(select_dashboard)
+    return {
+        'trees_time': trees_time,
+        'species_select': species_select,
+        'size_click': size_chart & click_trees_year,
+        'point_click_year': point_map & click_trees_year,
+        'dashboard': dashboard_map | dashboard_species,
+    }
+
+
+def measure(func):
+    """Run func once, returning (result, seconds, peak traced bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(rows):
+    """Benchmark every stage at one size and return {stage: stats}."""
+    raw = make_trees(rows).to_csv(index=False).encode('utf-8')
+    stats = {}
+
+    trees_df, seconds, peak = measure(lambda: parse_trees(raw))
+    stats['load'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    def clean():
+        trees = Trees(trees_df.drop(columns=['Unnamed: 0']))
+        return trees, trees.trees_small, trees.trees_nan_small
+    (trees, trees_small, _), seconds, peak = measure(clean)
+    stats['clean'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    # the chunked path only keeps running aggregates, its peak should stay flat as rows grow
+    _, seconds, peak = measure(lambda: aggregate_csv(io.BytesIO(raw)))
+    stats['stream'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    _, seconds, peak = measure(lambda: trees.trees_nan.groupby('species_name', observed=True).describe())
+    stats['describe'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    # every column and every species in one pass over the CSV, from the raw bytes
+    _, seconds, peak = measure(lambda: profile_csv(io.BytesIO(raw), by=['species_name']))
+    stats['profile'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for name, chart in figures(trees_small, data_dir).items():
+            spec, seconds, peak = measure(
+                lambda: json.dumps(prepare_chart(chart).to_dict(), separators=(',', ':')))
+            stats['figure:' + name] = {'seconds': seconds, 'peak_bytes': peak, 'spec_bytes': len(spec)}
+    return stats
+
+
+def regressions(results, baseline, tolerance, time_tolerance):
+    """Yield a message for every stat that grew by more than its tolerance over the baseline."""
+    for rows, stages in results.items():
+        for stage, stats in stages.items():
+            before = baseline.get(rows, {}).get(stage, {})
+            for key, value in stats.items():
+                old = before.get(key)
+                allowed = time_tolerance if key == 'seconds' else tolerance
+                if old and value > old * (1 + allowed):
+                    yield '{} rows, {} {}: {:.4g} -> {:.4g} (+{:.0%})'.format(
+                        rows, stage, key, old, value, value / old - 1)
+
+
+def print_results(results, out=sys.stdout):
+    print('{:>8} {:<26} {:>9} {:>12} {:>12}'.format(
+        'rows', 'stage', 'seconds', 'peak MiB', 'spec bytes'), file=out)
+    for rows, stages in results.items():
+        for stage, stats in stages.items():
+            print('{:>8} {:<26} {:>9.3f} {:>12.1f} {:>12}'.format(
+                rows, stage, stats['seconds'], stats['peak_bytes'] / 2 ** 20,
+                stats.get('spec_bytes', '')), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the analysis pipeline and chart serialization.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 500000])
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store this run as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative growth of memory and spec bytes before a stage counts as a regression')
+    parser.add_argument('--time-tolerance', type=float, default=1.0,
+                        help='allowed relative growth of wall time, which varies more between runs and machines')
+    args = parser.parse_args(argv)
+
+    alt.data_transformers.disable_max_rows()
+    results = {str(rows): run(rows) for rows in args.rows}
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline at {}, run with --save-baseline to create one'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    found = list(regressions(results, baseline, args.tolerance, args.time_tolerance))
+    for message in found:
+        print('REGRESSION ' + message)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
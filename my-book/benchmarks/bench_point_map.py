@@ -0,0 +1,52 @@
+# Compare the tree point map with and without level of detail.
+#
+#     python benchmarks/bench_point_map.py [--rows 5000 50000 150000]
+#
+# For every size this prints the number of marks the browser has to draw,
+# the bytes of the Vega-Lite spec and the time to build and serialize it.
+# Render time in the browser grows with the number of marks, so the marks
+# column is the one to watch.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'DataViz'))
+
+import altair as alt  # noqa: E402
+
+from book_charts import LOD_THRESHOLD, level_of_detail, point_layer  # noqa: E402
+from synthetic import make_trees_small  # noqa: E402
+
+
+def measure(trees, threshold=LOD_THRESHOLD):
+    start = time.perf_counter()
+    chart = point_layer(trees, size=10, threshold=threshold)
+    spec = json.dumps(chart.to_dict())
+    seconds = time.perf_counter() - start
+    marks = len(level_of_detail(trees, threshold))
+    return marks, len(spec), seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the tree point map with and without level of detail.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 150000])
+    args = parser.parse_args(argv)
+
+    alt.data_transformers.disable_max_rows()
+    print('{:>8} {:>6} {:>9} {:>12} {:>9} {:>10}'.format('rows', 'mode', 'marks', 'spec bytes', 'seconds', 'marks cut'))
+    for rows in args.rows:
+        # the generator drops the undated half, ask for twice as many
+        trees = make_trees_small(rows * 2)[:rows]
+        # every tree as a point, then the book's setting (LOD_THRESHOLD, LOD_MAX_CELLS)
+        marks, size, seconds = measure(trees, threshold=len(trees))
+        print('{:>8} {:>6} {:>9} {:>12} {:>9.3f} {:>10}'.format(rows, 'points', marks, size, seconds, ''))
+        lod_marks, size, seconds = measure(trees)
+        print('{:>8} {:>6} {:>9} {:>12} {:>9.3f} {:>9.1f}x'.format(
+            rows, 'lod', lod_marks, size, seconds, marks / lod_marks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Compare the monolithic Sphinx search index with the sharded one.
+#
+#     python benchmarks/bench_search_index.py [--pages 4 40 400]
+#
+# Builds synthetic search indexes for a growing number of pages and reports
+# the bytes of the monolithic index, of the sharded dictionary, the bytes a
+# typical query downloads (dictionary + the shards it touches), the time to
+# parse what a query needs in each layout and whether shard_search_index.py
+# shards an index of that size at all (worth_sharding()).
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'scripts'))
+
+from shard_search_index import decode_postings, shard_index, worth_sharding  # noqa: E402
+
+QUERIES = ['tree', 'vancouver', 'species', 'root barrier', 'planted year']
+
+
+def make_index(pages, vocabulary=20000, words_per_page=1500, seed=0):
+    """A synthetic Sphinx index: zipf-ish vocabulary spread over pages."""
+    rng = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(vocabulary)]
+    words[:len(QUERIES) * 2] = ' '.join(QUERIES).split()
+    terms = {}
+    for page in range(pages):
+        for _ in range(words_per_page):
+            word = words[min(int(rng.paretovariate(0.8)) - 1, len(words) - 1)]
+            terms.setdefault(word, set()).add(page)
+    terms = {word: sorted(docs) if len(docs) > 1 else min(docs) for word, docs in terms.items()}
+    return {'docnames': ['page{}'.format(i) for i in range(pages)],
+            'filenames': ['page{}.md'.format(i) for i in range(pages)],
+            'titles': ['Page {}'.format(i) for i in range(pages)],
+            'objects': {}, 'objnames': {}, 'objtypes': {},
+            'terms': terms, 'titleterms': {}}
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def query_shards(dictionary, query):
+    files = []
+    for shard in dictionary['shards']:
+        terms = shard['terms'] + shard['titleterms']
+        if any(word in term for word in query.split() for term in terms):
+            files.append(shard['file'])
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sharded search index.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[4, 40, 400])
+    args = parser.parse_args(argv)
+
+    print('{:>6} {:>12} {:>12} {:>14} {:>12} {:>12} {:>8}'.format(
+        'pages', 'full bytes', 'dict bytes', 'query bytes', 'full ms', 'sharded ms', 'shards'))
+    for pages in args.pages:
+        index = make_index(pages)
+        full = _dumps(index)
+        dictionary, shards = shard_index(index)
+        dictionary_text = _dumps(dictionary)
+        shard_texts = {name: _dumps(shard) for name, shard in shards.items()}
+
+        start = time.perf_counter()
+        for _ in QUERIES:
+            json.loads(full)
+        full_ms = (time.perf_counter() - start) * 1000 / len(QUERIES)
+
+        query_bytes = 0
+        start = time.perf_counter()
+        for query in QUERIES:
+            json.loads(dictionary_text)
+            for name in query_shards(dictionary, query):
+                query_bytes += len(shard_texts[name])
+                for postings in json.loads(shard_texts[name])['terms'].values():
+                    decode_postings(postings)
+        sharded_ms = (time.perf_counter() - start) * 1000 / len(QUERIES)
+        query_bytes = len(dictionary_text) + query_bytes // len(QUERIES)
+
+        print('{:>6} {:>12} {:>12} {:>14} {:>12.2f} {:>12.2f} {:>8}'.format(
+            pages, len(full), len(dictionary_text), query_bytes, full_ms, sharded_ms,
+            'yes' if worth_sharding(len(full), len(dictionary_text)) else 'no'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Time building and serializing a chart with Altair's validation and with
+# the book's cached validation (DataViz/spec_validation.py).
+#
+#     python benchmarks/bench_validation.py [--rows 5000 50000 150000]
+#
+# For every size and mode this prints the time to derive the figure through
+# a chain of .encode()/.properties() calls (Altair validates every
+# intermediate object in strict mode), the time to validate its spec with the
+# data inlined, and the time to validate it again for an identical
+# derivation. Converting the data to the spec costs the same in both modes
+# and is not included. In strict mode validation grows with the rows; in
+# cached mode it should stay flat and the second one should be free.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'DataViz'))
+
+import altair as alt  # noqa: E402
+
+import spec_validation  # noqa: E402
+from synthetic import make_trees_small  # noqa: E402
+
+
+def derive(base):
+    """The kind of chain the notebooks build a figure with."""
+    chart = base.mark_circle().encode(alt.X('diameter:Q'), alt.Y('height_range_id:Q'))
+    chart = chart.encode(color='species_name:N').properties(width=300, height=200)
+    chart = chart.encode(tooltip=['species_name:N', 'diameter:Q']).properties(title='Size')
+    return chart
+
+
+def measure(trees):
+    start = time.perf_counter()
+    chart = derive(alt.Chart(trees))
+    built = time.perf_counter() - start
+    spec = chart.to_dict(validate=False)
+    start = time.perf_counter()
+    type(chart).validate(spec)
+    first = time.perf_counter() - start
+    spec = derive(alt.Chart(trees)).to_dict(validate=False)
+    start = time.perf_counter()
+    type(chart).validate(spec)
+    again = time.perf_counter() - start
+    return built, first, again
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Altair schema validation against the cached mode.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000, 150000])
+    args = parser.parse_args(argv)
+
+    alt.data_transformers.disable_max_rows()
+    print('{:>8} {:>7} {:>9} {:>10} {:>10}'.format('rows', 'mode', 'derive', 'validate', 'again'))
+    for rows in args.rows:
+        # the generator drops the undated half, ask for twice as many
+        trees = make_trees_small(rows * 2)[:rows][['species_name', 'diameter', 'height_range_id']]
+        for mode in spec_validation.MODES[::-1]:
+            spec_validation.enable(mode)
+            built, first, again = measure(trees)
+            print('{:>8} {:>7} {:>9.3f} {:>10.4f} {:>10.4f}'.format(rows, mode, built, first, again))
+
+
+if __name__ == '__main__':
+    main()
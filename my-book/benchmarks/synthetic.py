@@ -0,0 +1,99 @@
+# Synthetic street trees data with the same schema as small_unique_vancouver.csv.
+#
+# Used by the benchmarks so they can run at any size without downloading the
+# real inventory. Values are random but follow the shape of the real data:
+# a long tail of species, about half the planting dates missing, and points
+# inside the bounding box of Vancouver.
+
+import numpy as np
+import pandas as pd
+
+NEIGHBOURHOODS = [
+    'ARBUTUS-RIDGE', 'DOWNTOWN', 'DUNBAR-SOUTHLANDS', 'FAIRVIEW', 'GRANDVIEW-WOODLAND',
+    'HASTINGS-SUNRISE', 'KENSINGTON-CEDAR COTTAGE', 'KERRISDALE', 'KILLARNEY',
+    'KITSILANO', 'MARPOLE', 'MOUNT PLEASANT', 'OAKRIDGE', 'RENFREW-COLLINGWOOD',
+    'RILEY PARK', 'SHAUGHNESSY', 'SOUTH CAMBIE', 'STRATHCONA', 'SUNSET',
+    'VICTORIA-FRASERVIEW', 'WEST END', 'WEST POINT GREY']
+N_SPECIES = 171
+# bounding box of the trees
+LONGITUDE = (-123.2206, -123.0233)
+LATITUDE = (49.2028, 49.2939)
+
+
+def make_trees(n, seed=0):
+    """Return a frame of n synthetic street trees, as read_csv would load it."""
+    rng = np.random.default_rng(seed)
+    # species popularity follows a long tail like the real data
+    weights = 1.0 / np.arange(1, N_SPECIES + 1)
+    species = rng.choice(N_SPECIES, size=n, p=weights / weights.sum())
+    genus = species // 4
+    planted = pd.to_datetime('1989-01-01') + pd.to_timedelta(
+        rng.integers(0, 31 * 365, size=n), unit='D')
+    planted = planted.where(rng.random(n) < 0.47)
+    return pd.DataFrame({
+        'Unnamed: 0': rng.permutation(n * 3)[:n],
+        'std_street': np.char.add('STREET ', rng.integers(0, 800, size=n).astype(str)),
+        'on_street': np.char.add('STREET ', rng.integers(0, 800, size=n).astype(str)),
+        'species_name': np.char.add('SPECIES', species.astype(str)),
+        'neighbourhood_name': rng.choice(NEIGHBOURHOODS, size=n),
+        'date_planted': planted,
+        'diameter': rng.gamma(2.0, 6.0, size=n).round(1),
+        'street_side_name': rng.choice(['EVEN', 'ODD', 'MED'], size=n, p=[0.49, 0.49, 0.02]),
+        'genus_name': np.char.add('GENUS', genus.astype(str)),
+        'assigned': rng.choice(['N', 'Y'], size=n, p=[0.9, 0.1]),
+        'civic_number': rng.integers(1, 9200, size=n),
+        'plant_area': rng.choice(['B', 'G', 'N', 'C', '6', '8', '10'], size=n),
+        'curb': rng.choice(['Y', 'N'], size=n, p=[0.95, 0.05]),
+        'tree_id': rng.permutation(n * 3)[:n] + 1,
+        'common_name': np.char.add('COMMON ', species.astype(str)),
+        'height_range_id': rng.integers(0, 10, size=n),
+        'on_street_block': rng.integers(0, 92, size=n) * 100,
+        'cultivar_name': np.where(rng.random(n) < 0.53, 'CULTIVAR', None),
+        'root_barrier': rng.choice(['N', 'Y'], size=n, p=[0.9, 0.1]),
+        'latitude': rng.uniform(*LATITUDE, size=n),
+        'longitude': rng.uniform(*LONGITUDE, size=n),
+    })
+
+
+def make_trees_small(n, seed=0):
+    """Synthetic version of trees_small: dated trees with a year_planted column."""
+    trees = make_trees(n, seed).drop(columns=['Unnamed: 0'])
+    trees = trees.dropna(subset=['date_planted'])
+    return trees.assign(year_planted=trees['date_planted'].dt.year)
+
+
+def make_areas(columns=11, rows=2, vertices=100, seed=0):
+    """GeoJSON features of jagged local areas tiling the bounding box of the trees.
+
+    Areas are named after NEIGHBOURHOODS. Every side has `vertices` points
+    and neighbouring areas share their sides exactly, like the real boundary
+    file.
+    """
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(*LONGITUDE, columns + 1)
+    ys = np.linspace(*LATITUDE, rows + 1)
+    amplitude = 0.15 * min(xs[1] - xs[0], ys[1] - ys[0])
+    t = np.linspace(0, 1, vertices)[:, None]
+    sides = {}
+
+    def side(a, b):
+        if (b, a) in sides:
+            return sides[(b, a)][::-1]
+        start, end = np.array([xs[a[0]], ys[a[1]]]), np.array([xs[b[0]], ys[b[1]]])
+        normal = np.array([start[1] - end[1], end[0] - start[0]])
+        normal /= np.hypot(*normal)
+        # wiggle away from the corners so the areas stay simple polygons
+        offset = amplitude * np.sin(np.pi * t) * rng.uniform(-1, 1, size=(vertices, 1))
+        sides[(a, b)] = start + t * (end - start) + offset * normal
+        return sides[(a, b)]
+
+    features = []
+    for row in range(rows):
+        for column in range(columns):
+            corners = [(column, row), (column + 1, row), (column + 1, row + 1), (column, row + 1), (column, row)]
+            ring = np.vstack([side(a, b)[:-1] for a, b in zip(corners[:-1], corners[1:])] + [side(*corners[:2])[:1]])
+            number = row * columns + column
+            name = NEIGHBOURHOODS[number] if number < len(NEIGHBOURHOODS) else 'AREA {}'.format(number)
+            features.append({'type': 'Feature', 'properties': {'name': name},
+                             'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}})
+    return features
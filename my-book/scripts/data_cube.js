@@ -0,0 +1,270 @@
+/*
+ * Answers chart data from the data cube of DataViz/data_cube.py, added to the
+ * pages that need it by scripts/page_scripts.py.
+ *
+ * A chart with a dataset named "book-cube:manifest=...&group=...&selection=..."
+ * starts empty. Once vega-embed has rendered it, this reads the manifest and,
+ * on every change of the named selections, sums the cube over what they
+ * select. Each array is turned into prefix sums along its first axis (the
+ * years) when it is loaded, so a year or a range of years is the difference
+ * of two slices, and the other axes are summed over their selected values.
+ * The work per change depends on the number of species and cells, never on
+ * the number of trees. The large arrays are only fetched once a view needs
+ * them, e.g. the full species x cell cube on the first click on a species.
+ * A top n chart keeps every row tied at the last place, like Vega's rank();
+ * when the selections pick one value of each dimension it reads the ranking
+ * precomputed in the manifest instead of summing.
+ */
+(function () {
+  var PREFIX = 'book-cube:';
+  // typed arrays read the platform byte order, little-endian in every browser
+  var TYPES = {uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array};
+  var files = {};
+
+  function load(url, read) {
+    if (!files[url]) {
+      files[url] = fetch(url).then(function (response) {
+        if (!response.ok) throw new Error('data cube: ' + response.status + ' for ' + url);
+        return read(response);
+      }).catch(function (err) {
+        delete files[url];
+        throw err;
+      });
+    }
+    return files[url];
+  }
+
+  function loadArray(entry, manifestUrl) {
+    return load(new URL(entry.url, manifestUrl).href, function (response) {
+      return response.arrayBuffer().then(function (buffer) {
+        var counts = new TYPES[entry.dtype](buffer);
+        var stride = counts.length / entry.shape[0];
+        // prefix sums along the first axis, wide enough for the totals
+        var sums = new Uint32Array(counts.length);
+        for (var i = 0; i < counts.length; i++) {
+          sums[i] = counts[i] + (i >= stride ? sums[i - stride] : 0);
+        }
+        return sums;
+      });
+    });
+  }
+
+  // {field: {values: [...], ranges: [[lo, hi], ...]}} for the tuples in the
+  // selections' stores; fields are treated independently, which is exact for
+  // the single-tuple selections of the dashboard
+  function selected(view, selections) {
+    var chosen = {};
+    selections.forEach(function (selection) {
+      var tuples;
+      try {
+        tuples = view.data(selection + '_store');
+      } catch (err) {
+        return;
+      }
+      tuples.forEach(function (tuple) {
+        tuple.fields.forEach(function (field, i) {
+          var entry = chosen[field.field] = chosen[field.field] || {values: [], ranges: []};
+          if (field.type.charAt(0) === 'R') entry.ranges.push(tuple.values[i]);
+          else entry.values.push(tuple.values[i]);
+        });
+      });
+    });
+    return chosen;
+  }
+
+  // indices along a dimension matching a selection entry
+  function indices(labels, entry) {
+    var found = [];
+    labels.forEach(function (label, i) {
+      var match = entry.values.indexOf(label) >= 0 || entry.ranges.some(function (range) {
+        return label >= Math.min(range[0], range[1]) && label <= Math.max(range[0], range[1]);
+      });
+      if (match) found.push(i);
+    });
+    return found;
+  }
+
+  function all(size) {
+    var list = [];
+    for (var i = 0; i < size; i++) list.push(i);
+    return list;
+  }
+
+  // consecutive indices as [first, last] runs
+  function runs(list) {
+    var found = [];
+    list.forEach(function (i) {
+      var last = found[found.length - 1];
+      if (last && last[1] === i - 1) last[1] = i;
+      else found.push([i, i]);
+    });
+    return found;
+  }
+
+  // totals along the group axis of the prefix summed array, for the chosen
+  // indices of every other axis (all of them when not chosen)
+  function sumCube(sums, shape, chosen, group) {
+    var strides = [], stride = 1;
+    for (var a = shape.length - 1; a >= 0; a--) {
+      strides[a] = stride;
+      stride *= shape[a];
+    }
+    var totals = new Float64Array(shape[group]);
+    var years = runs(chosen[0] || all(shape[0]));
+    var other = [];
+    for (a = 1; a < shape.length; a++) {
+      if (a !== group) other.push([a, chosen[a] || all(shape[a])]);
+    }
+    function walk(depth, offset) {
+      if (depth === other.length) {
+        years.forEach(function (run) {
+          var high = offset + run[1] * strides[0];
+          var low = run[0] > 0 ? offset + (run[0] - 1) * strides[0] : -1;
+          for (var g = 0; g < shape[group]; g++) {
+            var step = g * strides[group];
+            totals[g] += sums[high + step] - (low >= 0 ? sums[low + step] : 0);
+          }
+        });
+        return;
+      }
+      other[depth][1].forEach(function (i) {
+        walk(depth + 1, offset + i * strides[other[depth][0]]);
+      });
+    }
+    walk(0, 0);
+    return totals;
+  }
+
+  // the rows of the top n, ties at the last place included
+  function keepTop(rows, count, top) {
+    rows.sort(function (a, b) { return b[count] - a[count]; });
+    if (rows.length <= top) return rows;
+    var last = rows[top - 1][count];
+    return rows.filter(function (row) { return row[count] >= last; });
+  }
+
+  // the precomputed top rows for the selected values, null when the
+  // selections are not one value of each dimension the table is keyed on
+  function precomputedTop(manifest, group, top, chosen) {
+    var table = manifest.top;
+    if (!table || table.group !== group || table.n !== top) return null;
+    var key = [];
+    var covered = table.by.every(function (dimension) {
+      var entry = chosen[dimension];
+      if (!entry || entry.ranges.length || entry.values.length !== 1) return false;
+      key.push(entry.values[0]);
+      return true;
+    });
+    var other = Object.keys(chosen).some(function (dimension) {
+      return dimension !== group && table.by.indexOf(dimension) < 0 && manifest.dimensions.indexOf(dimension) >= 0;
+    });
+    if (!covered || other) return null;
+    return table.rows[JSON.stringify(key)] || [];
+  }
+
+  function bindDataset(view, name) {
+    var params = new URLSearchParams(name.slice(PREFIX.length));
+    var manifestUrl = new URL(params.get('manifest'), document.baseURI).href;
+    var group = params.get('group');
+    var count = params.get('count');
+    var top = Number(params.get('top') || 0);
+    var selections = params.getAll('selection');
+    var latest = 0;
+
+    load(manifestUrl, function (response) { return response.json(); }).then(function (manifest) {
+      function show(rows) {
+        view.change(name, vega.changeset().remove(vega.truthy).insert(rows)).run();
+      }
+
+      function update() {
+        var chosen = selected(view, selections);
+        var ticket = ++latest;
+        var ranked = top && precomputedTop(manifest, group, top, chosen);
+        if (ranked) {
+          show(ranked.map(function (entry) {
+            var row = {};
+            row[group] = entry[0];
+            row[count] = entry[1];
+            return row;
+          }));
+          return;
+        }
+        var filtered = manifest.dimensions.filter(function (dimension) {
+          return chosen[dimension] && dimension !== group;
+        });
+        // the smallest array holding the group and every filtered dimension
+        var entry = manifest.arrays.filter(function (array) {
+          return [group].concat(filtered).every(function (dimension) {
+            return array.dimensions.indexOf(dimension) >= 0;
+          });
+        })[0];
+        loadArray(entry, manifestUrl).then(function (sums) {
+          if (ticket !== latest) return;
+          var axes = entry.dimensions.map(function (dimension) {
+            if (!chosen[dimension] || dimension === group || dimension === 'cell') return null;
+            return indices(manifest.values[dimension], chosen[dimension]);
+          });
+          var groupAxis = entry.dimensions.indexOf(group);
+          var totals = sumCube(sums, entry.shape, axes, groupAxis);
+          var rows = [];
+          totals.forEach(function (total, i) {
+            if (!total) return;
+            var row = {};
+            if (group === 'cell') {
+              row.longitude = manifest.cells.longitude[i];
+              row.latitude = manifest.cells.latitude[i];
+            } else {
+              row[group] = manifest.values[group][i];
+            }
+            row[count] = total;
+            rows.push(row);
+          });
+          show(top ? keepTop(rows, count, top) : rows);
+        }).catch(function (err) {
+          console.error(err);
+        });
+      }
+
+      selections.forEach(function (selection) {
+        view.addDataListener(selection + '_store', update);
+      });
+      update();
+    }).catch(function (err) {
+      console.error(err);
+    });
+  }
+
+  function bind(result) {
+    (result.vgSpec.data || []).forEach(function (data) {
+      if (data.name.indexOf(PREFIX) === 0) bindDataset(result.view, data.name);
+    });
+    return result;
+  }
+
+  function wrap(embed) {
+    if (typeof embed !== 'function' || embed.bookCube) return embed;
+    var wrapped = function () {
+      return embed.apply(this, arguments).then(bind);
+    };
+    Object.assign(wrapped, embed);
+    wrapped.bookCube = true;
+    return wrapped;
+  }
+
+  // the Altair embed scripts load vega-embed on demand and call the global
+  // vegaEmbed, so wrap it whenever it is (re)defined, on top of any wrapper
+  // installed before this one
+  var previous = Object.getOwnPropertyDescriptor(window, 'vegaEmbed');
+  var current = wrap(window.vegaEmbed);
+  Object.defineProperty(window, 'vegaEmbed', {
+    configurable: true,
+    get: function () { return current; },
+    set: function (value) {
+      if (previous && previous.set) {
+        previous.set(value);
+        value = previous.get();
+      }
+      current = wrap(value);
+    }
+  });
+})();
@@ -0,0 +1,149 @@
+/*
+ * Page side of DataViz/data_server.py, injected by the server into the
+ * pages it sends.
+ *
+ * Charts built with served_data() have an empty dataset named
+ * "book-server:<query>". Once vega-embed has rendered a chart, this watches
+ * the selection named in the query and, on every change, fetches
+ * /query?<query>&<field>=<value>... for the selected values and replaces the
+ * dataset's rows with the answer. Answers are kept per query, so going back
+ * to a year already seen does not ask the server again, and a late answer
+ * for an older selection is dropped.
+ */
+(function () {
+  var PREFIX = 'book-server:';
+  var QUERY_URL = window.BOOK_DATA_SERVER || '/query';
+  var KINDS = {FLOAT: 0, INT: 1, STRING: 2, BOOL: 3};
+  var answers = {};
+
+  // the columns format of encode_columns() in data_server.py, as row objects
+  function decodeColumns(buffer) {
+    var view = new DataView(buffer), bytes = new Uint8Array(buffer), utf8 = new TextDecoder();
+    var rows = view.getUint32(4, true), count = view.getUint16(8, true), offset = 10;
+    var records = [];
+    for (var r = 0; r < rows; r++) records.push({});
+
+    function text(length) {
+      var value = utf8.decode(bytes.subarray(offset, offset + length));
+      offset += length;
+      return value;
+    }
+
+    for (var c = 0; c < count; c++) {
+      var nameLength = view.getUint16(offset, true);
+      offset += 2;
+      var name = text(nameLength);
+      var kind = view.getUint8(offset++);
+      var i, value;
+      if (kind === KINDS.STRING) {
+        var labels = [], n = view.getUint32(offset, true);
+        offset += 4;
+        for (i = 0; i < n; i++) {
+          var length = view.getUint32(offset, true);
+          offset += 4;
+          labels.push(text(length));
+        }
+        for (i = 0; i < rows; i++, offset += 4) {
+          var code = view.getInt32(offset, true);
+          records[i][name] = code < 0 ? null : labels[code];
+        }
+      } else if (kind === KINDS.FLOAT) {
+        for (i = 0; i < rows; i++, offset += 8) {
+          value = view.getFloat64(offset, true);
+          records[i][name] = isNaN(value) ? null : value;
+        }
+      } else if (kind === KINDS.INT) {
+        for (i = 0; i < rows; i++, offset += 4) records[i][name] = view.getInt32(offset, true);
+      } else {
+        for (i = 0; i < rows; i++, offset += 1) records[i][name] = view.getUint8(offset) === 1;
+      }
+    }
+    return records;
+  }
+
+  function fetchRows(query) {
+    if (!answers[query]) {
+      answers[query] = fetch(QUERY_URL + '?' + query, {headers: {Accept: 'application/x-book-columns'}})
+        .then(function (response) {
+          if (!response.ok) throw new Error('data server: ' + response.status + ' for ' + query);
+          return response.arrayBuffer();
+        })
+        .then(decodeColumns)
+        .catch(function (err) {
+          delete answers[query];
+          throw err;
+        });
+    }
+    return answers[query];
+  }
+
+  // field filters for the tuples currently in a selection's store
+  function selectionFilters(view, selection, params) {
+    var tuples;
+    try {
+      tuples = view.data(selection + '_store');
+    } catch (err) {
+      return;
+    }
+    tuples.forEach(function (tuple) {
+      tuple.fields.forEach(function (field, i) {
+        params.append(field.field, tuple.values[i]);
+      });
+    });
+  }
+
+  function bindDataset(view, name) {
+    var params = new URLSearchParams(name.slice(PREFIX.length));
+    var selection = params.get('selection');
+    params.delete('selection');
+    var latest = 0;
+
+    function update() {
+      var query = new URLSearchParams(params);
+      if (selection) selectionFilters(view, selection, query);
+      query.sort();
+      var ticket = ++latest;
+      fetchRows(query.toString()).then(function (rows) {
+        if (ticket !== latest) return;
+        view.change(name, vega.changeset().remove(vega.truthy).insert(rows)).run();
+      }).catch(function (err) {
+        console.error(err);
+      });
+    }
+
+    if (selection) {
+      try {
+        view.addDataListener(selection + '_store', update);
+      } catch (err) {
+        // a chart glued on its own, without the chart holding its selection
+      }
+    }
+    update();
+  }
+
+  function bind(result) {
+    (result.vgSpec.data || []).forEach(function (data) {
+      if (data.name.indexOf(PREFIX) === 0) bindDataset(result.view, data.name);
+    });
+    return result;
+  }
+
+  function wrap(embed) {
+    if (typeof embed !== 'function' || embed.bookDataServer) return embed;
+    var wrapped = function () {
+      return embed.apply(this, arguments).then(bind);
+    };
+    Object.assign(wrapped, embed);
+    wrapped.bookDataServer = true;
+    return wrapped;
+  }
+
+  // the Altair embed scripts load vega-embed on demand and call the global
+  // vegaEmbed, so wrap it whenever it is (re)defined
+  var current = wrap(window.vegaEmbed);
+  Object.defineProperty(window, 'vegaEmbed', {
+    configurable: true,
+    get: function () { return current; },
+    set: function (value) { current = wrap(value); }
+  });
+})();
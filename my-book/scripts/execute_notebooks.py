@@ -0,0 +1,373 @@
+# Execute the book's notebooks with a cell-level output cache.
+#
+#     python scripts/execute_notebooks.py DataViz/final_project_EDA.ipynb DataViz/final_project_report.ipynb
+#
+# Every code cell gets a key made from its source, the local modules it
+# imports (the .py files next to the notebook, and the ones they import), the
+# key of the code cell before it and a fingerprint of the input data (the
+# trees_data cache index). Outputs are stored under that key in
+# _build/.cell_cache. When every cell of a notebook is a hit its outputs are
+# filled in from the cache and no kernel is started, so an edit to Markdown
+# only costs a file copy. Otherwise the notebook is run and the cache
+# refreshed; cells before the first changed cell still run because later
+# cells need the kernel state they build, and are reported as `rerun`, not
+# as hits. A cell whose outputs point to chart
+# data under _static/data that is gone (a cleaned checkout) is a miss, running
+# it writes the files again.
+#
+# Notebooks are independent of each other, so they run on a process pool
+# (--jobs, default one per core), each in its own kernel with its own
+# timeout. Results are reported in command line order whatever order they
+# finish in, so the output matches a serial run.
+#
+# Outputs are written back into the notebooks, so build the book with
+# `execute_notebooks: off` in _config.yml after running this.
+#
+# --profile runs every notebook (no cache shortcut) and records, per code
+# cell, the wall time, the kernel's CPU time, how much the kernel's peak RSS
+# grew and the bytes of the cell's outputs. They go into the --report json,
+# --profile-table writes them as a Markdown table the book can include, and a
+# cell over its budget fails the run. Budgets default to --cell-time-budget /
+# --cell-output-budget and a cell can set its own in its metadata:
+#
+#     {"budget": {"seconds": 30, "output_bytes": 2000000}}
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import time
+import urllib.parse
+
+import nbformat
+from nbclient import NotebookClient
+
+BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CACHE_DIR = os.path.join(BOOK_DIR, '_build', '.cell_cache')
+DATA_CACHE_DIR = os.environ.get('TREES_CACHE_DIR', os.path.join(BOOK_DIR, '_build', '.data_cache'))
+# where book_charts, boundaries and data_cube write the chart data outputs point to
+STATIC_DATA_DIR = os.path.join(BOOK_DIR, '_static', 'data')
+
+_IMPORT = re.compile(r'^[ \t]*(?:from[ \t]+(\w+)[\w.]*[ \t]+import\b|import[ \t]+([\w., \t]+))', re.MULTILINE)
+# content addressed data file names, in outputs as urls and in manifests as names
+_DATA_URL = re.compile(r'_static/data/([\w-]+-[0-9a-f]{20}\.(?:json|bin))')
+_DATA_FILE = re.compile(r'[\w-]+-[0-9a-f]{20}\.(?:json|bin)')
+# data files listing other data files (partitioned_data and cube_data manifests)
+MANIFEST_PREFIXES = ('partitions-', 'cube-')
+
+
+def data_fingerprint(data_cache_dir=DATA_CACHE_DIR):
+    """Hash of the data cache index, which records the content hash of every dataset."""
+    try:
+        with open(os.path.join(data_cache_dir, 'index.json'), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ''
+
+
+def imported_names(source):
+    """Top-level names of the modules a piece of code imports."""
+    for match in _IMPORT.finditer(source):
+        if match.group(1):
+            yield match.group(1)
+        else:
+            for part in match.group(2).split(','):
+                if part.strip():
+                    yield part.split()[0].split('.')[0]
+
+
+def local_modules(source, module_dir):
+    """{name: path} of the modules in module_dir that source imports, directly or not."""
+    found = {}
+    todo = [source]
+    while todo:
+        for name in imported_names(todo.pop()):
+            path = os.path.join(module_dir, name + '.py')
+            if name not in found and os.path.isfile(path):
+                found[name] = path
+                with open(path, encoding='utf-8') as f:
+                    todo.append(f.read())
+    return found
+
+
+def module_fingerprint(source, module_dir):
+    """Hash of the local modules source imports, '' when it imports none."""
+    modules = local_modules(source, module_dir)
+    if not modules:
+        return ''
+    digest = hashlib.sha256()
+    for name in sorted(modules):
+        with open(modules[name], 'rb') as f:
+            digest.update(name.encode() + b'\n' + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def cell_keys(nb, fingerprint, module_dir=None):
+    """Return {cell index: key} for the code cells of nb.
+
+    With module_dir, a cell's key also covers the modules from that folder
+    it imports, so a change to one of them invalidates that cell and the ones
+    after it.
+    """
+    kernel = nb.metadata.get('kernelspec', {}).get('name', '')
+    keys = {}
+    upstream = hashlib.sha256((kernel + '\n' + fingerprint).encode()).hexdigest()
+    for index, cell in enumerate(nb.cells):
+        if cell.cell_type != 'code':
+            continue
+        modules = module_fingerprint(cell.source, module_dir) if module_dir else ''
+        upstream = hashlib.sha256((upstream + '\n' + cell.source + '\n' + modules).encode()).hexdigest()
+        keys[index] = upstream
+    return keys
+
+
+def missing_data_files(outputs, data_dir=STATIC_DATA_DIR):
+    """Names of the _static/data files outputs point to, directly or through a manifest, that do not exist."""
+    todo = set(_DATA_URL.findall(urllib.parse.unquote(json.dumps(outputs))))
+    seen, missing = set(), []
+    while todo:
+        name = todo.pop()
+        seen.add(name)
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            missing.append(name)
+        elif name.startswith(MANIFEST_PREFIXES) and name.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                todo.update(set(_DATA_FILE.findall(f.read())) - seen)
+    return sorted(missing)
+
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.json')
+
+
+def load_cell(cache_dir, key):
+    try:
+        with open(_cache_path(cache_dir, key)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_cell(cache_dir, key, cell):
+    path = _cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # notebooks run in parallel may store the same cell, give each its own temp file
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'outputs': cell.outputs, 'execution_count': cell.execution_count}, f)
+    os.replace(tmp, path)
+
+
+def process_usage(pid):
+    """(cpu seconds, peak rss bytes) of a process, (None, None) without /proc."""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/{}/status'.format(pid)) as f:
+            peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+        return cpu, peak
+    except (OSError, ValueError, StopIteration):
+        return None, None
+
+
+def _delta(after, before):
+    return None if after is None or before is None else after - before
+
+
+class CellProfiler:
+    """nbclient hooks recording wall time, kernel cpu time and peak rss growth per cell."""
+
+    def __init__(self):
+        self.cells = {}
+        self._client = None
+        self._start = None
+
+    def attach(self, client):
+        self._client = client
+        client.on_cell_execute = self.before
+        client.on_cell_executed = self.after
+
+    def _kernel_pid(self):
+        manager = self._client.km
+        process = getattr(getattr(manager, 'provisioner', None), 'process', None)
+        return getattr(process or getattr(manager, 'kernel', None), 'pid', None)
+
+    def before(self, cell, cell_index, **kwargs):
+        self._start = (time.perf_counter(),) + process_usage(self._kernel_pid())
+
+    def after(self, cell, cell_index, **kwargs):
+        wall, cpu, peak = (time.perf_counter(),) + process_usage(self._kernel_pid())
+        self.cells[cell_index] = {'wall_seconds': wall - self._start[0],
+                                  'cpu_seconds': _delta(cpu, self._start[1]),
+                                  'peak_rss_delta': _delta(peak, self._start[2])}
+
+
+def run_notebook(nb, path, timeout, profiler=None):
+    """Execute nb in a fresh kernel started in the notebook's directory."""
+    client = NotebookClient(nb, timeout=timeout,
+                            resources={'metadata': {'path': os.path.dirname(os.path.abspath(path))}})
+    if profiler is not None:
+        profiler.attach(client)
+    client.execute()
+
+
+def execute(path, cache_dir=CACHE_DIR, timeout=600, force=False, notebook_timeout=None,
+            profile=False, budget=None):
+    """Execute one notebook through the cache.
+
+    Returns the per-cell cache results and the seconds the notebook took.
+    With profile=True the notebook is always run and each cell's result also
+    has its measurements and its budget (`budget` updated by the cell's
+    metadata).
+    """
+    nb = nbformat.read(path, as_version=4)
+    module_dir = os.path.dirname(os.path.abspath(path))
+    keys = cell_keys(nb, data_fingerprint(), module_dir)
+    profiler = CellProfiler() if profile else None
+    cached = {index: None if force or profile else load_cell(cache_dir, key) for index, key in keys.items()}
+    for index, entry in cached.items():
+        if entry is not None and missing_data_files(entry['outputs']):
+            cached[index] = None
+    hits = {index for index, entry in cached.items() if entry is not None}
+    served = len(hits) == len(keys)
+
+    start = time.perf_counter()
+    if served:
+        for index, entry in cached.items():
+            nb.cells[index].outputs = [nbformat.from_dict(output) for output in entry['outputs']]
+            nb.cells[index].execution_count = entry['execution_count']
+    else:
+        if notebook_timeout:
+            # the pool cannot interrupt a worker, so enforce the budget here
+            _set_alarm(notebook_timeout, path)
+        try:
+            run_notebook(nb, path, timeout, profiler)
+        finally:
+            if notebook_timeout:
+                _set_alarm(0, path)
+        # the run may have filled the data cache, key the outputs on the data it saw
+        keys = cell_keys(nb, data_fingerprint(), module_dir)
+        for index, key in keys.items():
+            store_cell(cache_dir, key, nb.cells[index])
+    seconds = time.perf_counter() - start
+
+    nbformat.write(nb, path)
+    # once the kernel runs, a cell found in the cache was executed all the same
+    results = [{'notebook': path, 'cell': index, 'key': keys[index][:12],
+                'cache': 'hit' if served else 'rerun' if index in hits else 'miss'} for index in keys]
+    if profiler is not None:
+        for result in results:
+            cell = nb.cells[result['cell']]
+            result.update(profiler.cells.get(result['cell'], {}))
+            result['output_bytes'] = len(json.dumps(cell.outputs, separators=(',', ':')))
+            result['source'] = cell.source.strip().split('\n')[0][:60]
+            result['budget'] = dict(budget or {}, **cell.metadata.get('budget', {}))
+    return results, seconds
+
+
+class NotebookTimeout(RuntimeError):
+    pass
+
+
+def _set_alarm(seconds, path):
+    def _timeout(signum, frame):
+        raise NotebookTimeout('{} did not finish within {}s'.format(path, seconds))
+    signal.signal(signal.SIGALRM, _timeout)
+    signal.alarm(seconds)
+
+
+def execute_all(paths, jobs=None, **kwargs):
+    """Execute notebooks on a process pool and return results in the order of paths."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) == 1:
+        return [(path,) + execute(path, **kwargs) for path in paths]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+        futures = [pool.submit(execute, path, **kwargs) for path in paths]
+        # wait for every notebook before raising, so one failure does not
+        # leave the others half written
+        concurrent.futures.wait(futures)
+        return [(path,) + future.result() for path, future in zip(paths, futures)]
+
+
+def over_budget(results):
+    """Yield a message for every profiled cell over its time or output budget."""
+    for _, cells, _ in results:
+        for cell in cells:
+            budget = cell.get('budget', {})
+            for key, measured in (('seconds', 'wall_seconds'), ('output_bytes', 'output_bytes')):
+                if budget.get(key) is not None and cell.get(measured, 0) > budget[key]:
+                    yield '{} cell {} ({}): {} {:.4g} over budget {:.4g}'.format(
+                        cell['notebook'], cell['cell'], cell['source'], measured, cell[measured], budget[key])
+
+
+def _format(value, scale=1, digits=2):
+    return '' if value is None else '{:.{}f}'.format(value / scale, digits)
+
+
+def write_profile_table(results, path):
+    """Write the profiled cells as a Markdown table."""
+    with open(path, 'w') as f:
+        f.write('| notebook | cell | wall s | cpu s | peak RSS +MiB | output KiB | first line |\n')
+        f.write('|---|--:|--:|--:|--:|--:|---|\n')
+        for _, cells, _ in results:
+            for cell in cells:
+                f.write('| {} | {} | {} | {} | {} | {} | `{}` |\n'.format(
+                    os.path.basename(cell['notebook']), cell['cell'], _format(cell.get('wall_seconds')),
+                    _format(cell.get('cpu_seconds')), _format(cell.get('peak_rss_delta'), 2 ** 20, 1),
+                    _format(cell.get('output_bytes'), 2 ** 10, 1), cell['source'].replace('|', '\\|')))
+
+
+def print_report(results, out=sys.stdout):
+    for path, cells, seconds in results:
+        hits = sum(cell['cache'] == 'hit' for cell in cells)
+        print('{}: {}/{} cells cached, {:.1f}s'.format(path, hits, len(cells), seconds), file=out)
+        for cell in cells:
+            line = '  cell {:>3} {} {}'.format(cell['cell'], cell['key'], cell['cache'])
+            if 'output_bytes' in cell:
+                line += '  {:>7}s wall {:>7}s cpu {:>7} MiB rss {:>8} KiB out'.format(
+                    _format(cell.get('wall_seconds')), _format(cell.get('cpu_seconds')),
+                    _format(cell.get('peak_rss_delta'), 2 ** 20, 1), _format(cell['output_bytes'], 2 ** 10, 1))
+            print(line, file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute notebooks with a cell-level output cache.')
+    parser.add_argument('notebooks', nargs='+')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--timeout', type=int, default=600, help='seconds allowed per cell')
+    parser.add_argument('--notebook-timeout', type=int, help='seconds allowed per notebook')
+    parser.add_argument('-j', '--jobs', type=int, help='notebooks run at once (default: cpu count)')
+    parser.add_argument('--force', action='store_true', help='ignore cached outputs')
+    parser.add_argument('--report', help='also write the per-cell cache report as json')
+    parser.add_argument('--profile', action='store_true',
+                        help='run every notebook and measure time, memory and output size per cell')
+    parser.add_argument('--profile-table', help='write the profile as a Markdown table (implies --profile)')
+    parser.add_argument('--cell-time-budget', type=float, help='seconds a profiled cell may take')
+    parser.add_argument('--cell-output-budget', type=int, help='output bytes a profiled cell may produce')
+    args = parser.parse_args(argv)
+
+    profile = args.profile or bool(args.profile_table)
+    budget = {'seconds': args.cell_time_budget, 'output_bytes': args.cell_output_budget}
+    results = execute_all(args.notebooks, args.jobs, cache_dir=args.cache_dir, timeout=args.timeout,
+                          force=args.force, notebook_timeout=args.notebook_timeout,
+                          profile=profile, budget=budget)
+    print_report(results)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump([cell for _, cells, _ in results for cell in cells], f, indent=1)
+    if args.profile_table:
+        write_profile_table(results, args.profile_table)
+    failures = list(over_budget(results))
+    for message in failures:
+        print('OVER BUDGET ' + message)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# Incremental book build with per-page dependency tracking.
+#
+#     python scripts/incremental_build.py [--explain] [--dry-run] [book dir]
+#
+# Sphinx only records one hash of the whole configuration in .buildinfo, so
+# touching any _config.yml key or references.bib rebuilds every page, and a
+# jupyter-book build re-executes every notebook with it. This records, for
+# every page, what the page actually uses:
+#
+#   source        the page file itself
+#   toc           _toc.yml, every page carries the navigation
+#   config:<key>  the _config.yml sections that page depends on (GLOBAL_CONFIG
+#                 for all pages, NOTEBOOK_CONFIG for notebooks only, BIB_CONFIG
+#                 for pages that cite or print the bibliography)
+#   bib:<key>     each references.bib entry the page cites; the page with the
+#                 {bibliography} directive depends on every cited entry
+#   image:<path>  figures, images and <img> tags the page shows
+#   glue:<name>   the glued outputs the page displays, wherever they are glued
+#   data          for notebooks, the input data fingerprint
+#   modules       for notebooks, the local modules their code imports
+#
+# and compares it with the previous build (_build/.page_deps.json). Only
+# notebooks whose source, execute config or data changed are executed (through
+# execute_notebooks.py and its cell cache), and only stale pages are handed to
+# sphinx-build. It shares jupyter-book's environment (_build/.doctrees) and
+# its conf.py leaves the execute section out, so the pages that did not change
+# are not read again either. --explain prints why each page is rebuilt.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOK_DIR = os.path.join(HERE, os.pardir)
+STATE_FILE = os.path.join('_build', '.page_deps.json')
+# where jupyter-book keeps the sphinx environment and doctrees
+DOCTREES = os.path.join('_build', '.doctrees')
+PAGE_EXTENSIONS = ('.md', '.ipynb')
+# config sections every page's html depends on (header, sidebar, theme, parser)
+GLOBAL_CONFIG = ('title', 'author', 'copyright', 'logo', 'html', 'sphinx', 'parse', 'repository', 'launch_buttons')
+# config sections only executed notebooks depend on
+NOTEBOOK_CONFIG = ('execute',)
+# config sections only pages with citations depend on
+BIB_CONFIG = ('bibtex_bibfiles',)
+
+_CITE = re.compile(r'\{cite(?::\w+)?\}`([^`]+)`')
+_BIBLIOGRAPHY = re.compile(r'\{bibliography\}')
+_IMAGES = (re.compile(r'\{(?:figure|image)\}\s+(\S+)'),
+           re.compile(r'!\[[^\]]*\]\(\s*([^)\s]+)'),
+           re.compile(r'<img\b[^>]*\bsrc="([^"]+)"', re.IGNORECASE))
+_GLUE = (re.compile(r'\{glue(?::\w+)?\}`([^`]+)`'),
+         re.compile(r'\{glue(?::\w+)?\}\s+(\S+)'))
+_BIB_ENTRY = re.compile(r'^@\w+\s*\{\s*([^,\s]+)\s*,', re.MULTILINE)
+
+
+def _hash(data):
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return _hash(f.read())
+    except OSError:
+        return 'missing'
+
+
+def read_notebook(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def page_text(path):
+    """The Markdown of a page; for notebooks, its Markdown cells."""
+    if path.endswith('.ipynb'):
+        cells = read_notebook(path).get('cells', [])
+        return '\n'.join(''.join(cell['source']) for cell in cells if cell['cell_type'] == 'markdown')
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def bib_entries(path):
+    """{citation key: hash of the entry}."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return {}
+    matches = list(_BIB_ENTRY.finditer(text))
+    ends = [match.start() for match in matches[1:]] + [len(text)]
+    return {match.group(1): _hash(text[match.start():end].strip().encode('utf-8'))
+            for match, end in zip(matches, ends)}
+
+
+def glued_outputs(pages):
+    """{glue name: hash of its output} from the outputs stored in the notebooks."""
+    found = {}
+    for path in pages:
+        if not path.endswith('.ipynb'):
+            continue
+        for cell in read_notebook(path).get('cells', []):
+            for output in cell.get('outputs', []):
+                name = output.get('metadata', {}).get('scrapbook', {}).get('name')
+                if name:
+                    found[name] = _hash(output.get('data', {}))
+    return found
+
+
+def module_hash(path):
+    """Hash of the modules next to a notebook that its code cells import."""
+    from execute_notebooks import module_fingerprint
+
+    cells = read_notebook(path).get('cells', [])
+    source = '\n'.join(''.join(cell['source']) for cell in cells if cell['cell_type'] == 'code')
+    return module_fingerprint(source, os.path.dirname(os.path.abspath(path)))[:16]
+
+
+def find_pages(book_dir):
+    pages = []
+    for root, dirs, files in os.walk(book_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(('_', '.'))]
+        pages.extend(os.path.join(root, name) for name in files if name.endswith(PAGE_EXTENSIONS))
+    return sorted(pages)
+
+
+def read_config(book_dir):
+    try:
+        with open(os.path.join(book_dir, '_config.yml'), encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except OSError:
+        return {}
+
+
+def page_dependencies(book_dir, data_fingerprint=''):
+    """{page: {dependency: hash}} for every page of the book."""
+    config = read_config(book_dir)
+    bib_files = config.get('bibtex_bibfiles') or ['references.bib']
+    entries = {}
+    for name in bib_files:
+        entries.update(bib_entries(os.path.join(book_dir, name)))
+    pages = find_pages(book_dir)
+    glued = glued_outputs(pages)
+    toc = _file_hash(os.path.join(book_dir, '_toc.yml'))
+
+    texts = {path: page_text(path) for path in pages}
+    cited = {path: {key.strip() for match in _CITE.finditer(text) for key in match.group(1).split(',')}
+             for path, text in texts.items()}
+    all_cited = set().union(*cited.values()) if cited else set()
+
+    deps = {}
+    for path, text in texts.items():
+        page = os.path.relpath(path, book_dir).replace(os.sep, '/')
+        page_deps = {'source': _file_hash(path), 'toc': toc}
+        keys = list(GLOBAL_CONFIG)
+        if path.endswith('.ipynb'):
+            keys += NOTEBOOK_CONFIG
+            page_deps['data'] = data_fingerprint
+            page_deps['modules'] = module_hash(path)
+        citations = set(cited[path])
+        if _BIBLIOGRAPHY.search(text):
+            citations |= all_cited
+        if citations:
+            keys += BIB_CONFIG
+        for key in keys:
+            if key in config:
+                page_deps['config:' + key] = _hash(config[key])
+        for key in citations:
+            page_deps['bib:' + key] = entries.get(key, 'missing')
+        for pattern in _IMAGES:
+            for match in pattern.finditer(text):
+                src = match.group(1)
+                if not re.match(r'^([a-z]+:|//)', src):
+                    image = os.path.normpath(os.path.join(os.path.dirname(path), src))
+                    page_deps['image:' + src] = _file_hash(image)
+        for pattern in _GLUE:
+            for match in pattern.finditer(text):
+                page_deps['glue:' + match.group(1)] = glued.get(match.group(1), 'missing')
+        deps[page] = page_deps
+    return deps
+
+
+def _output_path(html_dir, page):
+    return os.path.join(html_dir, os.path.splitext(page)[0] + '.html')
+
+
+def changes(previous, current, html_dir):
+    """{page: [reasons]} for every page that has to be rebuilt."""
+    stale = {}
+    for page, deps in current.items():
+        before = previous.get(page)
+        if before is None:
+            stale[page] = ['new page']
+            continue
+        reasons = []
+        if not os.path.exists(_output_path(html_dir, page)):
+            reasons.append('no html output')
+        for key in sorted(set(deps) | set(before)):
+            if key not in before:
+                reasons.append('{} added'.format(key))
+            elif key not in deps:
+                reasons.append('{} no longer used'.format(key))
+            elif deps[key] != before[key]:
+                reasons.append('{} changed'.format(key))
+        if reasons:
+            stale[page] = reasons
+    return stale
+
+
+def needs_execution(page, reasons):
+    """Notebooks only run again when what the kernel sees changed."""
+    triggers = ('new page', 'source ', 'data ', 'modules ') + tuple('config:{} '.format(key) for key in NOTEBOOK_CONFIG)
+    return page.endswith('.ipynb') and any(reason.startswith(triggers) for reason in reasons)
+
+
+def execute_stale(book_dir, stale):
+    """Run the stale notebooks that need it, return the pages executed."""
+    import execute_notebooks
+
+    executed = [page for page, reasons in stale.items() if needs_execution(page, reasons)]
+    for page in executed:
+        execute_notebooks.execute(os.path.join(book_dir, page))
+    return executed
+
+
+def write_conf(book_dir):
+    """conf.py from _config.yml, the way `jupyter-book config sphinx` writes it.
+
+    The execute section is left out: execute_stale() already ran the notebooks,
+    and any change to it would change the sphinx config, which re-reads every page.
+    """
+    from jupyter_book.config import get_final_config
+
+    config = dict(read_config(book_dir), execute={'execute_notebooks': 'off'})
+    sphinx_config, _ = get_final_config(
+        user_yaml=config, sourcedir=Path(book_dir),
+        cli_config={'external_toc_path': '_toc.yml', 'latex_individualpages': False})
+    text = ''.join('{} = {!r}\n'.format(key, sphinx_config[key]) for key in sorted(sphinx_config))
+    path = os.path.join(book_dir, 'conf.py')
+    if not os.path.exists(path) or _file_hash(path) != _hash(text.encode('utf-8')):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def build(book_dir, html_dir, pages):
+    # sphinx-build on the doctrees jupyter-book keeps, so the pages that did not
+    # change are not read again, and it writes only the stale ones
+    write_conf(book_dir)
+    subprocess.run([sys.executable, '-m', 'sphinx', '-b', 'html', '-d', os.path.join(book_dir, DOCTREES),
+                    book_dir, html_dir] + [os.path.join(book_dir, page) for page in pages], check=True)
+
+
+def print_stale(stale, explain, out=sys.stdout):
+    for page, reasons in stale.items():
+        run = ', executed' if needs_execution(page, reasons) else ''
+        print('  {}{}'.format(page, run), file=out)
+        if explain:
+            for reason in reasons:
+                print('      ' + reason, file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild only the book pages whose dependencies changed.')
+    parser.add_argument('book_dir', nargs='?', default=BOOK_DIR)
+    parser.add_argument('--explain', action='store_true', help='list why each page is rebuilt')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be rebuilt')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, HERE)
+    from execute_notebooks import data_fingerprint
+
+    state_path = os.path.join(args.book_dir, STATE_FILE)
+    html_dir = os.path.join(args.book_dir, '_build', 'html')
+    try:
+        with open(state_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+    current = page_dependencies(args.book_dir, data_fingerprint())
+    stale = changes(previous, current, html_dir)
+    print('{} of {} pages to rebuild'.format(len(stale), len(current)))
+    print_stale(stale, args.explain)
+    if args.dry_run or not stale:
+        return 0
+
+    if execute_stale(args.book_dir, stale):
+        # executing refreshed the glued outputs, pages showing them follow
+        current = page_dependencies(args.book_dir, data_fingerprint())
+        more = {page: reasons for page, reasons in changes(previous, current, html_dir).items()
+                if page not in stale}
+        if more:
+            print('{} more pages use outputs that changed'.format(len(more)))
+            print_stale(more, args.explain)
+            stale.update(more)
+    build(args.book_dir, html_dir, list(stale))
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(current, f, indent=1, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,435 @@
+# Post-build asset stage for the book's static files.
+#
+#     python scripts/optimize_assets.py _build/html
+#
+# Run after `jupyter-book build` (and after shard_search_index.py). It
+#
+#   1. bundles the consecutive stylesheets and plain <script src> tags of each
+#      page into one CSS and one JS file, minified when rcssmin / rjsmin are
+#      installed, with @import and url() paths resolved,
+#   2. renames every asset a page or stylesheet references to a content
+#      hashed name and rewrites the references, so _static can be served
+#      with long-lived cache headers,
+#   3. deletes files nothing references that went into a bundle or are copies
+#      of a file that is used: byte-identical duplicates and versioned twins
+#      such as jquery-3.5.1.js next to jquery.js,
+#   4. writes .gz (and .br when brotli is installed) next to text assets,
+#
+# and prints the transfer bytes of each page before and after, both measured
+# as gzip would send them.
+# --drop-legacy-fonts also strips the eot/ttf/svg webfonts from @font-face
+# rules, every current browser uses woff2.
+
+import argparse
+import gzip
+import hashlib
+import os
+import posixpath
+import re
+from html.parser import HTMLParser
+
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:
+    rcssmin = rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIRS = ('_static', '_panels_static')
+COMPRESS_EXTENSIONS = ('.html', '.js', '.css', '.json', '.svg', '.txt', '.xml', '.map')
+COMPRESS_MIN_BYTES = 1024
+LEGACY_FONT_FORMATS = ('embedded-opentype', 'truetype', 'svg')
+
+_TAG = re.compile(r'<script\b[^>]*>\s*</script>|<link\b[^>]*>', re.IGNORECASE)
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_CSS_IMPORT = re.compile(r'''@import\s+(?:url\(\s*)?(['"]?)([^'")]+)\1\s*\)?\s*;''')
+_FONT_FACE = re.compile(r'@font-face\s*{[^}]*}')
+_HASHED_NAME = re.compile(r'[.-][0-9a-f]{8,}\.[a-z0-9]+$')
+_VERSION = re.compile(r'[.-](?:\d+(?:\.\d+)*|[0-9a-f]{8,})(?=\.[a-z0-9]+$)')
+
+
+class _Attrs(HTMLParser):
+    def handle_starttag(self, tag, attrs):
+        self.tag = tag
+        self.attrs = dict(attrs)
+
+
+def tag_attrs(text):
+    parser = _Attrs()
+    parser.feed(text)
+    return parser.tag, parser.attrs
+
+
+def is_local(url):
+    return bool(url) and not re.match(r'^([a-z]+:|//|#|data:)', url, re.IGNORECASE)
+
+
+def split_url(url):
+    """Split 'a/b.css?x#y' into ('a/b.css', '?x#y')."""
+    match = re.match(r'([^?#]*)(.*)', url)
+    return match.group(1), match.group(2)
+
+
+def relative_url(target, from_dir):
+    return posixpath.relpath(target, from_dir) if from_dir else target
+
+
+def _digest(data, length=12):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+class Book:
+    """The files of a built book, addressed by posix paths relative to html_dir."""
+
+    def __init__(self, html_dir):
+        self.html_dir = html_dir
+
+    def path(self, name):
+        return os.path.join(self.html_dir, *name.split('/'))
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def write(self, name, data):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), 'wb') as f:
+            f.write(data)
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def files(self, top=''):
+        for root, _, files in os.walk(self.path(top) if top else self.html_dir):
+            for filename in files:
+                full = os.path.join(root, filename)
+                yield os.path.relpath(full, self.html_dir).replace(os.sep, '/')
+
+    def pages(self):
+        return sorted(name for name in self.files() if name.endswith('.html')
+                      and not name.startswith(ASSET_DIRS))
+
+    def assets(self):
+        return [name for top in ASSET_DIRS if os.path.isdir(self.path(top))
+                for name in self.files(top)]
+
+
+def resolve(url, base_dir):
+    """Book path of a local url found in a file living in base_dir."""
+    path, _ = split_url(url)
+    return posixpath.normpath(posixpath.join(base_dir, path))
+
+
+# -- CSS helpers -----------------------------------------------------------------
+
+def rebase_css(css, from_dir, to_dir):
+    """Rewrite the relative url()s of css moved from from_dir to to_dir."""
+    def rewrite(match):
+        quote, url = match.groups()
+        if not is_local(url):
+            return match.group(0)
+        path, suffix = split_url(url)
+        target = posixpath.normpath(posixpath.join(from_dir, path))
+        return 'url({0}{1}{2}{0})'.format(quote, relative_url(target, to_dir), suffix)
+    return _CSS_URL.sub(rewrite, css)
+
+
+def inline_css(book, name, to_dir, seen=None):
+    """Text of stylesheet name with its @imports inlined, urls relative to to_dir."""
+    seen = set() if seen is None else seen
+    if name in seen:
+        return ''
+    seen.add(name)
+    base = posixpath.dirname(name)
+    css = book.read(name).decode('utf-8')
+
+    imported = []
+
+    def include(match):
+        url = match.group(2)
+        if not is_local(url):
+            return match.group(0)
+        imported.append(inline_css(book, resolve(url, base), to_dir, seen))
+        return '\0{}\0'.format(len(imported) - 1)
+    # imported sheets are already rebased, put them back after rebasing this one
+    css = rebase_css(_CSS_IMPORT.sub(include, css), base, to_dir)
+    return re.sub('\0(\\d+)\0', lambda match: imported[int(match.group(1))], css)
+
+
+def drop_legacy_fonts(css):
+    def clean(match):
+        rule = match.group(0)
+        # the lone IE "src:url(x.eot);" line
+        rule = re.sub(r'src:\s*url\([^)]*\.eot\)\s*;', '', rule)
+
+        def keep_modern(src):
+            entries = [entry for entry in src.group(1).split(',')
+                       if not any('"{}"'.format(fmt) in entry or "'{}'".format(fmt) in entry
+                                  for fmt in LEGACY_FONT_FORMATS)]
+            return 'src:' + ','.join(entries)
+        return re.sub(r'src:([^;}]*)', keep_modern, rule)
+    return _FONT_FACE.sub(clean, css)
+
+
+def css_references(book, name):
+    css = book.read(name).decode('utf-8', 'replace')
+    base = posixpath.dirname(name)
+    return {resolve(url, base) for _, url in _CSS_URL.findall(css) if is_local(url)}
+
+
+def minify(name, text):
+    if name.endswith('.css') and rcssmin:
+        return rcssmin.cssmin(text)
+    if name.endswith('.js') and rjsmin:
+        return rjsmin.jsmin(text)
+    return text
+
+
+# -- stages -------------------------------------------------------------------
+
+def _bundleable(tag, attrs):
+    if tag == 'script':
+        return (is_local(attrs.get('src')) and not {'async', 'defer', 'id', 'type'} & set(attrs)
+                and not any(key.startswith('data-') for key in attrs))
+    return (attrs.get('rel') == 'stylesheet' and is_local(attrs.get('href'))
+            and attrs.get('media', 'all') == 'all')
+
+
+def bundle_pages(book, legacy_fonts=True):
+    """Replace runs of adjacent script / stylesheet tags by a single bundle.
+
+    Returns the set of files that went into a bundle.
+    """
+    bundled = set()
+    for page in book.pages():
+        page_dir = posixpath.dirname(page)
+        html = book.read(page).decode('utf-8')
+        out, runs, last = [], [], 0
+        for match in _TAG.finditer(html):
+            tag, attrs = tag_attrs(match.group(0))
+            if not _bundleable(tag, attrs):
+                continue
+            between = html[runs[-1][-1].end():match.start()] if runs else None
+            if runs and runs[-1][0] == tag and not between.strip():
+                runs[-1][1].append(resolve(attrs.get('src') or attrs['href'], page_dir))
+                runs[-1][-1] = match
+            else:
+                runs.append([tag, [resolve(attrs.get('src') or attrs['href'], page_dir)], match, match])
+        for tag, names, first, end in runs:
+            if len(names) < 2:
+                continue
+            bundled.update(names)
+            if tag == 'script':
+                text = ';\n'.join(minify(name, book.read(name).decode('utf-8')) for name in names)
+                bundle = '_static/bundle-{}.js'.format(_digest(text.encode('utf-8')))
+                markup = '<script src="{}"></script>'
+            else:
+                sheets = []
+                for name in names:
+                    # sheets pulled in by @import go into the bundle as well
+                    imported = set()
+                    sheets.append(minify(name, inline_css(book, name, '_static', imported)))
+                    bundled.update(imported)
+                text = '\n'.join(sheets)
+                if not legacy_fonts:
+                    text = drop_legacy_fonts(text)
+                bundle = '_static/bundle-{}.css'.format(_digest(text.encode('utf-8')))
+                markup = '<link rel="stylesheet" href="{}" />'
+            if not book.exists(bundle):
+                book.write(bundle, text.encode('utf-8'))
+            out.append(html[last:first.start()])
+            out.append(markup.format(relative_url(bundle, page_dir)))
+            last = end.end()
+        out.append(html[last:])
+        book.write(page, ''.join(out).encode('utf-8'))
+    return bundled
+
+
+def page_references(book, page):
+    """Book paths of the local assets a page links to, with their tag text."""
+    page_dir = posixpath.dirname(page)
+    html = book.read(page).decode('utf-8')
+    found = {}
+    for match in re.finditer(r'<(?:script|link|img)\b[^>]*>', html, re.IGNORECASE):
+        _, attrs = tag_attrs(match.group(0))
+        url = attrs.get('src') or attrs.get('href')
+        if is_local(url) and resolve(url, page_dir).startswith(ASSET_DIRS):
+            found[resolve(url, page_dir)] = url
+    return found
+
+
+def referenced_assets(book):
+    """Every asset reachable from a page, following stylesheet url()s."""
+    todo = [name for page in book.pages() for name in page_references(book, page)]
+    seen = set()
+    while todo:
+        name = todo.pop()
+        if name in seen or not book.exists(name):
+            continue
+        seen.add(name)
+        if name.endswith('.css'):
+            todo.extend(css_references(book, name))
+    return seen
+
+
+def rename_css_urls(book, name, renamed):
+    """Point the url()s of stylesheet name at the renamed files."""
+    base = posixpath.dirname(name)
+    css = book.read(name).decode('utf-8')
+
+    def rewrite(match):
+        quote, url = match.groups()
+        if not is_local(url):
+            return match.group(0)
+        path, suffix = split_url(url)
+        target = renamed.get(posixpath.normpath(posixpath.join(base, path)))
+        if target is None:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, relative_url(target, base), suffix)
+    book.write(name, _CSS_URL.sub(rewrite, css).encode('utf-8'))
+
+
+def fingerprint(book, assets):
+    """Rename assets to content hashed names and rewrite their references.
+
+    Stylesheets are renamed after the files they point at, so their hash
+    covers the final urls.
+    """
+    renamed = {}
+    ordered = sorted(assets, key=lambda name: name.endswith('.css'))
+    for name in ordered:
+        if name.endswith('.css'):
+            rename_css_urls(book, name, renamed)
+        if _HASHED_NAME.search(name):
+            renamed[name] = name
+            continue
+        data = book.read(name)
+        stem, ext = posixpath.splitext(name)
+        target = '{}.{}{}'.format(stem, _digest(data, 10), ext)
+        os.replace(book.path(name), book.path(target))
+        renamed[name] = target
+
+    for page in book.pages():
+        page_dir = posixpath.dirname(page)
+        html = book.read(page).decode('utf-8')
+        for name, url in page_references(book, page).items():
+            if renamed.get(name, name) != name:
+                _, suffix = split_url(url)
+                # the ?digest= cache busters are not needed any more
+                suffix = re.sub(r'^\?[^#]*', '', suffix)
+                new = relative_url(renamed[name], page_dir) + suffix
+                html = re.sub(r'''((?:src|href)=["']){}(["'])'''.format(re.escape(url)),
+                              lambda m: m.group(1) + new + m.group(2), html)
+        book.write(page, html.encode('utf-8'))
+    return renamed
+
+
+def _twin_key(name):
+    return _VERSION.sub('', name)
+
+
+def remove_duplicates(book, renamed, bundled, legacy_fonts=True):
+    """Delete unreferenced bundle sources and copies of used or bundled files, return the deleted paths.
+
+    renamed maps the referenced assets to their fingerprinted names. A file
+    still named by a page or by a used script or stylesheet is kept, it may
+    be loaded at run time; a kept stylesheet that went into a bundle gets its
+    url()s pointed at the renamed files.
+    """
+    used = set(renamed.values())
+    # a bundle source also referenced on its own has been renamed already
+    bundled = {name for name in bundled if book.exists(name)}
+    originals = used | bundled
+    used_keys = {_twin_key(posixpath.basename(name)) for name in originals}
+    used_digests = {_digest(book.read(name)) for name in originals}
+    text = ''.join(book.read(name).decode('utf-8', 'replace')
+                   for name in book.pages() + sorted(used) if name.endswith(('.html', '.js', '.css')))
+    # the bundles carry their sources' banner comments, they do not load them
+    loaders = ''.join(book.read(name).decode('utf-8', 'replace')
+                      for name in book.pages() + sorted(used)
+                      if name.endswith(('.html', '.js', '.css')) and not name.startswith('_static/bundle-'))
+    removed = []
+    for name in sorted(bundled - used):
+        if posixpath.basename(name) in loaders:
+            if name.endswith('.css'):
+                rename_css_urls(book, name, renamed)
+        else:
+            os.remove(book.path(name))
+            removed.append(name)
+    for name in book.assets():
+        if name in originals or name.endswith(('.gz', '.br')):
+            continue
+        basename = posixpath.basename(name)
+        if basename in text:
+            continue
+        legacy = not legacy_fonts and name.endswith(('.eot', '.ttf')) or (
+            not legacy_fonts and name.endswith('.svg') and '/webfonts/' in name)
+        if legacy or _twin_key(basename) in used_keys or _digest(book.read(name)) in used_digests:
+            os.remove(book.path(name))
+            removed.append(name)
+    return removed
+
+
+def precompress(book):
+    for name in list(book.files()):
+        if not name.endswith(COMPRESS_EXTENSIONS):
+            continue
+        data = book.read(name)
+        if len(data) < COMPRESS_MIN_BYTES:
+            continue
+        # mtime=0 keeps the .gz files identical between builds
+        book.write(name + '.gz', gzip.compress(data, 9, mtime=0))
+        if brotli:
+            book.write(name + '.br', brotli.compress(data))
+
+
+def wire_bytes(book, name):
+    """Bytes of a file as sent gzipped, the way precompress() writes it, or as it is."""
+    data = book.read(name)
+    if name.endswith(COMPRESS_EXTENSIONS) and len(data) >= COMPRESS_MIN_BYTES:
+        return len(gzip.compress(data, 9, mtime=0))
+    return len(data)
+
+
+def transfer_bytes(book, page):
+    """Bytes a first visit to page downloads: the page plus its scripts and stylesheets.
+
+    Measured with wire_bytes() before and after alike, so the .gz files
+    written here do not count as savings of their own.
+    """
+    names = [name for name in page_references(book, page) if name.endswith(('.js', '.css'))]
+    return wire_bytes(book, page) + sum(wire_bytes(book, name) for name in names if book.exists(name))
+
+
+def optimize(html_dir, legacy_fonts=True):
+    book = Book(html_dir)
+    before = {page: transfer_bytes(book, page) for page in book.pages()}
+    bundled = bundle_pages(book, legacy_fonts)
+    renamed = fingerprint(book, referenced_assets(book))
+    removed = remove_duplicates(book, renamed, bundled, legacy_fonts)
+    precompress(book)
+    after = {page: transfer_bytes(book, page) for page in book.pages()}
+    return before, after, removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bundle, fingerprint and precompress book assets.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(HERE, os.pardir, '_build', 'html'))
+    parser.add_argument('--drop-legacy-fonts', action='store_true',
+                        help='only keep woff2/woff webfonts')
+    args = parser.parse_args(argv)
+    before, after, removed = optimize(args.html_dir, legacy_fonts=not args.drop_legacy_fonts)
+    for name in removed:
+        print('removed ' + name)
+    print('{:<45} {:>10} {:>10}'.format('page', 'before', 'after'))
+    for page in before:
+        print('{:<45} {:>10} {:>10}'.format(page, before[page], after[page]))
+
+
+if __name__ == '__main__':
+    main()
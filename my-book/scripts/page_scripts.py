@@ -0,0 +1,70 @@
+# Add the page scripts chart data loaders need to the built pages.
+#
+#     python scripts/page_scripts.py _build/html
+#
+# Run after `jupyter-book build`, before optimize_assets.py. Charts whose data
+# is loaded by the page itself (partitioned_data() in DataViz/book_charts.py,
+# cube_data() in DataViz/data_cube.py) only name their dataset in the spec.
+# This copies the script that fills such datasets to _static and adds it to
+# the <head> of every page with one of those charts, ahead of the embed
+# scripts, which load vega-embed.
+
+import argparse
+import os
+import posixpath
+import shutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOK_DIR = os.path.join(HERE, os.pardir)
+# dataset name prefix found in a page -> script that loads it
+SCRIPTS = {
+    'book-partitions:': 'partitioned_data.js',
+    'book-cube:': 'data_cube.js',
+}
+
+
+def add_scripts(text, page_dir):
+    """Return text with a <script> for every loader it needs, and the script names."""
+    needed = [script for prefix, script in SCRIPTS.items() if prefix in text]
+    for script in needed:
+        src = posixpath.relpath('_static/' + script, page_dir) if page_dir else '_static/' + script
+        tag = '<script src="{}"></script>'.format(src)
+        if tag not in text:
+            text = text.replace('</head>', tag + '\n</head>', 1)
+    return text, needed
+
+
+def process(html_dir):
+    """Add the loaders to every page, return the number of pages changed."""
+    changed = 0
+    installed = set()
+    for root, _, files in os.walk(html_dir):
+        rel_root = os.path.relpath(root, html_dir)
+        if rel_root.split(os.sep)[0] in ('_static', '_images', '_sources'):
+            continue
+        for filename in files:
+            if not filename.endswith('.html'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            new_text, needed = add_scripts(text, '' if rel_root == '.' else rel_root)
+            installed.update(needed)
+            if new_text != text:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(new_text)
+                changed += 1
+    for script in installed:
+        shutil.copyfile(os.path.join(HERE, script), os.path.join(html_dir, '_static', script))
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add chart data loader scripts to a built book.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(BOOK_DIR, '_build', 'html'))
+    args = parser.parse_args(argv)
+    print('{} pages updated'.format(process(args.html_dir)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+/*
+ * Loads partitioned chart data (partitioned_data() in DataViz/book_charts.py),
+ * added to the pages that need it by scripts/page_scripts.py.
+ *
+ * A chart with a dataset named "book-partitions:manifest=...&selection=..."
+ * starts empty. Once vega-embed has rendered it, this reads the manifest,
+ * loads the partition files matching the selection's current values and
+ * reloads on every selection change. After a change is drawn, the partitions
+ * next to the selected one along the first partition field (the neighbouring
+ * years of the slider) are fetched while the browser is idle, so moving the
+ * slider one step finds its file already loaded.
+ */
+(function () {
+  var PREFIX = 'book-partitions:';
+  var files = {};
+
+  function load(url) {
+    if (!files[url]) {
+      files[url] = fetch(url).then(function (response) {
+        if (!response.ok) throw new Error('partitioned data: ' + response.status + ' for ' + url);
+        return response.json();
+      }).catch(function (err) {
+        delete files[url];
+        throw err;
+      });
+    }
+    return files[url];
+  }
+
+  function whenIdle(callback) {
+    (window.requestIdleCallback || function (f) { return setTimeout(f, 200); })(callback);
+  }
+
+  // {field: [values]} for the tuples in a selection's store
+  function selected(view, selection) {
+    var chosen = {};
+    try {
+      view.data(selection + '_store').forEach(function (tuple) {
+        tuple.fields.forEach(function (field, i) {
+          (chosen[field.field] = chosen[field.field] || []).push(tuple.values[i]);
+        });
+      });
+    } catch (err) {
+      // no store yet, nothing selected
+    }
+    return chosen;
+  }
+
+  function bindDataset(view, name) {
+    var params = new URLSearchParams(name.slice(PREFIX.length));
+    var manifestUrl = new URL(params.get('manifest'), document.baseURI).href;
+    var selection = params.get('selection');
+    var prefetch = Number(params.get('prefetch') || 1);
+    var latest = 0;
+
+    load(manifestUrl).then(function (manifest) {
+      var axis = manifest.fields[0];
+      var axisValues = manifest.values[axis];
+
+      function matching(chosen) {
+        return manifest.partitions.filter(function (partition) {
+          return manifest.fields.every(function (field, i) {
+            return !chosen[field] || chosen[field].indexOf(partition.key[i]) >= 0;
+          });
+        });
+      }
+
+      function fileUrl(partition) {
+        return new URL(partition.url, manifestUrl).href;
+      }
+
+      function neighbours(chosen) {
+        var near = [];
+        (chosen[axis] || []).forEach(function (value) {
+          var i = axisValues.indexOf(value);
+          for (var step = 1; i >= 0 && step <= prefetch; step++) {
+            if (i - step >= 0) near.push(axisValues[i - step]);
+            if (i + step < axisValues.length) near.push(axisValues[i + step]);
+          }
+        });
+        if (!near.length) return [];
+        var shifted = Object.assign({}, chosen);
+        shifted[axis] = near;
+        return matching(shifted);
+      }
+
+      function update() {
+        var chosen = selected(view, selection);
+        var ticket = ++latest;
+        Promise.all(matching(chosen).map(function (partition) {
+          return load(fileUrl(partition));
+        })).then(function (parts) {
+          if (ticket !== latest) return;
+          // copies, vega tags the objects it is given and the files are reused
+          var rows = [];
+          parts.forEach(function (part) {
+            part.forEach(function (row) { rows.push(Object.assign({}, row)); });
+          });
+          view.change(name, vega.changeset().remove(vega.truthy).insert(rows)).run();
+          whenIdle(function () {
+            neighbours(chosen).forEach(function (partition) {
+              load(fileUrl(partition)).catch(function () {});
+            });
+          });
+        }).catch(function (err) {
+          console.error(err);
+        });
+      }
+
+      if (selection) view.addDataListener(selection + '_store', update);
+      update();
+    }).catch(function (err) {
+      console.error(err);
+    });
+  }
+
+  function bind(result) {
+    (result.vgSpec.data || []).forEach(function (data) {
+      if (data.name.indexOf(PREFIX) === 0) bindDataset(result.view, data.name);
+    });
+    return result;
+  }
+
+  function wrap(embed) {
+    if (typeof embed !== 'function' || embed.bookPartitions) return embed;
+    var wrapped = function () {
+      return embed.apply(this, arguments).then(bind);
+    };
+    Object.assign(wrapped, embed);
+    wrapped.bookPartitions = true;
+    return wrapped;
+  }
+
+  // the Altair embed scripts load vega-embed on demand and call the global
+  // vegaEmbed, so wrap it whenever it is (re)defined, on top of any wrapper
+  // installed before this one (data_server.js)
+  var previous = Object.getOwnPropertyDescriptor(window, 'vegaEmbed');
+  var current = wrap(window.vegaEmbed);
+  Object.defineProperty(window, 'vegaEmbed', {
+    configurable: true,
+    get: function () { return current; },
+    set: function (value) {
+      if (previous && previous.set) {
+        previous.set(value);
+        value = previous.get();
+      }
+      current = wrap(value);
+    }
+  });
+})();
@@ -0,0 +1,231 @@
+# Static placeholders for the book's Altair figures, hydrated lazily.
+#
+#     python scripts/prerender_charts.py _build/html
+#
+# Run after `jupyter-book build`, before optimize_assets.py. Every Altair
+# output on a page is a <div id="altair-viz-..."> followed by a script that
+# loads vega/vega-lite/vega-embed and renders the spec in the browser, so the
+# reader sees an empty box until all of that has run. This renders each spec
+# at build time with vl-convert (a headless Vega bundled in a Python wheel, no
+# browser and no network) and puts the SVG (or PNG) into the div. The embed
+# script is kept, but as type="text/plain", and vega_hydrate.js only runs it
+# once the figure comes near the viewport or is clicked.
+#
+# Chart data the specs reference by url (the book_static transformer and
+# boundary_data write it under _static/data) is read from the built site and
+# inlined for rendering. A chart that needs a remote url is left as it was,
+# and so is one with a named dataset the spec does not hold (cube_data,
+# served_data, partitioned_data): the page fills those in, rendered at build
+# time they would only show empty axes.
+# Renders are cached in _build/.chart_cache by spec hash.
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import posixpath
+import re
+import shutil
+
+try:
+    import vl_convert
+except ImportError:
+    vl_convert = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOK_DIR = os.path.join(HERE, os.pardir)
+CACHE_DIR = os.path.join(BOOK_DIR, '_build', '.chart_cache')
+HYDRATE_JS = 'vega_hydrate.js'
+CHART_DIR = '_images/charts'
+
+_EMBED = re.compile(r'<div id="(altair-viz-[0-9a-f]+)"></div>\s*'
+                    r'<script type="text/javascript">(.*?)</script>', re.DOTALL)
+_CALL = re.compile(r'\}\)\(\s*(?=\{)')
+_SCHEMA_VERSION = re.compile(r'/v(\d+\.\d+)(?:\.\d+)?\.json$')
+
+
+class RenderError(Exception):
+    """The chart cannot be rendered offline (remote data, renderer missing or failing)."""
+
+
+def embed_spec(script):
+    """The Vega-Lite spec an Altair embed script passes to vegaEmbed."""
+    match = None
+    for match in _CALL.finditer(script):
+        pass
+    if match is None:
+        raise RenderError('no spec in embed script')
+    spec, _ = json.JSONDecoder().raw_decode(script, match.end())
+    return spec
+
+
+def page_datasets(node, datasets=None):
+    """Names of the datasets a spec uses but does not hold, filled in by page scripts."""
+    if datasets is None:
+        datasets = set(node.get('datasets', {})) if isinstance(node, dict) else set()
+    found = set()
+    if isinstance(node, list):
+        for item in node:
+            found |= page_datasets(item, datasets)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'data' and isinstance(value, dict) and isinstance(value.get('name'), str):
+                if value['name'] not in datasets and 'values' not in value:
+                    found.add(value['name'])
+            elif key != 'datasets':
+                found |= page_datasets(value, datasets)
+    return found
+
+
+def inline_data(node, html_dir, page_dir):
+    """Replace local data urls in a spec with the values read from the built site."""
+    if isinstance(node, list):
+        return [inline_data(item, html_dir, page_dir) for item in node]
+    if not isinstance(node, dict):
+        return node
+    node = {key: inline_data(value, html_dir, page_dir) for key, value in node.items()}
+    url = node.get('url')
+    if isinstance(url, str):
+        if re.match(r'^([a-z]+:|//)', url, re.IGNORECASE):
+            raise RenderError('remote data {}'.format(url))
+        path = os.path.normpath(os.path.join(html_dir, page_dir, url.split('?')[0]))
+        if not os.path.isfile(path):
+            raise RenderError('missing data {}'.format(url))
+        fmt = dict(node.get('format', {}))
+        with open(path, encoding='utf-8') as f:
+            if fmt.get('type', 'json') == 'json':
+                values = json.load(f)
+                # inline values are not looked up by property, do it here
+                if 'property' in fmt:
+                    values = values[fmt.pop('property')]
+            else:
+                values = f.read()
+        node['values'] = values
+        del node['url']
+        if fmt:
+            node['format'] = fmt
+        else:
+            node.pop('format', None)
+    return node
+
+
+def render(spec, fmt='svg', cache_dir=CACHE_DIR):
+    """Rendered bytes of a self-contained Vega-Lite spec, rendering it only once."""
+    if vl_convert is None:
+        raise RenderError('vl-convert-python is not installed')
+    text = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+    cached = os.path.join(cache_dir, digest + '.' + fmt)
+    if not os.path.exists(cached):
+        match = _SCHEMA_VERSION.search(spec.get('$schema', ''))
+        version = match.group(1) if match else None
+        try:
+            if fmt == 'svg':
+                data = vl_convert.vegalite_to_svg(text, vl_version=version).encode('utf-8')
+            else:
+                data = vl_convert.vegalite_to_png(text, vl_version=version, scale=2)
+        except Exception as err:
+            raise RenderError(str(err))
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cached + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(cached + '.tmp', cached)
+    return cached, digest
+
+
+def _size(path, fmt):
+    if fmt == 'svg':
+        with open(path, encoding='utf-8') as f:
+            head = f.read(2000)
+        width = re.search(r'<svg[^>]*\swidth="([\d.]+)', head)
+        height = re.search(r'<svg[^>]*\sheight="([\d.]+)', head)
+        return (width and round(float(width.group(1))), height and round(float(height.group(1))))
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    # PNG IHDR, rendered at scale=2
+    return int.from_bytes(header[16:20], 'big') // 2, int.from_bytes(header[20:24], 'big') // 2
+
+
+def placeholder(div_id, script, html_dir, page_dir, fmt='svg', cache_dir=CACHE_DIR):
+    """The markup replacing one Altair output: prerendered image plus inert embed script."""
+    spec = embed_spec(script)
+    filled = page_datasets(spec)
+    if filled:
+        raise RenderError('data filled by the page ({})'.format(', '.join(sorted(filled))))
+    spec = inline_data(spec, html_dir, page_dir)
+    cached, digest = render(spec, fmt, cache_dir)
+    name = '{}.{}'.format(digest, fmt)
+    os.makedirs(os.path.join(html_dir, CHART_DIR), exist_ok=True)
+    target = os.path.join(html_dir, CHART_DIR, name)
+    if not os.path.exists(target):
+        shutil.copyfile(cached, target)
+    src = os.path.relpath(target, os.path.join(html_dir, page_dir)).replace(os.sep, '/')
+    width, height = _size(cached, fmt)
+    size = ''.join(' {}="{}"'.format(key, value)
+                   for key, value in (('width', width), ('height', height)) if value)
+    title = spec.get('title')
+    alt = html.escape(title if isinstance(title, str) else 'Interactive chart, click to load', quote=True)
+    return ('<div id="{id}" class="vega-prerendered" role="button" tabindex="0">'
+            '<img class="vega-placeholder" src="{src}" alt="{alt}"{size} decoding="async" />'
+            '</div>\n'
+            '<script type="text/plain" data-vega-hydrate="{id}">{script}</script>'
+            ).format(id=div_id, src=src, alt=alt, size=size, script=script)
+
+
+def _add_loader(text, page_dir):
+    src = posixpath.relpath('_static/' + HYDRATE_JS, page_dir) if page_dir else '_static/' + HYDRATE_JS
+    tag = '<script src="{}" defer></script>'.format(src)
+    if tag in text:
+        return text
+    return text.replace('</head>', tag + '\n</head>', 1)
+
+
+def process(html_dir, fmt='svg', cache_dir=CACHE_DIR):
+    """Prerender the charts of every page, return (rendered, skipped)."""
+    rendered = skipped = 0
+    for root, _, files in os.walk(html_dir):
+        rel_root = os.path.relpath(root, html_dir)
+        if rel_root.split(os.sep)[0] in ('_static', '_images', '_sources'):
+            continue
+        for filename in files:
+            if not filename.endswith('.html'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            page_dir = '' if rel_root == '.' else rel_root
+
+            def replace(match):
+                nonlocal rendered, skipped
+                try:
+                    new = placeholder(match.group(1), match.group(2), html_dir, page_dir, fmt, cache_dir)
+                except RenderError as err:
+                    print('{}: {} left interactive only ({})'.format(
+                        os.path.relpath(path, html_dir), match.group(1), err))
+                    skipped += 1
+                    return match.group(0)
+                rendered += 1
+                return new
+
+            new_text = _EMBED.sub(replace, text)
+            if new_text != text:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(_add_loader(new_text, page_dir))
+    if rendered:
+        shutil.copyfile(os.path.join(HERE, HYDRATE_JS), os.path.join(html_dir, '_static', HYDRATE_JS))
+    return rendered, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prerender the Altair charts of a built book.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(BOOK_DIR, '_build', 'html'))
+    parser.add_argument('--format', choices=('svg', 'png'), default='svg')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    rendered, skipped = process(args.html_dir, args.format, args.cache_dir)
+    print('{} charts prerendered, {} skipped'.format(rendered, skipped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# Responsive variants of the book's figures.
+#
+#     python scripts/responsive_images.py _build/html
+#
+# Run after `jupyter-book build`, before optimize_assets.py. Every <img> that
+# points into _images/, and the theme's logo, gets WebP (and AVIF, when
+# Pillow can write it) versions at the widths in WIDTHS that are smaller than
+# the original, plus the original width when it is not above the largest of
+# WIDTHS. The tag is wrapped in a <picture> with srcset and a sizes for the
+# width the image is shown at (its own width, a width set on the tag, its
+# class, at most the content column), and gets loading="lazy" plus its width
+# and height so the page does not jump while images load. The theme only caps
+# the width of images, so a height added here comes with height:auto to keep
+# the image's aspect ratio when it is shown narrower.
+#
+# Encoded variants are cached in _build/.image_cache by source hash, so an
+# unchanged figure is never re-encoded.
+
+import argparse
+import hashlib
+import html
+import io
+import os
+import re
+import shutil
+from html.parser import HTMLParser
+
+from PIL import Image, features
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOK_DIR = os.path.join(HERE, os.pardir)
+CACHE_DIR = os.path.join(BOOK_DIR, '_build', '.image_cache')
+WIDTHS = (320, 640, 960, 1280)
+# the book theme's content column is at most about 750px wide
+CONTENT_WIDTH = 750
+# narrower places the theme shows images in, by class
+CLASS_WIDTHS = {'logo': 300}
+QUALITY = {'webp': 80, 'avif': 60}
+MIME = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+_IMG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_STYLE_WIDTH = re.compile(r'(?:^|;)\s*width:\s*([\d.]+)px', re.IGNORECASE)
+_STYLE_HEIGHT = re.compile(r'(?:^|;)\s*height:', re.IGNORECASE)
+
+
+class _Attrs(HTMLParser):
+    def handle_starttag(self, tag, attrs):
+        self.attrs = attrs
+
+
+def img_attrs(tag):
+    parser = _Attrs()
+    parser.feed(tag)
+    return parser.attrs
+
+
+def formats():
+    # AVIF needs a Pillow built with libavif (or pillow-avif-plugin)
+    found = ['webp'] if features.check('webp') else []
+    try:
+        avif = features.check('avif')
+    except ValueError:
+        # Pillow too old to know about AVIF at all
+        avif = False
+    return ['avif'] + found if avif else found
+
+
+def encode(source_path, width, fmt, cache_dir=CACHE_DIR):
+    """Return the path of source resized to width in fmt, encoding it only once."""
+    with open(source_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    cached = os.path.join(cache_dir, '{}-{}-q{}.{}'.format(digest, width, QUALITY[fmt], fmt))
+    if not os.path.exists(cached):
+        os.makedirs(cache_dir, exist_ok=True)
+        with Image.open(source_path) as image:
+            height = round(image.height * width / image.width)
+            resized = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            resized = resized.resize((width, height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, fmt.upper(), quality=QUALITY[fmt])
+        with open(cached + '.tmp', 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(cached + '.tmp', cached)
+    return cached, digest
+
+
+def variants(html_dir, src_path, cache_dir=CACHE_DIR):
+    """Copy the variants of one image into _images/variants, {fmt: [(url path, width)]}."""
+    with Image.open(src_path) as image:
+        original_width = image.width
+    # nothing is shown wider than the content column, so no variant above WIDTHS
+    widths = [width for width in WIDTHS if width < original_width]
+    if original_width <= WIDTHS[-1]:
+        widths.append(original_width)
+    out_dir = os.path.join(html_dir, '_images', 'variants')
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    found = {}
+    for fmt in formats():
+        for width in widths:
+            cached, digest = encode(src_path, width, fmt, cache_dir)
+            name = '{}-{}-{}.{}'.format(stem, digest[:8], width, fmt)
+            target = os.path.join(out_dir, name)
+            if not os.path.exists(target):
+                shutil.copyfile(cached, target)
+            found.setdefault(fmt, []).append(('_images/variants/' + name, width))
+    return found
+
+
+def display_width(attrs, width):
+    """Widest, in CSS pixels, an image `width` pixels wide is shown with these attributes."""
+    shown = [width, CONTENT_WIDTH]
+    declared = attrs.get('width') or ''
+    if declared.isdigit():
+        shown.append(int(declared))
+    style = _STYLE_WIDTH.search(attrs.get('style') or '')
+    if style:
+        shown.append(round(float(style.group(1))))
+    shown.extend(CLASS_WIDTHS[name] for name in (attrs.get('class') or '').split() if name in CLASS_WIDTHS)
+    return min(shown)
+
+
+def sizes(shown):
+    # full width on screens narrower than the image, its own width on the others
+    return '(max-width: {0}px) 100vw, {0}px'.format(shown)
+
+
+def picture(tag, attrs, html_dir, page_dir, cache_dir=CACHE_DIR):
+    """The <picture> markup replacing one <img> tag, or the tag unchanged."""
+    attrs = dict(attrs)
+    src = attrs.get('src', '')
+    src_path = os.path.normpath(os.path.join(html_dir, page_dir, src))
+    rel = os.path.relpath(src_path, html_dir).replace(os.sep, '/')
+    logo = 'logo' in (attrs.get('class') or '').split()
+    if 'srcset' in attrs or not (rel.startswith('_images/') or logo) or not os.path.isfile(src_path):
+        return tag
+    if src_path.lower().endswith(('.svg', '.gif')):
+        return tag
+    with Image.open(src_path) as image:
+        width, height = image.size
+    shown = display_width(attrs, width)
+    sources = []
+    for fmt, entries in variants(html_dir, src_path, cache_dir).items():
+        srcset = ', '.join('{} {}w'.format(os.path.relpath(os.path.join(html_dir, path),
+                                                          os.path.join(html_dir, page_dir)).replace(os.sep, '/'),
+                                          variant_width)
+                           for path, variant_width in entries)
+        sources.append('<source type="{}" srcset="{}" sizes="{}">'.format(MIME[fmt], srcset, sizes(shown)))
+    if not logo:
+        # the logo is at the top of every page, the rest can wait for scrolling
+        attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    attrs.setdefault('width', str(width))
+    if 'height' not in attrs:
+        attrs['height'] = str(height)
+        # max-width:100% shrinks the width only, the height has to follow it
+        style = (attrs.get('style') or '').strip().rstrip(';')
+        if not _STYLE_HEIGHT.search(style):
+            attrs['style'] = style + ';height:auto' if style else 'height:auto'
+    img = '<img {} />'.format(' '.join('{}="{}"'.format(key, html.escape(value or '', quote=True))
+                                       for key, value in attrs.items()))
+    return '<picture>{}{}</picture>'.format(''.join(sources), img)
+
+
+def process(html_dir, cache_dir=CACHE_DIR):
+    """Rewrite the images of every page, return the number of tags changed."""
+    changed = 0
+    for root, _, files in os.walk(html_dir):
+        rel_root = os.path.relpath(root, html_dir)
+        if rel_root.split(os.sep)[0] in ('_static', '_images', '_sources'):
+            continue
+        for filename in files:
+            if not filename.endswith('.html'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            page_dir = '' if rel_root == '.' else rel_root
+            out, last = [], 0
+            for match in _IMG.finditer(text):
+                # already wrapped by an earlier run
+                if text.rfind('<picture>', 0, match.start()) > text.rfind('</picture>', 0, match.start()):
+                    continue
+                new = picture(match.group(0), img_attrs(match.group(0)), html_dir, page_dir, cache_dir)
+                if new != match.group(0):
+                    out.append(text[last:match.start()])
+                    out.append(new)
+                    last = match.end()
+                    changed += 1
+            if last:
+                out.append(text[last:])
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(''.join(out))
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add responsive image variants to a built book.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(BOOK_DIR, '_build', 'html'))
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    print('{} images rewritten'.format(process(args.html_dir, args.cache_dir)))
+
+
+if __name__ == '__main__':
+    main()
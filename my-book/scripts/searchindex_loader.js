@@ -0,0 +1,104 @@
+/*
+ * Sharded search index loader, installed as searchindex.js by
+ * scripts/shard_search_index.py.
+ *
+ * Instead of one Search.setIndex({...}) blob this loads a small dictionary of
+ * terms, then fetches only the shards holding the terms a query can match
+ * (exact words plus the partial matches searchtools.js scores) before
+ * handing the query to the stock Search.query. The index it builds has
+ * every term the query can touch, so the results are the same as with the
+ * full index.
+ */
+(function () {
+  var root = DOCUMENTATION_OPTIONS.URL_ROOT + '_static/searchindex/';
+  var dictionary = null;
+  var loaded = {};
+  var runQuery = Search.query;
+
+  // postings are base64 varints of doc number deltas
+  function decodePostings(text) {
+    var bytes = atob(text), docs = [], value = 0, shift = 0, previous = 0;
+    for (var i = 0; i < bytes.length; i++) {
+      var b = bytes.charCodeAt(i);
+      value |= (b & 0x7f) << shift;
+      if (b & 0x80) {
+        shift += 7;
+      } else {
+        previous += value;
+        docs.push(previous);
+        value = 0;
+        shift = 0;
+      }
+    }
+    // single documents are stored as a plain number, like Sphinx does
+    return docs.length == 1 ? docs[0] : docs;
+  }
+
+  // the words Search.query will look up, stemmed the same way
+  function searchWords(query) {
+    var stemmer = new Stemmer(), words = [], parts = splitQuery(query);
+    for (var i = 0; i < parts.length; i++) {
+      var lower = parts[i].toLowerCase();
+      if (parts[i] === '' || $u.indexOf(stopwords, lower) != -1)
+        continue;
+      var word = stemmer.stemWord(lower);
+      if (word.length < 3 && parts[i].length >= 3)
+        word = parts[i];
+      if (word[0] == '-')
+        word = word.substr(1);
+      words.push(word);
+    }
+    return words;
+  }
+
+  function matches(term, word) {
+    return term === word || (word.length > 2 && term.match(Search.escapeRegExp(word)));
+  }
+
+  function neededShards(words) {
+    var needed = [];
+    $.each(dictionary.shards, function (_, shard) {
+      if (loaded[shard.file])
+        return;
+      var terms = shard.terms.concat(shard.titleterms);
+      for (var i = 0; i < words.length; i++) {
+        for (var j = 0; j < terms.length; j++) {
+          if (matches(terms[j], words[i])) {
+            needed.push(shard.file);
+            return;
+          }
+        }
+      }
+    });
+    return needed;
+  }
+
+  function loadShard(file) {
+    return $.ajax({url: root + file, dataType: 'json', cache: true}).done(function (shard) {
+      $.each(['terms', 'titleterms'], function (_, kind) {
+        var target = Search._index[kind];
+        $.each(shard[kind], function (term, postings) {
+          target[term] = decodePostings(postings);
+        });
+      });
+      loaded[file] = true;
+    });
+  }
+
+  Search.query = function (query) {
+    var files = neededShards(searchWords(query));
+    if (!files.length)
+      return runQuery.call(Search, query);
+    $.when.apply($, $.map(files, loadShard)).always(function () {
+      runQuery.call(Search, query);
+    });
+  };
+
+  $.ajax({url: root + 'dictionary.json', dataType: 'json', cache: true}).done(function (data) {
+    dictionary = data;
+    var index = data.base;
+    index.terms = {};
+    index.titleterms = {};
+    Search.setIndex(index);
+  });
+})();
@@ -0,0 +1,157 @@
+# Replace the monolithic searchindex.js of a built book with a sharded index.
+#
+#     python scripts/shard_search_index.py _build/html
+#
+# Run after `jupyter-book build`. Sphinx writes every term and its postings
+# into one Search.setIndex({...}) call that the search page downloads and
+# parses before the first query. This splits it into:
+#
+#   _static/searchindex/dictionary.json  everything except postings, plus the
+#                                        list of terms held by each shard
+#   _static/searchindex/shard-NNN.json   postings for the terms sharing a
+#                                        prefix, as delta + varint bytes
+#
+# and installs searchindex_loader.js as searchindex.js, which fetches the
+# dictionary and then only the shards a query needs. The original file is
+# kept as _static/searchindex/searchindex.full.js.
+#
+# The dictionary still lists every term, so that partial matches can be
+# resolved without fetching every shard. Sharding only pays off when the
+# postings make up most of the index: an index under SHARD_MIN_BYTES, or one
+# whose dictionary would exceed MAX_DICTIONARY_SHARE of it, is left as it is.
+
+import argparse
+import base64
+import json
+import os
+import shutil
+from collections import defaultdict
+
+from sphinx.search import js_index
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOADER = os.path.join(HERE, 'searchindex_loader.js')
+PREFIX_LENGTH = 2
+# below this size one request for the whole index beats dictionary + shards
+SHARD_MIN_BYTES = 64 * 1024
+# largest dictionary, as a share of the whole index, worth a second request
+MAX_DICTIONARY_SHARE = 0.5
+
+
+def encode_postings(docs):
+    """Encode a doc number or list of doc numbers as base64 delta varints."""
+    docs = sorted(docs) if isinstance(docs, list) else [docs]
+    out = bytearray()
+    previous = 0
+    for doc in docs:
+        delta = doc - previous
+        previous = doc
+        while delta > 0x7f:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return base64.b64encode(bytes(out)).decode('ascii')
+
+
+def decode_postings(text):
+    """Inverse of encode_postings, single docs come back as a plain int."""
+    docs = []
+    value = shift = previous = 0
+    for byte in base64.b64decode(text):
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += value
+            docs.append(previous)
+            value = shift = 0
+    return docs[0] if len(docs) == 1 else docs
+
+
+def shard_index(index, prefix_length=PREFIX_LENGTH):
+    """Split a Sphinx search index into (dictionary, {file: shard})."""
+    groups = defaultdict(lambda: {'terms': {}, 'titleterms': {}})
+    for kind in ('terms', 'titleterms'):
+        for term, docs in index[kind].items():
+            groups[term[:prefix_length].lower()][kind][term] = encode_postings(docs)
+
+    base = {key: value for key, value in index.items() if key not in ('terms', 'titleterms')}
+    dictionary = {'base': base, 'shards': []}
+    shards = {}
+    for number, prefix in enumerate(sorted(groups)):
+        shard = groups[prefix]
+        filename = 'shard-{:03d}.json'.format(number)
+        shards[filename] = shard
+        dictionary['shards'].append({'file': filename,
+                                     'terms': sorted(shard['terms']),
+                                     'titleterms': sorted(shard['titleterms'])})
+    return dictionary, shards
+
+
+def worth_sharding(index_bytes, dictionary_bytes):
+    """Whether a query downloads clearly less with the sharded index."""
+    return index_bytes >= SHARD_MIN_BYTES and dictionary_bytes <= index_bytes * MAX_DICTIONARY_SHARE
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, sort_keys=True)
+
+
+def _dump(obj, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(_dumps(obj))
+
+
+def write_sharded_index(html_dir, prefix_length=PREFIX_LENGTH):
+    """Shard html_dir/searchindex.js in place and return the files written.
+
+    Nothing is written, and an index sharded by an earlier run is put back,
+    when the index is too small for sharding to pay off (worth_sharding()).
+    """
+    index_path = os.path.join(html_dir, 'searchindex.js')
+    out_dir = os.path.join(html_dir, '_static', 'searchindex')
+    full_path = os.path.join(out_dir, 'searchindex.full.js')
+    # a second run reads the untouched copy rather than the loader
+    source = full_path if os.path.exists(full_path) else index_path
+    with open(source, encoding='utf-8') as f:
+        text = f.read()
+    index = js_index.loads(text)
+    dictionary, shards = shard_index(index, prefix_length)
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    if not worth_sharding(len(text.encode('utf-8')), len(_dumps(dictionary).encode('utf-8'))):
+        if source == full_path:
+            with open(index_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return []
+    os.makedirs(out_dir)
+    with open(full_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    written = [os.path.join(out_dir, 'dictionary.json')]
+    _dump(dictionary, written[0])
+    for filename, shard in shards.items():
+        written.append(os.path.join(out_dir, filename))
+        _dump(shard, written[-1])
+    shutil.copyfile(LOADER, index_path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shard the search index of a built book.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(HERE, os.pardir, '_build', 'html'))
+    parser.add_argument('--prefix-length', type=int, default=PREFIX_LENGTH,
+                        help='terms sharing this many leading characters go in one shard')
+    args = parser.parse_args(argv)
+    written = write_sharded_index(args.html_dir, args.prefix_length)
+    if not written:
+        print('search index left as it is, too small to gain from sharding')
+        return
+    sizes = [os.path.getsize(path) for path in written]
+    print('{} shards, {} bytes in total, dictionary {} bytes'.format(
+        len(written) - 1, sum(sizes), sizes[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+/*
+ * Lazy hydration of the Altair charts (see prerender_charts.py and
+ * vega_runtime.py).
+ *
+ * Each chart is a <div class="vega-prerendered"> holding a static image, or
+ * an empty <div class="vega-lazy">, followed by its embed script as <script
+ * type="text/plain" data-vega-hydrate="id">. The script is run, and so vega
+ * and the chart data are downloaded, only when the chart comes within
+ * HYDRATE_MARGIN of the viewport or the reader clicks / presses Enter on it.
+ * The static image stays until vega-embed has put its own output into the div.
+ */
+(function () {
+  var HYDRATE_MARGIN = '200px';
+
+  function hydrate(div) {
+    if (div.dataset.hydrated) return;
+    div.dataset.hydrated = '1';
+    var inert = document.querySelector('script[data-vega-hydrate="' + div.id + '"]');
+    if (!inert) return;
+    var placeholder = div.querySelector('.vega-placeholder');
+    if (placeholder) {
+      // fix the box to the image size so the page does not jump while vega loads
+      div.style.minHeight = placeholder.offsetHeight + 'px';
+      new MutationObserver(function (changes, observer) {
+        for (var i = 0; i < changes.length; i++) {
+          for (var j = 0; j < changes[i].addedNodes.length; j++) {
+            if (changes[i].addedNodes[j] !== placeholder) {
+              placeholder.remove();
+              div.style.minHeight = '';
+              observer.disconnect();
+              return;
+            }
+          }
+        }
+      }).observe(div, {childList: true});
+    }
+    div.removeAttribute('role');
+    div.removeAttribute('tabindex');
+    var script = document.createElement('script');
+    script.text = inert.textContent;
+    inert.parentNode.replaceChild(script, inert);
+  }
+
+  function init() {
+    var charts = document.querySelectorAll('div.vega-prerendered, div.vega-lazy');
+    var observer = 'IntersectionObserver' in window ? new IntersectionObserver(function (entries) {
+      entries.forEach(function (entry) {
+        if (entry.isIntersecting) {
+          observer.unobserve(entry.target);
+          hydrate(entry.target);
+        }
+      });
+    }, {rootMargin: HYDRATE_MARGIN}) : null;
+
+    Array.prototype.forEach.call(charts, function (div) {
+      div.addEventListener('click', function () { hydrate(div); });
+      div.addEventListener('keydown', function (event) {
+        if (event.key === 'Enter' || event.key === ' ') hydrate(div);
+      });
+      if (observer) {
+        observer.observe(div);
+      } else {
+        hydrate(div);
+      }
+    });
+  }
+
+  if (document.readyState === 'loading') {
+    document.addEventListener('DOMContentLoaded', init);
+  } else {
+    init();
+  }
+})();
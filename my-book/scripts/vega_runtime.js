@@ -0,0 +1,86 @@
+/*
+ * Self-hosted Vega runtime of the chart pages (see vega_runtime.py).
+ *
+ * The <script> tag of this file names the vendored vega, vega-embed and, when
+ * a chart of the page was left as Vega-Lite, vega-lite files in its
+ * data-vega, data-vega-embed and data-vega-lite attributes. Nothing is
+ * downloaded until vega_hydrate.js runs the first chart's
+ * bookVega.embed(id, spec, options); the files are then loaded once for the
+ * page, in order, and rendered through the global vegaEmbed so the chart
+ * data loaders installed on it still apply. Their names are content hashed,
+ * the browser keeps them across pages.
+ */
+(function () {
+  var LIBRARIES = ['vega', 'vega-lite', 'vega-embed'];
+  var script = document.currentScript;
+  var urls = {};
+  var ready = null;
+
+  LIBRARIES.forEach(function (name) {
+    var url = script && script.getAttribute('data-' + name);
+    if (url) urls[name] = new URL(url, document.baseURI).href;
+  });
+
+  function loadScript(url) {
+    return new Promise(function (resolve, reject) {
+      var tag = document.createElement('script');
+      tag.src = url;
+      tag.onload = resolve;
+      tag.onerror = function () { reject(new Error('vega runtime: cannot load ' + url)); };
+      document.head.appendChild(tag);
+    });
+  }
+
+  // with require.js on the page (notebook pages have it for widgets) the UMD
+  // builds register as AMD modules instead of globals
+  function loadModules() {
+    return new Promise(function (resolve, reject) {
+      var paths = {};
+      Object.keys(urls).forEach(function (name) {
+        paths[name] = urls[name].replace(/\.js$/, '');
+      });
+      if (!urls['vega-lite'] && !window.require.defined('vega-lite')) {
+        // vega-embed depends on it, but never calls it for Vega specs
+        window.define('vega-lite', [], function () { return {}; });
+      }
+      window.requirejs.config({paths: paths});
+      window.require(['vega', 'vega-embed'], function (vega, embed) {
+        window.vega = window.vega || vega;
+        window.vegaEmbed = embed;
+        resolve();
+      }, reject);
+    });
+  }
+
+  function runtime() {
+    if (!ready) {
+      if (typeof window.define === 'function' && window.define.amd) {
+        ready = loadModules();
+      } else {
+        ready = LIBRARIES.filter(function (name) { return urls[name]; }).reduce(function (previous, name) {
+          return previous.then(function () { return loadScript(urls[name]); });
+        }, Promise.resolve());
+      }
+      ready = ready.catch(function (err) {
+        ready = null;
+        throw err;
+      });
+    }
+    return ready;
+  }
+
+  function embed(id, spec, options) {
+    var div = document.getElementById(id);
+    return runtime().then(function () {
+      return window.vegaEmbed(div, spec, options);
+    }).catch(function (err) {
+      console.error(err);
+      // a prerendered chart keeps its static image
+      if (!div.querySelector('.vega-placeholder')) {
+        div.textContent = 'The chart could not be loaded: ' + err.message;
+      }
+    });
+  }
+
+  window.bookVega = {embed: embed, runtime: runtime};
+})();
@@ -0,0 +1,236 @@
+# Self-hosted, lazily loaded Vega runtime for the pages with Altair charts.
+#
+#     python scripts/vega_runtime.py _build/html
+#
+# Run after prerender_charts.py and page_scripts.py, before optimize_assets.py.
+# Each Altair embed script fetches vega, vega-lite and vega-embed from a CDN
+# as soon as the page is parsed, outside the _static pipeline. This
+#
+#   1. vendors the RUNTIME versions into _static/vendor/vega under content
+#      hashed names, so they are shared by every chart page and can be cached
+#      for good; they are copied from altair_viewer when it is installed,
+#      downloaded from the CDN otherwise, once, into _build/.vega_runtime,
+#   2. compiles each chart's Vega-Lite spec to Vega with vl-convert, cached in
+#      _build/.chart_cache by spec hash, so the browser skips that step and a
+#      page whose charts all compiled does not load vega-lite at all,
+#   3. replaces the embed script by an inert bookVega.embed() call that
+#      vega_hydrate.js runs when the chart comes near the viewport (scripts
+#      already made inert by prerender_charts.py are rewritten in place),
+#   4. adds vega_runtime.js, which loads the vendored files on the first
+#      call, to the chart pages only; other pages are left as they are.
+#
+# A chart whose spec cannot be compiled is embedded as Vega-Lite.
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+
+from prerender_charts import CACHE_DIR, HYDRATE_JS, RenderError, _CALL, _EMBED, _SCHEMA_VERSION, vl_convert
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOK_DIR = os.path.join(HERE, os.pardir)
+RUNTIME_DIR = os.path.join(BOOK_DIR, '_build', '.vega_runtime')
+RUNTIME_JS = 'vega_runtime.js'
+VENDOR_DIR = '_static/vendor/vega'
+# the versions Altair 4 asks for (vega@5, vega-lite@4.17.0, vega-embed@6), in load order
+RUNTIME = (('vega', '5.21.0'), ('vega-lite', '4.17.0'), ('vega-embed', '6.20.0'))
+CDN_URL = 'https://cdn.jsdelivr.net/npm/{name}@{version}/build/{name}.min.js'
+
+_INERT = re.compile(r'<script type="text/plain" data-vega-hydrate="(altair-viz-[0-9a-f]+)">(.*?)</script>',
+                    re.DOTALL)
+_COMMA = re.compile(r'\s*,\s*')
+_EMBED_CALL = 'bookVega.embed('
+
+
+def runtime_file(name, version, runtime_dir=RUNTIME_DIR):
+    """Path of the minified build of a runtime library, fetching it only once."""
+    filename = '{}-{}.js'.format(name, version)
+    cached = os.path.join(runtime_dir, filename)
+    if os.path.exists(cached):
+        return cached
+    os.makedirs(runtime_dir, exist_ok=True)
+    viewer = importlib.util.find_spec('altair_viewer')
+    bundled = viewer and os.path.join(os.path.dirname(viewer.origin), 'scripts', filename)
+    if bundled and os.path.exists(bundled):
+        shutil.copyfile(bundled, cached + '.tmp')
+    else:
+        url = CDN_URL.format(name=name, version=version)
+        with urllib.request.urlopen(url, timeout=60) as response, open(cached + '.tmp', 'wb') as f:
+            shutil.copyfileobj(response, f)
+    os.replace(cached + '.tmp', cached)
+    return cached
+
+
+def vendor_runtime(html_dir, runtime_dir=RUNTIME_DIR):
+    """Copy the runtime into the built site, return {library: book path}."""
+    vendored = {}
+    for name, version in RUNTIME:
+        with open(runtime_file(name, version, runtime_dir), 'rb') as f:
+            data = f.read()
+        target = '{}/{}.{}.js'.format(VENDOR_DIR, name, hashlib.sha256(data).hexdigest()[:10])
+        path = os.path.join(html_dir, *target.split('/'))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        vendored[name] = target
+    return vendored
+
+
+def embed_arguments(script):
+    """The spec and embed options an Altair embed script passes to vegaEmbed."""
+    match = None
+    for match in _CALL.finditer(script):
+        pass
+    if match is None:
+        raise RenderError('no spec in embed script')
+    decoder = json.JSONDecoder()
+    spec, end = decoder.raw_decode(script, match.end())
+    comma = _COMMA.match(script, end)
+    options = {}
+    if comma:
+        try:
+            options, _ = decoder.raw_decode(script, comma.end())
+        except ValueError:
+            pass
+    return spec, options
+
+
+def compile_spec(spec, cache_dir=CACHE_DIR):
+    """The Vega spec a Vega-Lite spec compiles to, compiling it only once."""
+    if vl_convert is None:
+        raise RenderError('vl-convert-python is not installed')
+    text = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+    cached = os.path.join(cache_dir, digest + '.vg.json')
+    if os.path.exists(cached):
+        with open(cached, encoding='utf-8') as f:
+            return json.load(f)
+    match = _SCHEMA_VERSION.search(spec.get('$schema', ''))
+    try:
+        compiled = vl_convert.vegalite_to_vega(text, vl_version=match.group(1) if match else None)
+    except Exception as err:
+        # vl-convert appends a backtrace
+        raise RenderError(str(err).split('\n')[0])
+    if isinstance(compiled, str):
+        compiled = json.loads(compiled)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cached + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(compiled, f, separators=(',', ':'))
+    os.replace(cached + '.tmp', cached)
+    return compiled
+
+
+def _script_json(value):
+    return json.dumps(value, separators=(',', ':')).replace('</', '<\\/')
+
+
+def embed_call(div_id, script, cache_dir=CACHE_DIR):
+    """The bookVega.embed() call replacing an embed script, and whether it is Vega-Lite."""
+    spec, options = embed_arguments(script)
+    try:
+        spec, options = compile_spec(spec, cache_dir), dict(options, mode='vega')
+    except RenderError as err:
+        print('{}: left as Vega-Lite ({})'.format(div_id, err))
+        options = dict(options, mode='vega-lite')
+    call = '{}{}, {}, {});'.format(_EMBED_CALL, json.dumps(div_id), _script_json(spec), _script_json(options))
+    return call, options['mode'] == 'vega-lite'
+
+
+def has_charts(text):
+    return bool(_EMBED.search(text) or _INERT.search(text))
+
+
+def rewrite_charts(text, cache_dir=CACHE_DIR):
+    """Return text with lazy embed calls for its charts, the number of charts and
+    how many of them are left as Vega-Lite."""
+    charts = vega_lite = 0
+
+    def inert(div_id, script):
+        nonlocal charts, vega_lite
+        charts += 1
+        if script.lstrip().startswith(_EMBED_CALL):
+            # rewritten by an earlier run
+            vega_lite += '"mode":"vega-lite"' in script
+            return script
+        try:
+            call, needs = embed_call(div_id, script, cache_dir)
+        except RenderError as err:
+            # still runs as it is once hydrated, with the runtime from the CDN
+            print('{}: left as it was ({})'.format(div_id, err))
+            return script
+        vega_lite += needs
+        return call
+
+    text = _INERT.sub(lambda match: '<script type="text/plain" data-vega-hydrate="{}">{}</script>'.format(
+        match.group(1), inert(match.group(1), match.group(2))), text)
+    text = _EMBED.sub(lambda match: ('<div id="{0}" class="vega-lazy"></div>\n'
+                                     '<script type="text/plain" data-vega-hydrate="{0}">{1}</script>').format(
+        match.group(1), inert(match.group(1), match.group(2))), text)
+    return text, charts, vega_lite
+
+
+def _url(target, page_dir):
+    return posixpath.relpath(target, page_dir) if page_dir else target
+
+
+def add_runtime(text, page_dir, vendored, vega_lite):
+    """Add the runtime loader, ahead of vega_hydrate.js, to a chart page."""
+    text = re.sub(r'<script src="[^"]*{}"[^>]*></script>\n?'.format(re.escape(RUNTIME_JS)), '', text)
+    attrs = ''.join(' data-{}="{}"'.format(name, _url(target, page_dir))
+                    for name, target in vendored.items() if vega_lite or name != 'vega-lite')
+    runtime = '<script src="{}"{} defer></script>\n'.format(_url('_static/' + RUNTIME_JS, page_dir), attrs)
+    hydrate = '<script src="{}" defer></script>'.format(_url('_static/' + HYDRATE_JS, page_dir))
+    if hydrate in text:
+        return text.replace(hydrate, runtime + hydrate, 1)
+    return text.replace('</head>', runtime + hydrate + '\n</head>', 1)
+
+
+def process(html_dir, runtime_dir=RUNTIME_DIR, cache_dir=CACHE_DIR):
+    """Switch every chart page to the vendored runtime, return (pages, charts, compiled)."""
+    pages = []
+    for root, _, files in os.walk(html_dir):
+        rel_root = os.path.relpath(root, html_dir)
+        if rel_root.split(os.sep)[0] in ('_static', '_images', '_sources'):
+            continue
+        for filename in files:
+            if filename.endswith('.html'):
+                with open(os.path.join(root, filename), encoding='utf-8') as f:
+                    if has_charts(f.read()):
+                        pages.append((os.path.join(root, filename), '' if rel_root == '.' else rel_root))
+    if not pages:
+        return 0, 0, 0
+    vendored = vendor_runtime(html_dir, runtime_dir)
+    total = compiled = 0
+    for path, page_dir in pages:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        text, charts, vega_lite = rewrite_charts(text, cache_dir)
+        total += charts
+        compiled += charts - vega_lite
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(add_runtime(text, page_dir, vendored, vega_lite > 0))
+    for script in (RUNTIME_JS, HYDRATE_JS):
+        shutil.copyfile(os.path.join(HERE, script), os.path.join(html_dir, '_static', script))
+    return len(pages), total, compiled
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the Vega runtime of the chart pages from _static.')
+    parser.add_argument('html_dir', nargs='?', default=os.path.join(BOOK_DIR, '_build', 'html'))
+    parser.add_argument('--runtime-dir', default=RUNTIME_DIR,
+                        help='where the runtime files are kept, as <name>-<version>.js')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    pages, charts, compiled = process(args.html_dir, args.runtime_dir, args.cache_dir)
+    print('{} charts on {} pages use the vendored runtime, {} compiled to Vega'.format(charts, pages, compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for folder in ('DataViz', 'scripts'):
+    sys.path.insert(0, os.path.join(HERE, os.pardir, folder))
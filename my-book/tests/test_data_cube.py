@@ -0,0 +1,32 @@
+# The cube's top-n tables against top_species(), ties included.
+
+import json
+import os
+
+import pandas as pd
+
+from book_charts import top_species
+from data_cube import DataCube, write_cube
+
+
+def make_trees_small():
+    # in 2001 / N, species C and D tie for second place
+    rows = [(2001, 'N', 'A')] * 3 + [(2001, 'N', 'C')] * 2 + [(2001, 'N', 'D')] * 2 + [(2001, 'N', 'B')]
+    rows += [(2003, 'Y', 'A')] + [(2003, 'Y', 'B')] * 2
+    frame = pd.DataFrame(rows, columns=['year_planted', 'root_barrier', 'species_name'])
+    return frame.assign(longitude=-123.1, latitude=49.25)
+
+
+def test_top_keeps_ties_like_top_species():
+    trees = make_trees_small()
+    table = DataCube(trees).top('species_name', 2, count='species_count')
+    pd.testing.assert_frame_equal(table, top_species(trees, n=2))
+    assert list(table.loc[(2001, 'N'), 'species_name']) == ['A', 'C', 'D']
+
+
+def test_manifest_holds_the_top_rows(tmp_path):
+    url = write_cube(DataCube(make_trees_small()), top=('species_name', 2), data_dir=str(tmp_path), data_url='')
+    with open(os.path.join(str(tmp_path), url.lstrip('/'))) as f:
+        top = json.load(f)['top']
+    assert top['by'] == ['year_planted', 'root_barrier']
+    assert top['rows'] == {'[2001,"N"]': [['A', 3], ['C', 2], ['D', 2]], '[2003,"Y"]': [['B', 2], ['A', 1]]}
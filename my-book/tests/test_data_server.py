@@ -0,0 +1,109 @@
+# The query server and its Python client against a stand-in table, on an ephemeral port.
+
+import http.client
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_server import CLIENT_PATH, DataClient, DataServer, ResponseCache, decode_columns, encode_columns
+
+
+def make_trees_small():
+    return pd.DataFrame({
+        'year_planted': [2001, 2001, 2001, 2001, 2002, 2002],
+        'root_barrier': ['N', 'N', 'N', 'Y', 'N', 'Y'],
+        'species_name': ['A', 'A', 'B', None, 'C', 'A'],
+        'diameter': [1.5, np.nan, 3.0, 4.0, 5.5, 6.0],
+        'curb': [True, False, True, True, False, False],
+        'date_planted': pd.to_datetime(['2001-01-02', None, '2001-03-04', '2001-05-06', '2002-07-08', '2002-09-10']),
+    })
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / 'index.html').write_text('<html><head><title>book</title></head><body></body></html>')
+    with DataServer({'trees_small': make_trees_small()}, html_dir=str(tmp_path), cache_size=4) as server:
+        yield server
+
+
+def test_columns_round_trip():
+    trees = make_trees_small()
+    frame = decode_columns(encode_columns(trees))
+    assert list(frame.columns) == list(trees.columns)
+    assert frame['year_planted'].tolist() == trees['year_planted'].tolist()
+    assert frame['species_name'].astype(object).where(frame['species_name'].notna(), None).tolist() == \
+        trees['species_name'].tolist()
+    np.testing.assert_array_equal(frame['diameter'], trees['diameter'])
+    assert frame['curb'].tolist() == trees['curb'].tolist()
+    millis = (trees['date_planted'] - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    np.testing.assert_array_equal(frame['date_planted'], millis.where(trees['date_planted'].notna()))
+
+
+def test_filtered_rows(server):
+    client = DataClient(server.url)
+    frame = client.query('trees_small', year_planted=[2001], root_barrier=['N'], columns='diameter,curb')
+    assert list(frame.columns) == ['diameter', 'curb']
+    np.testing.assert_array_equal(frame['diameter'], [1.5, np.nan, 3.0])
+    assert client.query('trees_small', year_planted=[2001, 2002], curb=['true'])['diameter'].tolist() == [1.5, 3.0, 4.0]
+
+
+def test_top_keeps_ties(server):
+    frame = DataClient(server.url).query('trees_small', root_barrier=['N', 'Y'], groupby='species_name',
+                                         top=2, count='species_count')
+    # A leads, B and C tie for second place and are both kept
+    assert frame.to_dict('list') == {'species_name': ['A', 'B', 'C'], 'species_count': [3, 1, 1], 'rank': [1, 2, 2]}
+
+
+def test_errors(server):
+    client = DataClient(server.url)
+    with pytest.raises(ValueError, match='404'):
+        client.query('nope')
+    with pytest.raises(ValueError, match='400'):
+        client.query('trees_small', height=[1])
+
+
+def test_connection_is_reused(server):
+    client = DataClient(server.url)
+    for year in (2001, 2002, 2001, 2002):
+        client.query('trees_small', year_planted=[year])
+    assert client.requests == 4 and client.connections == 1
+    client.close()
+
+
+def test_etag_revalidation(server):
+    client = DataClient(server.url)
+    first = client.query('trees_small', year_planted=[2002])
+    etag = client._cache[next(iter(client._cache))][0]
+    # the same filter in another order is one cache entry and one etag
+    connection = http.client.HTTPConnection(server.httpd.server_address[0], server.httpd.server_address[1])
+    connection.request('GET', '/query?year_planted=2002&table=trees_small', headers={'If-None-Match': etag})
+    response = connection.getresponse()
+    assert response.status == 304 and response.read() == b'' and response.getheader('ETag') == etag
+    connection.close()
+    pd.testing.assert_frame_equal(client.query('trees_small', year_planted=[2002]), first)
+    assert server.cache.misses == 1 and server.cache.hits == 2
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache, computed = ResponseCache(size=2), []
+
+    def compute(key):
+        return lambda: computed.append(key) or key
+
+    for key in ('a', 'b', 'a', 'c', 'b', 'a'):
+        cache.get(key, compute(key))
+    # c pushed out b (a had just been used), then b pushed out a
+    assert computed == ['a', 'b', 'c', 'b', 'a']
+    assert (cache.hits, cache.misses) == (1, 5)
+
+
+def test_pages_get_the_client_script(server):
+    connection = http.client.HTTPConnection(server.httpd.server_address[0], server.httpd.server_address[1])
+    connection.request('GET', '/')
+    page = connection.getresponse().read().decode('utf-8')
+    assert page.startswith('<html><head><script src="{}"></script>'.format(CLIENT_PATH))
+    connection.request('GET', CLIENT_PATH)
+    response = connection.getresponse()
+    assert response.status == 200 and b'book-server:' in response.read()
+    connection.close()
@@ -0,0 +1,69 @@
+# Cache keys, stale outputs and cache reports of the notebook runner.
+
+import json
+import urllib.parse
+
+import pytest
+
+nbformat = pytest.importorskip('nbformat')
+pytest.importorskip('nbclient')
+
+import execute_notebooks  # noqa: E402
+
+
+def notebook(*sources):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell(source) for source in sources]
+    return nb
+
+
+def test_keys_follow_local_imports(tmp_path):
+    (tmp_path / 'charts.py').write_text('import helpers\n')
+    (tmp_path / 'helpers.py').write_text('SIZE = 1\n')
+    nb = notebook('import altair as alt\nfrom charts import *', 'x = 1')
+    before = execute_notebooks.cell_keys(nb, '', str(tmp_path))
+    assert before == execute_notebooks.cell_keys(nb, '', str(tmp_path))
+    # a module imported by an imported module changes every key from that cell on
+    (tmp_path / 'helpers.py').write_text('SIZE = 2\n')
+    after = execute_notebooks.cell_keys(nb, '', str(tmp_path))
+    assert before[0] != after[0] and before[1] != after[1]
+
+
+def test_keys_ignore_modules_a_cell_does_not_import(tmp_path):
+    (tmp_path / 'helpers.py').write_text('SIZE = 1\n')
+    nb = notebook('import pandas as pd', 'import helpers')
+    before = execute_notebooks.cell_keys(nb, '', str(tmp_path))
+    (tmp_path / 'helpers.py').write_text('SIZE = 2\n')
+    after = execute_notebooks.cell_keys(nb, '', str(tmp_path))
+    assert before[0] == after[0] and before[1] != after[1]
+
+
+def test_missing_data_files_follows_manifests(tmp_path):
+    manifest, array, rows = 'cube-' + 'a' * 20 + '.json', 'cube-' + 'b' * 20 + '.bin', 'trees-' + 'c' * 20 + '.json'
+    (tmp_path / manifest).write_text(json.dumps({'arrays': [{'url': array}]}))
+    (tmp_path / rows).write_text('[]')
+    name = 'book-cube:' + urllib.parse.urlencode([('manifest', '../_static/data/' + manifest)])
+    outputs = [{'output_type': 'display_data',
+                'data': {'application/json': {'data': [{'name': name}, {'url': '../_static/data/' + rows}]}}}]
+    assert execute_notebooks.missing_data_files(outputs, str(tmp_path)) == [array]
+    (tmp_path / array).write_bytes(b'\0')
+    assert execute_notebooks.missing_data_files(outputs, str(tmp_path)) == []
+
+
+def test_cached_cells_run_with_a_miss_are_not_hits(tmp_path):
+    pytest.importorskip('ipykernel')
+    path = str(tmp_path / 'small.ipynb')
+    nbformat.write(notebook('x = 1', 'y = x + 1'), path)
+    cache_dir = str(tmp_path / 'cache')
+
+    def report():
+        cells, _ = execute_notebooks.execute(path, cache_dir=cache_dir, timeout=60)
+        return [cell['cache'] for cell in cells]
+
+    assert report() == ['miss', 'miss']
+    assert report() == ['hit', 'hit']
+    nb = nbformat.read(path, as_version=4)
+    nb.cells[1].source = 'y = x + 2'
+    nbformat.write(nb, path)
+    # the kernel runs the whole notebook, the unchanged first cell included
+    assert report() == ['rerun', 'miss']
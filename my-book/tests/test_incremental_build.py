@@ -0,0 +1,55 @@
+# incremental_build.py on a three page book that jupyter-book built first.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('jupyter_book')
+
+import incremental_build  # noqa: E402
+
+BOOK = {
+    '_config.yml': 'title: Tiny\nexecute:\n  execute_notebooks: force\n',
+    '_toc.yml': 'format: jb-book\nroot: intro\nchapters:\n- file: a\n- file: b\n',
+    'intro.md': '# Intro\n\nThe book.\n',
+    'a.md': '# A\n\nPage a.\n',
+    'b.md': '# B\n\nPage b.\n',
+}
+
+
+def html_times(book):
+    html = os.path.join(book, '_build', 'html')
+    return {name: os.stat(os.path.join(html, name)).st_mtime_ns for name in ('intro.html', 'a.html', 'b.html')}
+
+
+def touch_later(path, seconds=5):
+    # sphinx compares source and doctree mtimes, keep them apart
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_one_page_change_rebuilds_only_that_page(tmp_path, capfd):
+    book = str(tmp_path)
+    for name, text in BOOK.items():
+        (tmp_path / name).write_text(text)
+    subprocess.run([sys.executable, '-c', 'from jupyter_book.cli.main import main; main()', 'build', '-q', book],
+                   check=True)
+    assert incremental_build.main([book]) == 0
+    capfd.readouterr()
+    before = html_times(book)
+
+    # a config change no page depends on, and one edited page
+    (tmp_path / '_config.yml').write_text(BOOK['_config.yml'] + '  timeout: 60\n')
+    (tmp_path / 'a.md').write_text('# A\n\nPage a, edited.\n')
+    touch_later(str(tmp_path / 'a.md'))
+    assert incremental_build.main([book]) == 0
+    out = capfd.readouterr().out
+
+    assert '1 of 3 pages to rebuild' in out
+    assert 'reading sources... [100%] a' in out and 'reading sources... [ 50%]' not in out
+    after = html_times(book)
+    # intro.html lists a in its toctree, sphinx writes it with a
+    assert after['a.html'] > before['a.html'] and after['b.html'] == before['b.html']
+    assert 'Page a, edited.' in (tmp_path / '_build' / 'html' / 'a.html').read_text()
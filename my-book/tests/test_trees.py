@@ -0,0 +1,82 @@
+# The Trees views against the pandas expressions the notebooks used to run.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trees import Trees
+
+NAMES = ['COMMON {}'.format(i) for i in range(12)]
+
+
+def make_trees_df(categorical):
+    # name i appears 12 - i times, so the top 10 has no ties
+    common = [name for i, name in enumerate(NAMES) for _ in range(len(NAMES) - i)]
+    n = len(common)
+    rng = np.random.default_rng(0)
+    planted = pd.Series(pd.to_datetime('1990-01-01') + pd.to_timedelta(rng.integers(0, 9000, n), unit='D'))
+    frame = pd.DataFrame({
+        'tree_id': np.arange(1, n + 1),
+        'common_name': common,
+        'species_name': ['SPECIES ' + name[-1] for name in common],
+        'date_planted': planted.where(rng.random(n) < 0.5),
+        'diameter': rng.gamma(2.0, 6.0, n),
+    })
+    if categorical:
+        frame = frame.astype({'common_name': 'category', 'species_name': 'category'})
+    return frame
+
+
+@pytest.fixture(params=[False, True], ids=['object', 'category'])
+def trees_df(request):
+    return make_trees_df(request.param)
+
+
+def original_top_common(trees_nan):
+    trees_common = (trees_nan.groupby("common_name").count().sort_values(by='tree_id', ascending=False
+                    ).reset_index().loc[0:9])
+    return trees_common["common_name"].tolist()
+
+
+def test_trees_small(trees_df):
+    expected = trees_df.dropna(subset=['date_planted'])
+    expected = expected.assign(year_planted=expected['date_planted'].dt.year)
+    pd.testing.assert_frame_equal(Trees(trees_df).trees_small, expected)
+
+
+def test_trees_nan(trees_df):
+    expected = trees_df.assign(date_record=trees_df.isna().loc[:, 'date_planted'])
+    pd.testing.assert_frame_equal(Trees(trees_df).trees_nan, expected)
+
+
+def test_top_common(trees_df):
+    trees = Trees(trees_df)
+    expected = original_top_common(trees.trees_nan)
+    assert trees.top_common() == expected
+    assert trees.top_common(10) == expected
+    assert trees.top_common(3) == expected[:3]
+    assert Trees(trees_df, n_common=5).top_common() == expected[:5]
+
+
+def test_trees_nan_small(trees_df):
+    trees = Trees(trees_df)
+    trees_nan = trees_df.assign(date_record=trees_df.isna().loc[:, 'date_planted'])
+    common_records = trees_nan.common_name.isin(original_top_common(trees_nan))
+    pd.testing.assert_frame_equal(trees.trees_nan_small, trees_nan[common_records])
+
+
+def test_views_are_memoized(trees_df):
+    trees = Trees(trees_df)
+    for name in ('trees_small', 'trees_nan', 'trees_nan_small'):
+        assert getattr(trees, name) is getattr(trees, name)
+    counts = trees._common_counts
+    trees.top_common()
+    trees.top_common(3)
+    assert trees._common_counts is counts
+
+
+def test_views_are_lazy(trees_df):
+    trees = Trees(trees_df)
+    trees.top_common()
+    assert 'trees_small' not in vars(trees)
+    assert 'trees_nan' not in vars(trees)
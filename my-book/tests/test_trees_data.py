@@ -0,0 +1,116 @@
+# load_trees() against a local stand-in for the GitHub raw file server.
+
+import http.server
+import threading
+
+import pandas as pd
+import pytest
+
+import trees_data
+
+CSV = (b'species_name,common_name,neighbourhood_name,root_barrier,street_side_name,date_planted,diameter\n'
+       b'ACER,MAPLE,KITSILANO,N,EVEN,1999-03-01,10.5\n'
+       b'PRUNUS,CHERRY,KITSILANO,Y,ODD,,3.0\n'
+       b'ACER,MAPLE,SUNSET,N,ODD,2005-11-20,7.25\n')
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """Serves `body` with an ETag, answering 304 to a matching If-None-Match."""
+
+    body = CSV
+    etag = ETAG
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type('Handler', (StandIn,), {'requests': []})
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, 'http://127.0.0.1:{}/trees.csv'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_first_load_parses_and_caches(server, tmp_path):
+    handler, url = server
+    trees = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    assert len(handler.requests) == 1
+    assert str(trees['species_name'].dtype) == 'category'
+    assert pd.api.types.is_datetime64_any_dtype(trees['date_planted'])
+    index = trees_data._read_index(str(tmp_path))
+    assert index[url]['etag'] == ETAG
+    assert index[url]['last_modified'] == LAST_MODIFIED
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_warm_load_does_not_touch_the_network(server, tmp_path):
+    handler, url = server
+    first = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    again = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    assert len(handler.requests) == 1
+    pd.testing.assert_frame_equal(first, again)
+
+
+def test_revalidate_not_modified(server, tmp_path):
+    handler, url = server
+    first = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    again = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False, revalidate=True)
+    assert len(handler.requests) == 2
+    assert handler.requests[1]['If-None-Match'] == ETAG
+    assert handler.requests[1]['If-Modified-Since'] == LAST_MODIFIED
+    pd.testing.assert_frame_equal(first, again)
+
+
+def test_revalidate_changed_file(server, tmp_path):
+    handler, url = server
+    trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    handler.body = CSV + b'ULMUS,ELM,SUNSET,Y,EVEN,2010-06-01,20.0\n'
+    handler.etag = '"v2"'
+    trees = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False, revalidate=True)
+    assert len(trees) == 4
+    assert trees_data._read_index(str(tmp_path))[url]['etag'] == '"v2"'
+
+
+def test_frozen_uses_the_cache_only(server, tmp_path):
+    handler, url = server
+    first = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=False)
+    again = trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=True, revalidate=True)
+    assert len(handler.requests) == 1
+    pd.testing.assert_frame_equal(first, again)
+
+
+def test_frozen_without_cache_raises(server, tmp_path):
+    handler, url = server
+    with pytest.raises(trees_data.TreesCacheError):
+        trees_data.load_trees(url, cache_dir=str(tmp_path), frozen=True)
+    assert not handler.requests
+
+
+def test_frozen_from_environment(server, tmp_path, monkeypatch):
+    handler, url = server
+    monkeypatch.setenv('TREES_FROZEN', '1')
+    with pytest.raises(trees_data.TreesCacheError):
+        trees_data.load_trees(url, cache_dir=str(tmp_path))
+    assert not handler.requests